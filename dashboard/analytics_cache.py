@@ -0,0 +1,83 @@
+"""
+Versioned cache for the sales analytics.
+
+Cached results embed the ``sales_analytics`` version token in their keys and
+the token is bumped whenever orders are paid or change status and when the
+rollup is rebuilt. Keys also carry the local date, as trailing windows move on
+at midnight.
+
+With a shared cache (``REDIS_URL``) a bump reaches every worker, so an entry
+is current for as long as it can be found and is kept for a day, by which
+time its key is out of use anyway. With the per-process local memory cache a
+bump only reaches the worker that made it; entries then expire after
+``versioning.max_age`` (``CACHE_LOCAL_MAX_AGE``, a minute), which bounds how
+stale another worker's figures can be.
+
+Bumps happen once the changing transaction has committed. Bumping inside it
+would let a concurrent request cache the old figures under the new version.
+
+Hits and misses are counted per cached endpoint in the default cache and
+reported by ``stats``; without a shared cache the counts are those of the
+worker answering.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from store.signals import order_paid, order_status_changed
+from store.versioning import get_version, bump_version, max_age, shared
+
+VERSION_NAME = 'sales_analytics'
+TIMEOUT = 24 * 3600
+NAMES = ('sales_analytics',)
+
+
+def cache_key(name, *parts):
+    return '_'.join([name, get_version(VERSION_NAME), timezone.localdate().isoformat(), *map(str, parts)])
+
+
+def _count(name, outcome):
+    key = f'analytics_cache:{name}:{outcome}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        # First count since the cache was cleared
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def lookup(name, key):
+    """The cached value or None, counting the hit or miss."""
+    value = cache.get(key)
+    _count(name, 'misses' if value is None else 'hits')
+    return value
+
+
+def save(key, value):
+    cache.set(key, value, max_age(TIMEOUT))
+
+
+def stats():
+    """Hits, misses and hit rate of every cached endpoint, the current version and whether the cache is shared."""
+    counts = cache.get_many([f'analytics_cache:{name}:{outcome}' for name in NAMES for outcome in ('hits', 'misses')])
+    result = {'version': get_version(VERSION_NAME), 'shared': shared()}
+    for name in NAMES:
+        hits = counts.get(f'analytics_cache:{name}:hits', 0)
+        misses = counts.get(f'analytics_cache:{name}:misses', 0)
+        result[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    return result
+
+
+def sales_changed():
+    """Invalidate every cached analytics result once the current transaction commits."""
+    transaction.on_commit(lambda: bump_version(VERSION_NAME))
+
+
+@receiver(order_paid)
+@receiver(order_status_changed)
+def orders_changed(sender, **kwargs):
+    sales_changed()
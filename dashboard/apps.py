@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 class DashboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'dashboard'
\ No newline at end of file
+    name = 'dashboard'
+
+    def ready(self):
+        # Connect the rollup and event counter receivers to the store signals
+        # and the ranking and sales cache invalidation to the data they cache
+        from . import analytics_cache, events, rollups, scoring  # noqa: F401
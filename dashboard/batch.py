@@ -0,0 +1,117 @@
+"""
+Batched dashboard requests.
+
+``POST /api/dashboard/batch/`` with
+
+    {"requests": [{"id": "sales", "path": "/api/dashboard/sales/", "params": {"days": 30}}, ...],
+     "concurrent": true}
+
+runs each sub-request against the dashboard views in-process and answers
+``{"responses": {"sales": {"status": 200, "body": {...}}, ...}}``. The batch is
+authenticated once; sub-requests carry its user and token through DRF's
+forced authentication, so there is no further token lookup. Each view still
+checks its own permissions and throttles.
+
+Only GETs of ``/api/dashboard/`` endpoints that answer with JSON can be
+batched: sub-requests run in any order, possibly at once, so nothing in a
+batch may depend on another part of it. With ``concurrent`` they run on up to
+``MAX_WORKERS`` threads, each with its own database connection.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+from django.db import connection
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework.response import Response
+
+PREFIX = '/api/dashboard/'
+MAX_REQUESTS = 20
+MAX_WORKERS = 4
+# URL names of the views that stream files
+FILE_ENDPOINTS = ('update-download', 'update-delta')
+NOT_JSON = 'Endpoint does not return JSON, request it directly'
+
+
+class BatchError(ValueError):
+    pass
+
+
+def parse(data):
+    """The (id, path, query string) of each sub-request; BatchError if malformed."""
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BatchError('requests must be a non-empty list')
+    if len(items) > MAX_REQUESTS:
+        raise BatchError(f'A batch can hold at most {MAX_REQUESTS} requests')
+
+    parsed = []
+    for n, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise BatchError(f'Request {n} needs a path')
+        if item.get('method', 'GET').upper() != 'GET':
+            raise BatchError(f'Request {n}: only GET requests can be batched')
+        params = item.get('params') or {}
+        if not isinstance(params, dict):
+            raise BatchError(f'Request {n}: params must be an object')
+        url = urlsplit(item['path'])
+        if not url.path.startswith(PREFIX) or url.path.startswith(PREFIX + 'batch/'):
+            raise BatchError(f'Request {n}: path must be a dashboard endpoint')
+        query = '&'.join(part for part in (url.query, urlencode(params, doseq=True)) if part)
+        parsed.append((str(item.get('id', n)), url.path, query))
+    if len({request_id for request_id, _, _ in parsed}) != len(parsed):
+        raise BatchError('Request ids must be unique')
+    return parsed
+
+
+def sub_request(request, path, query):
+    """A GET of ``path`` by the user already authenticated on ``request``."""
+    sub = HttpRequest()
+    sub.method = 'GET'
+    sub.path = sub.path_info = path
+    sub.META = {
+        key: value for key, value in request.META.items()
+        if key not in ('CONTENT_LENGTH', 'CONTENT_TYPE', 'HTTP_IF_NONE_MATCH', 'HTTP_RANGE')
+    }
+    sub.META.update({'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query})
+    sub.GET = QueryDict(query)
+    sub.user = request.user
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    return sub
+
+
+def run_one(request, path, query):
+    """(status, body) of one sub-request."""
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return 404, {'error': 'Not found'}
+    if match.url_name in FILE_ENDPOINTS:
+        # Never opened, so never left open: the batch would drop the file unread
+        return 400, {'error': NOT_JSON}
+    response = match.func(sub_request(request, path, query), *match.args, **match.kwargs)
+    if not isinstance(response, Response):
+        return 400, {'error': NOT_JSON}
+    return response.status_code, response.data
+
+
+def run_in_thread(request, path, query):
+    try:
+        return run_one(request, path, query)
+    finally:
+        # Threads open their own connection; don't leave it behind
+        connection.close()
+
+
+def run(request, items, concurrent=False):
+    """Responses of the parsed sub-requests, by id."""
+    if concurrent and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(items))) as pool:
+            futures = [pool.submit(run_in_thread, request, path, query) for _, path, query in items]
+            results = [future.result() for future in futures]
+    else:
+        results = [run_one(request, path, query) for _, path, query in items]
+    return {
+        request_id: {'status': code, 'body': body}
+        for (request_id, _, _), (code, body) in zip(items, results)
+    }
@@ -0,0 +1,154 @@
+"""
+Customer cohorts.
+
+Customers are grouped by the month of their first paid order. ``load`` streams
+(user, order time, amount) for every paid order of the customers whose first
+paid order falls in the window, in one query; the first order time comes from
+a window function, so older customers stay out even when their later orders
+fall in the window. ``cohort_matrices`` maps the order times to local months
+with one ``searchsorted`` against the month boundaries and builds the
+cohort x months-since-first-order matrices with NumPy grouping
+(``np.unique`` and ``np.bincount``):
+
+- ``customers``: cohort sizes
+- ``retention``: share of the cohort ordering in each month
+- ``revenue``: item revenue of the cohort in each month
+- ``repeat_purchase``: share of the cohort that has placed a second order by
+  each month
+
+Memory is bounded by the columns, about 20 bytes per order, which are filled
+chunk by chunk. ``cohort_analytics`` caches the result per computation date.
+"""
+from datetime import datetime
+import numpy as np
+from django.core.cache import cache
+from django.db.models import F, FloatField, Min, Window
+from django.db.models.functions import Cast
+from django.utils import timezone
+from store.models import Order
+
+CHUNK_SIZE = 20000
+
+
+def month_starts(first_month, count):
+    """
+    Local midnight of the first day of ``count`` consecutive months, the first
+    being ``(year, month)``, as aware datetimes.
+    """
+    year, month = first_month
+    starts = []
+    for _ in range(count):
+        starts.append(timezone.make_aware(datetime(year, month, 1)))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return starts
+
+
+def load(since):
+    """
+    Columns (user, order timestamp, amount) of the paid orders of customers
+    whose first paid order was placed at ``since`` or later.
+    """
+    orders = Order.objects.filter(paid=True, user__isnull=False).annotate(
+        first_order=Window(Min('created_at'), partition_by=[F('user_id')]),
+        amount=Cast('items_total', FloatField())
+    ).filter(first_order__gte=since).order_by()
+
+    users, timestamps, amounts = [], [], []
+    chunk = []
+    for row in orders.values_list('user_id', 'created_at', 'amount').iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            _append_chunk(chunk, users, timestamps, amounts)
+            chunk = []
+    _append_chunk(chunk, users, timestamps, amounts)
+    return np.concatenate(users), np.concatenate(timestamps), np.concatenate(amounts)
+
+
+def _append_chunk(chunk, users, timestamps, amounts):
+    # Convert each chunk to compact arrays so Python tuples never pile up
+    users.append(np.fromiter((row[0] for row in chunk), dtype=np.int32, count=len(chunk)))
+    timestamps.append(np.fromiter((row[1].timestamp() for row in chunk), dtype=np.float64, count=len(chunk)))
+    amounts.append(np.fromiter((row[2] for row in chunk), dtype=np.float64, count=len(chunk)))
+
+
+def cohort_matrices(users, timestamps, amounts, starts):
+    """
+    Cohort matrices (see the module docstring) as NumPy arrays, for one cohort
+    per month beginning at each of ``starts``.
+    """
+    cohorts = ages = len(starts)  # the oldest cohort can be this many months old
+    boundaries = np.array([start.timestamp() for start in starts])
+    month = np.searchsorted(boundaries, timestamps, side='right') - 1
+
+    # One row per customer; their cohort is the month of their first order
+    customer_ids, customer = np.unique(users, return_inverse=True)
+    customer_cohort = np.full(len(customer_ids), cohorts, dtype=np.int64)
+    np.minimum.at(customer_cohort, customer, month)
+    customers = np.bincount(customer_cohort, minlength=cohorts)
+    cohort = customer_cohort[customer]
+    age = month - cohort
+
+    # Customers active per (cohort, age): distinct (customer, age) pairs
+    active_pairs = np.unique(customer.astype(np.int64) * ages + age)
+    active_customer, active_age = np.divmod(active_pairs, ages)
+    active = np.bincount(
+        customer_cohort[active_customer] * ages + active_age, minlength=cohorts * ages
+    ).reshape(cohorts, ages)
+
+    revenue = np.bincount(cohort * ages + age, weights=amounts, minlength=cohorts * ages).reshape(cohorts, ages)
+
+    # Age of each customer's second order: sort orders by customer, then time
+    order = np.lexsort((timestamps, customer))
+    sorted_customer, sorted_age = customer[order], age[order]
+    firsts = np.searchsorted(sorted_customer, np.arange(len(customer_ids)))
+    repeaters = np.flatnonzero(np.bincount(customer, minlength=len(customer_ids)) >= 2)
+    second_age = sorted_age[firsts[repeaters] + 1]
+    seconds = np.bincount(
+        customer_cohort[repeaters] * ages + second_age, minlength=cohorts * ages
+    ).reshape(cohorts, ages)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retention = np.nan_to_num(active / customers[:, None])
+        repeat_purchase = np.nan_to_num(np.cumsum(seconds, axis=1) / customers[:, None])
+    return {
+        'customers': customers,
+        'retention': retention,
+        'revenue': revenue,
+        'repeat_purchase': repeat_purchase,
+    }
+
+
+def cohort_analytics(months=12):
+    """
+    Cohort matrices of the last ``months`` monthly cohorts, as lists. Row i
+    only has the ages cohort i has reached. Cached per computation date.
+    """
+    today = timezone.localdate()
+    cache_key = f'cohort_analytics_{months}_{today.isoformat()}'
+    result = cache.get(cache_key)
+    if result is not None:
+        return result
+
+    index = today.year * 12 + today.month - months
+    starts = month_starts((index // 12, index % 12 + 1), months)
+    users, timestamps, amounts = load(starts[0])
+    matrices = cohort_matrices(users, timestamps, amounts, starts)
+
+    def rows(matrix, digits):
+        return [
+            [round(float(value), digits) for value in row[:months - i]]
+            for i, row in enumerate(matrix)
+        ]
+
+    result = {
+        'computed_on': today.isoformat(),
+        'cohorts': [start.strftime('%Y-%m') for start in starts],
+        'customers': matrices['customers'].tolist(),
+        'orders': len(users),
+        'retention': rows(matrices['retention'], 4),
+        'revenue': rows(matrices['revenue'], 2),
+        'repeat_purchase': rows(matrices['repeat_purchase'], 4),
+    }
+    # Keep it for the rest of the day; tomorrow's key misses
+    cache.set(cache_key, result, 24 * 3600)
+    return result
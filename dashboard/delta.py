@@ -0,0 +1,164 @@
+"""
+rsync-style binary deltas.
+
+``make_delta`` cuts the source into ``BLOCK_SIZE`` blocks and indexes them
+by a weak checksum (rsync's two 16-bit running sums) and a strong hash. It
+then looks for those blocks at every offset of the target. The weak checksums
+of all target windows come out of a few NumPy cumulative sums rather than a
+byte-by-byte rolling loop; only windows whose weak checksum matches a source
+block are checked with the strong hash. Matched blocks become copy
+instructions and everything else is sent literally. The instructions are
+zlib-compressed.
+
+Both files are worked through ``SEGMENT_SIZE`` bytes at a time, so beyond the
+files themselves memory stays at a few dozen MiB whatever their size.
+
+``apply_delta`` rebuilds the target from the source and the delta, and
+checks the result against the size and SHA-256 recorded in the delta.
+
+This module has no Django imports, so the desktop client uses it as is.
+"""
+import hashlib
+import struct
+import zlib
+import numpy as np
+
+BLOCK_SIZE = 2048
+MAGIC = b'MDELTA1\n'
+SEGMENT_SIZE = 1 << 20  # bytes checksummed at once, bounds memory
+
+_TABLE_MASK = (1 << 24) - 1  # candidate lookup table, 16 MiB
+
+_HEADER = struct.Struct('>IQ32s')
+_COPY = struct.Struct('>II')
+_DATA = struct.Struct('>I')
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def weak_checksums(data, block_size):
+    """The weak checksum of every ``block_size`` window of ``data``, by start offset."""
+    x = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    if len(x) < block_size:
+        return np.zeros(0, dtype=np.int64)
+    sums = np.concatenate(([0], np.cumsum(x)))
+    weighted = np.concatenate(([0], np.cumsum(x * np.arange(len(x)))))
+    start = np.arange(len(x) - block_size + 1)
+    a = sums[block_size:] - sums[:-block_size]
+    # sum of (start + block_size - i) * x[i] over the window
+    b = (start + block_size) * a - (weighted[block_size:] - weighted[:-block_size])
+    return (a & 0xffff) | ((b & 0xffff) << 16)
+
+
+def block_checksums(data, block_size):
+    """The weak checksum of each whole ``block_size`` block of ``data``."""
+    blocks = len(data) // block_size
+    # Window weights as in weak_checksums: block_size for the first byte, 1 for the last
+    weights = np.arange(block_size, 0, -1, dtype=np.int64)
+    per_segment = max(SEGMENT_SIZE // block_size, 1)
+    checksums = []
+    for first in range(0, blocks, per_segment):
+        last = min(first + per_segment, blocks)
+        rows = np.frombuffer(data, dtype=np.uint8, count=(last - first) * block_size,
+                             offset=first * block_size).reshape(last - first, block_size).astype(np.int64)
+        a = rows.sum(axis=1)
+        b = rows @ weights
+        checksums.append((a & 0xffff) | ((b & 0xffff) << 16))
+    return np.concatenate(checksums) if checksums else np.zeros(0, dtype=np.int64)
+
+
+def _candidates(target, block_size, known):
+    """(offsets, checksums) of the target windows whose checksum is in ``known`` (sorted), a segment at a time."""
+    if not len(known):
+        return
+    table = np.zeros(_TABLE_MASK + 1, dtype=bool)
+    table[known & _TABLE_MASK] = True
+    for segment in range(0, max(len(target) - block_size + 1, 0), SEGMENT_SIZE):
+        weak = weak_checksums(target[segment:segment + SEGMENT_SIZE + block_size - 1], block_size)
+        # A lookup table on the low bits rules out nearly every window; the rest are searched for
+        maybe = np.flatnonzero(table[weak & _TABLE_MASK])
+        found = np.minimum(np.searchsorted(known, weak[maybe]), len(known) - 1)
+        hits = maybe[known[found] == weak[maybe]]
+        yield hits + segment, weak[hits]
+
+
+def _strong(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def make_delta(source, target, block_size=BLOCK_SIZE):
+    """A delta that turns ``source`` into ``target`` (both bytes)."""
+    index = {}
+    for number, weak in enumerate(block_checksums(source, block_size).tolist()):
+        index.setdefault(weak, []).append(number)
+    known = np.array(sorted(index), dtype=np.int64)
+
+    ops = []
+    strong = {}
+    literal_start = position = 0
+    for offsets, checksums in _candidates(target, block_size, known):
+        # Skip candidates inside a block matched in the previous segment
+        i = int(np.searchsorted(offsets, position, side='left'))
+        while i < len(offsets):
+            offset = int(offsets[i])
+            window = target[offset:offset + block_size]
+            digest = _strong(window)
+            for number in index[int(checksums[i])]:
+                if number not in strong:
+                    strong[number] = _strong(source[number * block_size:(number + 1) * block_size])
+                if strong[number] == digest:
+                    if literal_start < offset:
+                        ops.append(('data', target[literal_start:offset]))
+                    if ops and ops[-1][0] == 'copy' and sum(ops[-1][1:]) == number:
+                        ops[-1] = ('copy', ops[-1][1], ops[-1][2] + 1)
+                    else:
+                        ops.append(('copy', number, 1))
+                    position = literal_start = offset + block_size
+                    break
+            else:
+                position = offset + 1
+            # Next candidate past whatever was consumed
+            i = int(np.searchsorted(offsets, position, side='left')) if position > offset else i + 1
+    if literal_start < len(target):
+        ops.append(('data', target[literal_start:]))
+
+    body = [_HEADER.pack(block_size, len(target), hashlib.sha256(target).digest())]
+    for op in ops:
+        if op[0] == 'copy':
+            body.append(b'C' + _COPY.pack(op[1], op[2]))
+        else:
+            body.append(b'D' + _DATA.pack(len(op[1])) + op[1])
+    return MAGIC + zlib.compress(b''.join(body), 6)
+
+
+def apply_delta(source, delta):
+    """The target rebuilt from ``source`` and ``delta``; DeltaError if it doesn't verify."""
+    if not delta.startswith(MAGIC):
+        raise DeltaError('Not a delta')
+    try:
+        body = zlib.decompress(delta[len(MAGIC):])
+        block_size, size, sha256 = _HEADER.unpack_from(body)
+        position = _HEADER.size
+        parts = []
+        while position < len(body):
+            kind = body[position:position + 1]
+            position += 1
+            if kind == b'C':
+                start, count = _COPY.unpack_from(body, position)
+                position += _COPY.size
+                parts.append(source[start * block_size:(start + count) * block_size])
+            elif kind == b'D':
+                (length,) = _DATA.unpack_from(body, position)
+                position += _DATA.size
+                parts.append(body[position:position + length])
+                position += length
+            else:
+                raise DeltaError('Unknown instruction')
+    except (zlib.error, struct.error) as error:
+        raise DeltaError(f'Corrupt delta: {error}')
+    target = b''.join(parts)
+    if len(target) != size or hashlib.sha256(target).digest() != sha256:
+        raise DeltaError('Patched output does not match the target hash')
+    return target
@@ -0,0 +1,116 @@
+"""
+Update file downloads.
+
+``serve`` answers ``GET /api/dashboard/updates/<id>/download/`` with:
+
+- a strong ETag, the file's SHA-256, so ``If-None-Match`` revalidates with a
+  304 and no body;
+- single ``Range`` requests (``bytes=a-b``, ``bytes=a-``, ``bytes=-n``) as 206
+  partial content, honouring ``If-Range`` so a resumed download never splices
+  two versions of a file. Multi-range requests get the whole file.
+
+Bodies are ``FileResponse``s over the open file. Under a server with a
+sendfile-capable ``wsgi.file_wrapper`` (gunicorn) the kernel copies the bytes
+straight from the file, starting at the file position and limited by
+Content-Length, so ranges are zero-copy too; elsewhere ``RangeFile`` stops
+reading at the end of the range.
+"""
+import re
+from django.http import FileResponse, HttpResponse
+from django.utils.http import http_date, parse_etags
+from .uploads import file_sha256
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class RangeFile:
+    """A file opened at ``start`` that reads at most ``length`` bytes."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    (start, end) of a single byte range, end inclusive; None to serve the
+    whole file; ValueError if the range can't be satisfied.
+    """
+    match = _RANGE.fullmatch(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last ``last`` bytes
+        length = int(last)
+        if not length:
+            raise ValueError
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise ValueError
+    if end < start:
+        return None
+    return start, end
+
+
+def etag(update):
+    """The strong ETag of an update's file, hashing it first for rows that predate hashes."""
+    if not update.sha256:
+        with update.file.open('rb') as f:
+            update.sha256 = file_sha256(f)
+        type(update).objects.filter(pk=update.pk).update(sha256=update.sha256)
+    return f'"{update.sha256}"'
+
+
+def serve(request, update):
+    tag = etag(update)
+    headers = {
+        'ETag': tag,
+        'Accept-Ranges': 'bytes',
+        'Last-Modified': http_date(update.created_at.timestamp()),
+    }
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (if_none_match.strip() == '*' or tag in parse_etags(if_none_match)):
+        return HttpResponse(status=304, headers=headers)
+
+    size = update.file.size
+    requested = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if requested and if_range and if_range.strip() != tag:
+        # The client's partial copy is of another version: send it all
+        requested = None
+    try:
+        byte_range = parse_range(requested, size) if requested else None
+    except ValueError:
+        return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    file = update.file.storage.open(update.file.name, 'rb')
+    filename = update.file.name.rsplit('/', 1)[-1]
+    if byte_range is None:
+        response = FileResponse(file, as_attachment=True, filename=filename)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangeFile(file, start, end - start + 1), status=206,
+                                as_attachment=True, filename=filename)
+        response.headers['Content-Length'] = end - start + 1
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    for name, value in headers.items():
+        response.headers[name] = value
+    return response
@@ -0,0 +1,284 @@
+"""
+Buffered product event counters and event log.
+
+Product page views, cart additions and purchases arrive through the store
+signals at page-view rates, far too often for a database write each. They
+are counted in an in-process ``EventBuffer`` instead and written to
+``ProductAnalytics`` in one transaction when the buffer holds
+``ANALYTICS_FLUSH_SIZE`` events or the oldest one is ``ANALYTICS_FLUSH_SECONDS``
+old, whichever comes first. A flush adds the counts with ``F()`` expressions
+to the latest ``ProductAnalytics`` row of each product, grouping products
+with the same increments into one UPDATE, and creates rows for products that
+have none. The same flush appends every buffered event, searches included,
+to the ``AnalyticsEvent`` log with one batched insert, and folds the visitors
+of product pages into the day's ``ProductVisitorSketch`` of each product.
+
+The buffer lives in worker memory, so a crashed worker loses what it had not
+flushed yet: at most ``ANALYTICS_FLUSH_SIZE`` events, or the events of the
+last ``ANALYTICS_FLUSH_SECONDS`` seconds, per worker process. Workers flush
+on a clean exit. A flush that fails puts the events back; when the flush was
+triggered by an event it is logged rather than raised, so the page view or
+cart addition that triggered it still succeeds, and the next attempt waits
+another interval so a locked database doesn't stall every request. The
+interval is checked when an event arrives, so an idle worker holds its last
+events until the next one or until it exits. Counters are for trends, not
+accounting (``purchases`` counts units ordered); paid sales come from
+``dashboard.rollups``.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Max
+from django.dispatch import receiver
+from django.utils import timezone
+from store.models import Product
+from store.signals import product_viewed, product_added_to_cart, order_placed, products_searched
+from . import sketches
+from .models import AnalyticsEvent, ProductAnalytics, ProductVisitorSketch
+from .scoring import counters_changed
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('views', 'cart_additions', 'purchases')
+EVENT_TYPES = (AnalyticsEvent.VIEW, AnalyticsEvent.CART_ADD, AnalyticsEvent.PURCHASE)
+
+
+def local_day(moment, days):
+    """``timezone.localdate(moment)``, memoized per minute in ``days``."""
+    # Local dates change on whole minutes in every time zone
+    minute = moment.replace(second=0, microsecond=0)
+    if minute not in days:
+        days[minute] = timezone.localdate(minute)
+    return days[minute]
+
+
+class EventBuffer:
+    def __init__(self, size=None, interval=None):
+        self.size = size or getattr(settings, 'ANALYTICS_FLUSH_SIZE', 500)
+        self.interval = interval or getattr(settings, 'ANALYTICS_FLUSH_SECONDS', 5)
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counts = defaultdict(lambda: [0, 0, 0])
+        self.log = []
+        # (product_id, day) -> {register: rank} of the visitors seen
+        self.visitors = defaultdict(dict)
+        self.days = {}
+        self.oldest = None
+        self.database = None
+        self.retry_at = 0.0
+
+    @property
+    def pending(self):
+        return len(self.log)
+
+    def record(self, product_id, counter, amount=1, user_id=None, visitor=None):
+        """
+        Count ``amount`` events of ``counter`` (one of COUNTERS) for a product.
+        ``visitor`` (a user or session id) is added to the unique visitor sketch.
+        """
+        index = COUNTERS.index(counter)
+        if visitor is not None:
+            register, rank = sketches.hash_visitor(visitor)
+        with self.lock:
+            self.counts[product_id][index] += amount
+            due = self._log(EVENT_TYPES[index], product_id, user_id, amount, '')
+            if visitor is not None:
+                ranks = self.visitors[product_id, local_day(self.log[-1][0], self.days)]
+                if rank > ranks.get(register, 0):
+                    ranks[register] = rank
+        if due:
+            self._flush_from_event()
+
+    def record_search(self, query, user_id=None):
+        """Log a search; searches have no counter."""
+        with self.lock:
+            due = self._log(AnalyticsEvent.SEARCH, None, user_id, 1, query[:100])
+        if due:
+            self._flush_from_event()
+
+    def _log(self, *event):
+        # Called with the lock held; returns whether a flush is due
+        self.log.append((timezone.now(), *event))
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+            self.database = connection.settings_dict['NAME']
+        now = time.monotonic()
+        if now < self.retry_at:
+            return False
+        return len(self.log) >= self.size or now - self.oldest >= self.interval
+
+    def _flush_from_event(self):
+        # On the request path: keep the events for later rather than fail the request
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Flushing %d analytics events failed, retrying in %s s', self.pending, self.interval)
+            with self.lock:
+                self.retry_at = time.monotonic() + self.interval
+
+    def take(self):
+        """Empty the buffer and return the counts, log and visitors it held."""
+        with self.lock:
+            batch = self.counts, self.log, self.visitors
+            self._reset()
+        return batch
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of products touched."""
+        counts, log, visitors = self.take()
+        if not log:
+            return 0
+        try:
+            with transaction.atomic():
+                write_counts(counts)
+                write_log(log)
+                write_sketches(visitors)
+        except Exception:
+            # Put everything back so the next flush retries it
+            with self.lock:
+                for product_id, deltas in counts.items():
+                    for index, amount in enumerate(deltas):
+                        self.counts[product_id][index] += amount
+                self.log[:0] = log
+                for key, ranks in visitors.items():
+                    merged = self.visitors[key]
+                    for register, rank in ranks.items():
+                        merged[register] = max(rank, merged.get(register, 0))
+                if self.oldest is None:
+                    self.oldest = time.monotonic()
+                    self.database = connection.settings_dict['NAME']
+            raise
+        if counts:
+            counters_changed()
+        return len(counts)
+
+
+def write_counts(counts):
+    """
+    Add ``{product_id: [views, cart_additions, purchases]}`` to ProductAnalytics.
+    Runs inside the flush transaction.
+    """
+    if not counts:
+        return
+    latest = dict(
+        ProductAnalytics.objects.filter(product_id__in=counts).values('product_id').annotate(
+            latest=Max('id')
+        ).values_list('product_id', 'latest')
+    )
+    by_deltas = defaultdict(list)
+    for product_id, row_id in latest.items():
+        by_deltas[tuple(counts[product_id])].append(row_id)
+    for deltas, row_ids in by_deltas.items():
+        ProductAnalytics.objects.filter(id__in=row_ids).update(last_updated=timezone.now(), **{
+            counter: F(counter) + amount
+            for counter, amount in zip(COUNTERS, deltas) if amount
+        })
+    missing = [product_id for product_id in counts if product_id not in latest]
+    if missing:
+        # Products deleted since their events were recorded are dropped
+        ProductAnalytics.objects.bulk_create([
+            ProductAnalytics(product_id=product_id, **dict(zip(COUNTERS, counts[product_id])))
+            for product_id in Product.objects.filter(id__in=missing).values_list('id', flat=True)
+        ])
+
+
+LOG_COLUMNS = ('day', 'created_at', 'event_type', 'product_id', 'user_id', 'quantity', 'query')
+
+
+def write_log(log):
+    """
+    Append buffered ``(created_at, event_type, product_id, user_id, quantity, query)``
+    events with one ``executemany``. The log is insert-only and has no signals
+    to run, so this skips building a model instance per event.
+    """
+    ops = connection.ops
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        ops.quote_name(AnalyticsEvent._meta.db_table),
+        ', '.join(ops.quote_name(AnalyticsEvent._meta.get_field(name).column) for name in LOG_COLUMNS),
+        ', '.join(['%s'] * len(LOG_COLUMNS))
+    )
+    days = {}
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (
+                ops.adapt_datefield_value(local_day(created_at, days)),
+                ops.adapt_datetimefield_value(created_at),
+                event_type, product_id, user_id, quantity, query
+            )
+            for created_at, event_type, product_id, user_id, quantity, query in log
+        ])
+
+
+def write_sketches(visitors):
+    """Fold buffered ``{(product_id, day): {register: rank}}`` into the stored sketches."""
+    if not visitors:
+        return
+    stored = {
+        (sketch.product_id, sketch.day): sketch
+        for sketch in ProductVisitorSketch.objects.select_for_update().filter(
+            product_id__in={product_id for product_id, day in visitors},
+            day__in={day for product_id, day in visitors}
+        )
+    }
+    live = set(Product.objects.filter(
+        id__in={product_id for product_id, day in visitors if (product_id, day) not in stored}
+    ).values_list('id', flat=True))
+
+    changed, created = [], []
+    for (product_id, day), ranks in visitors.items():
+        sketch = stored.get((product_id, day))
+        if sketch is None and product_id not in live:
+            continue
+        registers = sketches.from_bytes(sketch.registers) if sketch else sketches.empty()
+        index = np.fromiter(ranks.keys(), dtype=np.intp, count=len(ranks))
+        registers[index] = np.maximum(registers[index], np.fromiter(ranks.values(), dtype=np.uint8, count=len(ranks)))
+        if sketch is None:
+            created.append(ProductVisitorSketch(product_id=product_id, day=day,
+                                                registers=sketches.to_bytes(registers)))
+        else:
+            sketch.registers = sketches.to_bytes(registers)
+            changed.append(sketch)
+    ProductVisitorSketch.objects.bulk_update(changed, ['registers'], batch_size=100)
+    ProductVisitorSketch.objects.bulk_create(created, batch_size=100)
+
+
+buffer = EventBuffer()
+
+
+@atexit.register
+def flush_at_exit():
+    # Counts recorded against another database (a test run's) stay there
+    if buffer.database != connection.settings_dict['NAME']:
+        return
+    try:
+        buffer.flush()
+    except DatabaseError:
+        pass
+
+
+@receiver(product_viewed)
+def count_view(sender, product_id, user_id=None, visitor=None, **kwargs):
+    buffer.record(product_id, 'views', user_id=user_id, visitor=visitor)
+
+
+@receiver(product_added_to_cart)
+def count_cart_addition(sender, product_id, user_id=None, quantity=1, **kwargs):
+    buffer.record(product_id, 'cart_additions', user_id=user_id)
+
+
+@receiver(order_placed)
+def count_purchases(sender, order, lines, **kwargs):
+    for product_id, quantity in lines:
+        buffer.record(product_id, 'purchases', quantity, user_id=order.user_id)
+
+
+@receiver(products_searched)
+def log_search(sender, query, user_id=None, **kwargs):
+    buffer.record_search(query, user_id=user_id)
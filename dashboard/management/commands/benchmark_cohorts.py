@@ -0,0 +1,85 @@
+import random
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from dashboard import cohorts
+from store.benchmarks import benchmark_database, Timer
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = ('Measure cohort analytics over a seeded order history: time to stream '
+            'the orders, time to build the matrices and peak traced memory.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000, help='Paid orders to seed')
+        parser.add_argument('--customers', type=int, default=100000, help='Customers placing them')
+        parser.add_argument('--months', type=int, default=24, help='Cohorts to compute')
+        parser.add_argument('--seed', type=int, default=1234, help='Random seed for the order history')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with benchmark_database():
+            with Timer() as seeding:
+                self.seed(rng, options['orders'], options['customers'], options['months'])
+            self.stdout.write(f"Seeded {options['orders']} orders of {options['customers']} customers "
+                              f'in {seeding.elapsed:.1f} s')
+
+            today = timezone.localdate()
+            index = today.year * 12 + today.month - options['months']
+            starts = cohorts.month_starts((index // 12, index % 12 + 1), options['months'])
+            with Timer() as loading:
+                columns = cohorts.load(starts[0])
+            with Timer() as computing:
+                cohorts.cohort_matrices(*columns, starts)
+            del columns
+
+            # Memory in a separate pass, tracing slows everything down
+            cache.clear()
+            tracemalloc.start()
+            try:
+                result = cohorts.cohort_analytics(options['months'])
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        self.stdout.write(f"  orders analysed: {result['orders']}")
+        self.stdout.write(f'  stream orders:   {loading.elapsed:.2f} s')
+        self.stdout.write(f'  build matrices:  {computing.elapsed:.2f} s')
+        self.stdout.write(f'  peak memory:     {peak / 2 ** 20:.1f} MiB '
+                          f"({peak / max(result['orders'], 1):.0f} bytes per order)")
+
+    def seed(self, rng, orders, customers, months):
+        users = User.objects.bulk_create(
+            (User(username=f'customer-{n}') for n in range(customers)), batch_size=2000
+        )
+        user_ids = [user.id for user in users]
+        now = timezone.now()
+        span = months * 30 * 24 * 3600
+        batch = []
+        for n in range(orders):
+            batch.append(Order(
+                user_id=rng.choice(user_ids),
+                paid=True,
+                items_total=Decimal(rng.randint(5, 500)),
+                item_count=1
+            ))
+            if len(batch) == 5000 or n == orders - 1:
+                created = Order.objects.bulk_create(batch, batch_size=5000)
+                # created_at is set on insert; spread the orders over the months
+                with connection.cursor() as cursor:
+                    cursor.executemany(
+                        f'UPDATE {Order._meta.db_table} SET created_at = %s WHERE id = %s',
+                        [
+                            (connection.ops.adapt_datetimefield_value(
+                                now - timedelta(seconds=rng.randrange(span))
+                            ), order.pk)
+                            for order in created
+                        ]
+                    )
+                batch = []
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from dashboard import events
+from store.benchmarks import benchmark_database, seed_catalog, measure, percentile, Timer
+from store.signals import product_viewed
+
+
+class Command(BaseCommand):
+    help = ('Measure what product event counting costs: buffering one event, '
+            'flushing a batch and the overhead on a product page view.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=100000, help='Events to buffer and flush')
+        parser.add_argument('--products', type=int, default=1000, help='Catalog size')
+        parser.add_argument('--iterations', type=int, default=300, help='Timed page views per run')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            products = seed_catalog(products=options['products'])
+            ids = [product.id for product in products]
+            n = options['events']
+
+            # Buffering only: a buffer that never flushes on its own
+            buffer = events.EventBuffer(size=n + 1, interval=10 ** 9)
+            with Timer() as record:
+                for i in range(n):
+                    buffer.record(ids[i % len(ids)], 'views')
+
+            with CaptureQueriesContext(connection) as ctx, Timer() as flush:
+                touched = buffer.flush()
+            flush_queries = len(ctx.captured_queries)
+
+            # The same events through the signal, as the views send them
+            events.buffer.take()
+            with Timer() as signal:
+                for i in range(n):
+                    product_viewed.send(sender=None, product_id=ids[i % len(ids)], user_id=None)
+            events.buffer.take()
+
+            # Time the counting receiver inside real page views
+            receiver_timings = []
+
+            def timed_count_view(**kwargs):
+                with Timer() as timer:
+                    events.count_view(**kwargs)
+                receiver_timings.append(timer.elapsed)
+
+            client = Client()
+            url = products[0].get_absolute_url()
+            product_viewed.disconnect(events.count_view)
+            product_viewed.connect(timed_count_view)
+            try:
+                page_view = measure(lambda: client.get(url), options['iterations'], alloc_iterations=0)
+            finally:
+                product_viewed.disconnect(timed_count_view)
+                product_viewed.connect(events.count_view)
+            events.buffer.take()
+
+        self.stdout.write(f'{n} events over {touched} products')
+        self.stdout.write(f'  record:            {record.elapsed / n * 1e6:.2f} us/event')
+        self.stdout.write(f'  signal + record:   {signal.elapsed / n * 1e6:.2f} us/event, '
+                          f'including a flush every {events.buffer.size} events')
+        self.stdout.write(f'  flush:             {flush.elapsed * 1000:.1f} ms, '
+                          f'{flush.elapsed / n * 1e6:.2f} us/event, {flush_queries} queries')
+        self.stdout.write(f"  page view:         {page_view['p50_ms'] * 1000:.0f} us p50")
+        self.stdout.write(f'  counting overhead: {percentile(receiver_timings, 50) * 1e6:.2f} us p50, '
+                          f'{percentile(receiver_timings, 99) * 1e6:.2f} us p99 per page view')
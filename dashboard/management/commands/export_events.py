@@ -0,0 +1,31 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from dashboard import eventlog
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date: {value} (expected YYYY-MM-DD)')
+
+
+class Command(BaseCommand):
+    help = ('Export the analytics event log for a range of days to memory-mapped '
+            'NumPy .npy columns (timestamp, event_type, product_id, user_id).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory to write the .npy files to')
+        parser.add_argument('--start', type=parse_date, help='First day, YYYY-MM-DD (default: 30 days ago)')
+        parser.add_argument('--end', type=parse_date, help='Last day, YYYY-MM-DD (default: today)')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        start = options['start'] or end - timedelta(days=29)
+        if start > end:
+            raise CommandError('--start must not be after --end')
+        count = eventlog.export(start, end, options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {count} events from {start} to {end} to {options['output']}"
+        ))
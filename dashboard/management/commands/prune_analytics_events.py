@@ -0,0 +1,18 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from dashboard import eventlog
+
+
+class Command(BaseCommand):
+    help = 'Drop the analytics event log of every day older than --keep-days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=365, help='Days of events to keep')
+
+    def handle(self, *args, **options):
+        if options['keep_days'] < 1:
+            raise CommandError('--keep-days must be at least 1')
+        before = timezone.localdate() - timedelta(days=options['keep_days'] - 1)
+        deleted = eventlog.drop_days(before)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} events from before {before}'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from dashboard.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recreate the daily sales rollup tables from all paid orders.'
+
+    def handle(self, *args, **options):
+        days, rows = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales rollup: {days} days, {rows} product rows'))
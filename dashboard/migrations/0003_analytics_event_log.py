@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0002_daily_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('created_at', models.DateTimeField()),
+                ('event_type', models.PositiveSmallIntegerField(choices=[(1, 'Product view'), (2, 'Cart addition'), (3, 'Search'), (4, 'Purchase')])),
+                ('product_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('user_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('query', models.CharField(blank=True, max_length=100)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'event_type'], name='dashboard_a_day_dc222e_idx')],
+            },
+        ),
+    ]
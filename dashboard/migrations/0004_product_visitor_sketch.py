@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0003_analytics_event_log'),
+        ('store', '0009_order_item_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('registers', models.BinaryField(max_length=4096)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='dashboard_p_day_505304_idx')],
+                'unique_together': {('product', 'day')},
+            },
+        ),
+    ]
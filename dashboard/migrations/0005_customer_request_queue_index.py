@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_product_visitor_sketch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerrequest',
+            index=models.Index(fields=['status', 'created_at'], name='dashboard_c_status_d0110a_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0006_update_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpdateDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='updates/deltas/')),
+                ('size', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deltas_from', to='dashboard.update')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deltas', to='dashboard.update')),
+            ],
+            options={
+                'unique_together': {('source', 'target')},
+            },
+        ),
+    ]
@@ -1,6 +1,7 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
-from store.models import Product, Order
+from store.models import Product, Order, Category
 
 class ProductAnalytics(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -38,6 +39,14 @@ class CustomerRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Requests still waiting for staff
+    OPEN_STATUSES = ('pending', 'processing')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
     def __str__(self):
         return f'{self.request_type} - {self.subject}'
 
@@ -53,9 +62,134 @@ class Update(models.Model):
     description = models.TextField()
     file = models.FileField(upload_to='updates/')
     version = models.CharField(max_length=50)
+    # Hex SHA-256 of the file, computed while it was received
+    sha256 = models.CharField(max_length=64, blank=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
     def __str__(self):
-        return f'{self.update_type} - {self.title} (v{self.version})'
\ No newline at end of file
+        return f'{self.update_type} - {self.title} (v{self.version})'
+
+class UpdateUpload(models.Model):
+    """
+    An update file being uploaded in chunks (see dashboard.uploads); becomes an
+    ``Update`` once complete.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    title = models.CharField(max_length=200)
+    update_type = models.CharField(max_length=20, choices=Update.UPDATE_TYPES)
+    description = models.TextField()
+    version = models.CharField(max_length=50)
+    filename = models.CharField(max_length=200)
+    size = models.PositiveBigIntegerField()
+    # Bytes received so far; the next chunk must start here
+    received = models.PositiveBigIntegerField(default=0)
+    # Hex SHA-256 the client expects, checked on completion when given
+    sha256 = models.CharField(max_length=64, blank=True)
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size} bytes)'
+
+class UpdateDelta(models.Model):
+    """
+    A binary patch turning ``source``'s file into ``target``'s (see
+    dashboard.delta), built when ``target`` was uploaded.
+    """
+    source = models.ForeignKey(Update, on_delete=models.CASCADE, related_name='deltas_from')
+    target = models.ForeignKey(Update, on_delete=models.CASCADE, related_name='deltas')
+    file = models.FileField(upload_to='updates/deltas/')
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('source', 'target')
+
+    def __str__(self):
+        return f'{self.target} from v{self.source.version}'
+
+class DailySales(models.Model):
+    """Paid sales per day, maintained by dashboard.rollups."""
+    date = models.DateField(unique=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name_plural = 'Daily Sales'
+
+    def __str__(self):
+        return f'Sales on {self.date}'
+
+class DailyProductSales(models.Model):
+    """Paid sales per day and product, maintained by dashboard.rollups."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ('date', 'product', 'category')
+        indexes = [
+            models.Index(fields=['date', 'category']),
+        ]
+        verbose_name_plural = 'Daily Product Sales'
+
+    def __str__(self):
+        return f'Sales of {self.product_id} on {self.date}'
+
+class AnalyticsEvent(models.Model):
+    """
+    Append-only log of storefront events, written in batches by
+    dashboard.events. ``day`` partitions the log: exports read whole days and
+    old days are dropped with a single delete. Product and user ids are plain
+    integers so the log outlives the rows it refers to.
+    """
+    VIEW = 1
+    CART_ADD = 2
+    SEARCH = 3
+    PURCHASE = 4
+    EVENT_TYPES = (
+        (VIEW, 'Product view'),
+        (CART_ADD, 'Cart addition'),
+        (SEARCH, 'Search'),
+        (PURCHASE, 'Purchase'),
+    )
+
+    day = models.DateField()
+    created_at = models.DateTimeField()
+    event_type = models.PositiveSmallIntegerField(choices=EVENT_TYPES)
+    product_id = models.PositiveIntegerField(null=True, blank=True)
+    user_id = models.PositiveIntegerField(null=True, blank=True)
+    quantity = models.PositiveIntegerField(default=1)
+    query = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day', 'event_type']),
+        ]
+
+    def __str__(self):
+        return f'{self.get_event_type_display()} on {self.day}'
+
+class ProductVisitorSketch(models.Model):
+    """Unique visitors of a product on a day as a HyperLogLog sketch, see dashboard.sketches."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    day = models.DateField()
+    registers = models.BinaryField(max_length=4096)
+
+    class Meta:
+        unique_together = ('product', 'day')
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self):
+        return f'Visitors of {self.product_id} on {self.day}'
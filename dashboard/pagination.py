@@ -0,0 +1,21 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Newest orders first. The cursor encodes the last ``created_at`` seen, so
+    every page is an indexed range scan however deep the client pages, and
+    orders placed meanwhile don't shift the pages.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class RequestQueuePagination(CursorPagination):
+    """Oldest customer requests first, the order the queue is worked in."""
+    ordering = ('created_at', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
@@ -0,0 +1,93 @@
+"""
+Delta packages between update versions.
+
+When an ``Update`` is stored, ``build`` diffs its file against the previous
+update with the same title or, failing that, the same update type, and keeps
+the delta (see dashboard.delta) as an ``UpdateDelta``. Before it is stored
+the delta is applied to the previous file and the result checked against the
+new file's SHA-256, so a delta that is served always patches correctly.
+Deltas that wouldn't save at least ``MIN_SAVING`` of the download are not kept.
+
+Diffing reads both files into memory and takes a while (about 15 seconds and
+130 MiB on top of the files for two of ``MAX_FILE_SIZE``), so the upload views
+call ``build_later``: the delta is built on a background thread once the new
+update is committed, one delta at a time per worker. Until it is there the
+client is sent to the full download.
+
+A client on version v asks ``GET /api/dashboard/updates/<id>/delta/?from_version=v``
+and falls back to the full download when there is no delta.
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from .delta import apply_delta, make_delta
+from .models import Update, UpdateDelta
+
+MAX_FILE_SIZE = 256 * 1024 * 1024  # both files are diffed in memory
+MIN_SAVING = 0.1
+
+logger = logging.getLogger(__name__)
+
+# A single thread, so a worker never holds more than one pair of files in memory
+builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='update-delta')
+
+
+def previous(update):
+    """The update ``update`` supersedes: the latest earlier one of the same title, else type."""
+    earlier = Update.objects.exclude(pk=update.pk).filter(created_at__lte=update.created_at)
+    for match in ({'title': update.title}, {'update_type': update.update_type}):
+        source = earlier.filter(**match).order_by('-created_at', '-id').first()
+        if source is not None:
+            return source
+    return None
+
+
+def build(update):
+    """Store the delta from the previous version to ``update``; returns it or None."""
+    source = previous(update)
+    if source is None or source.version == update.version:
+        return None
+    if max(source.file.size, update.file.size) > MAX_FILE_SIZE:
+        return None
+
+    with source.file.open('rb') as f:
+        old = f.read()
+    with update.file.open('rb') as f:
+        new = f.read()
+    delta = make_delta(old, new)
+    if len(delta) > len(new) * (1 - MIN_SAVING):
+        return None
+    # Never store a delta that doesn't reproduce the new file
+    if hashlib.sha256(apply_delta(old, delta)).hexdigest() != hashlib.sha256(new).hexdigest():
+        return None
+
+    return UpdateDelta.objects.create(
+        source=source,
+        target=update,
+        file=ContentFile(delta, name=f'{update.pk}-from-{source.pk}.delta'),
+        size=len(delta)
+    )
+
+
+def build_in_thread(update_id):
+    try:
+        update = Update.objects.filter(pk=update_id).first()
+        if update is not None:
+            build(update)
+    except Exception:
+        logger.exception('Building the delta for update %s failed', update_id)
+    finally:
+        # The thread keeps its own connection; don't leave it behind
+        connection.close()
+
+
+def build_later(update):
+    """Build the delta to ``update`` in the background once the current transaction commits."""
+    transaction.on_commit(lambda: builder.submit(build_in_thread, update.pk))
+
+
+def find(update, from_version):
+    """The stored delta from ``from_version`` to ``update``, or None."""
+    return UpdateDelta.objects.filter(target=update, source__version=from_version).select_related('source').first()
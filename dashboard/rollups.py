@@ -0,0 +1,260 @@
+"""
+Daily sales rollup.
+
+``DailySales`` (per day) and ``DailyProductSales`` (per day, product and
+category) hold revenue, units and order counts of paid orders, bucketed by the
+day the order was placed. Orders are folded in incrementally when they are
+marked paid (``store.signals.order_paid``) and ``rebuild()`` recreates both
+tables from scratch. The analytics endpoints read only these tables, so their
+cost depends on the number of days asked for, not on the number of orders.
+
+``sales_timeseries`` also answers from the rollup, except for hourly buckets
+and category filters: the rollup has no hours, and per-product order counts
+cannot be added up into exact per-category counts. Those fall back to a single
+grouped query over the order items.
+
+``sales_summary`` computes several trailing windows at once: every figure is
+a conditional sum per window over the rows of the widest window.
+"""
+import heapq
+from datetime import datetime, time, timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Q, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+from django.dispatch import receiver
+from store.models import OrderItem
+from store.signals import order_paid
+from . import analytics_cache
+from .models import DailySales, DailyProductSales
+
+REVENUE = Sum(F('price') * F('quantity'))
+
+
+def _grouped(items):
+    """Per (date, product, category) figures for ``items``."""
+    return items.annotate(
+        date=TruncDate('order__created_at')
+    ).values(
+        'date', 'product_id', 'product__category_id'
+    ).annotate(
+        revenue=REVENUE,
+        units=Sum('quantity'),
+        orders=Count('order_id', distinct=True)
+    )
+
+
+def _daily(items):
+    """Per date figures for ``items``."""
+    return items.annotate(
+        date=TruncDate('order__created_at')
+    ).values('date').annotate(
+        revenue=REVENUE,
+        units=Sum('quantity'),
+        orders=Count('order_id', distinct=True)
+    )
+
+
+def _increment(model, lookup, deltas):
+    changes = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Created concurrently, add to it instead
+        model.objects.filter(**lookup).update(**changes)
+
+
+def add_orders(order_ids):
+    """Fold newly paid orders into the rollup tables."""
+    items = OrderItem.objects.filter(order_id__in=order_ids)
+    with transaction.atomic():
+        for row in _grouped(items):
+            _increment(DailyProductSales, {
+                'date': row['date'],
+                'product_id': row['product_id'],
+                'category_id': row['product__category_id'],
+            }, {
+                'revenue': row['revenue'],
+                'units': row['units'],
+                'orders': row['orders'],
+            })
+        for row in _daily(items):
+            _increment(DailySales, {'date': row['date']}, {
+                'revenue': row['revenue'],
+                'units': row['units'],
+                'orders': row['orders'],
+            })
+
+
+def rebuild():
+    """Recreate both rollup tables from every paid order."""
+    items = OrderItem.objects.filter(order__paid=True)
+    with transaction.atomic():
+        DailyProductSales.objects.all().delete()
+        DailySales.objects.all().delete()
+        DailyProductSales.objects.bulk_create(
+            (
+                DailyProductSales(
+                    date=row['date'],
+                    product_id=row['product_id'],
+                    category_id=row['product__category_id'],
+                    revenue=row['revenue'],
+                    units=row['units'],
+                    orders=row['orders']
+                )
+                for row in _grouped(items).order_by().iterator()
+            ),
+            batch_size=1000
+        )
+        DailySales.objects.bulk_create(
+            (
+                DailySales(date=row['date'], revenue=row['revenue'], units=row['units'], orders=row['orders'])
+                for row in _daily(items).order_by().iterator()
+            ),
+            batch_size=1000
+        )
+        analytics_cache.sales_changed()
+    return DailySales.objects.count(), DailyProductSales.objects.count()
+
+
+def sales_summary(windows, top=5):
+    """
+    Totals, sales by category and top products of the last ``days`` days for
+    every ``days`` in ``windows``, in three queries however many windows are
+    asked for. Returns a dict keyed by window.
+    """
+    today = timezone.localdate()
+    starts = {days: today - timedelta(days=days - 1) for days in windows}
+    product_sales = DailyProductSales.objects.filter(date__gte=min(starts.values()))
+
+    def per_window(field):
+        return {
+            f'{field}_{days}': Sum(field, filter=Q(date__gte=start))
+            for days, start in starts.items()
+        }
+
+    totals = DailySales.objects.filter(date__gte=min(starts.values())).aggregate(
+        **per_window('revenue'), **per_window('orders')
+    )
+    categories = list(product_sales.values('category__name').annotate(
+        **per_window('revenue')
+    ).order_by('category__name'))
+    products = list(product_sales.values('product__name').annotate(
+        **per_window('revenue'), **per_window('units')
+    ).order_by())
+
+    summary = {}
+    for days in starts:
+        revenue, units = f'revenue_{days}', f'units_{days}'
+        sold = [row for row in products if row[units]]
+        summary[days] = {
+            'total_sales': totals[revenue] or 0,
+            'orders_count': totals[f'orders_{days}'] or 0,
+            'sales_by_category': {
+                row['category__name']: row[revenue]
+                for row in categories if row[revenue] is not None
+            },
+            'top_products': [
+                {'name': row['product__name'], 'sales': row[units], 'revenue': row[revenue]}
+                for row in heapq.nlargest(top, sold, key=lambda row: row[revenue])
+            ],
+        }
+    return summary
+
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+
+
+def _bucket_start(value, granularity):
+    if granularity == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'week':
+        return value - timedelta(days=value.weekday())
+    if granularity == 'month':
+        return value.replace(day=1)
+    return value
+
+
+def _next_bucket(value, granularity):
+    if granularity == 'hour':
+        return value + timedelta(hours=1)
+    if granularity == 'day':
+        return value + timedelta(days=1)
+    if granularity == 'week':
+        return value + timedelta(weeks=1)
+    return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _series_rows(granularity, since, category_id, product_id):
+    """One grouped query returning (bucket, revenue, units, orders) rows."""
+    if granularity == 'hour' or category_id is not None:
+        if granularity != 'hour':
+            since = timezone.make_aware(datetime.combine(since, time.min))
+        items = OrderItem.objects.filter(order__paid=True, order__created_at__gte=since)
+        if category_id is not None:
+            items = items.filter(product__category_id=category_id)
+        if product_id is not None:
+            items = items.filter(product_id=product_id)
+        output_field = None if granularity == 'hour' else DateField()
+        return items.annotate(
+            bucket=Trunc('order__created_at', granularity, output_field=output_field)
+        ).values('bucket').annotate(
+            revenue=REVENUE,
+            units=Sum('quantity'),
+            orders=Count('order_id', distinct=True)
+        ).order_by().values_list('bucket', 'revenue', 'units', 'orders')
+
+    if product_id is not None:
+        rows = DailyProductSales.objects.filter(product_id=product_id)
+    else:
+        rows = DailySales.objects.all()
+    return rows.filter(date__gte=since).annotate(
+        bucket=Trunc('date', granularity, output_field=DateField())
+    ).values('bucket').annotate(
+        total_revenue=Sum('revenue'),
+        total_units=Sum('units'),
+        total_orders=Sum('orders')
+    ).order_by().values_list('bucket', 'total_revenue', 'total_units', 'total_orders')
+
+
+def sales_timeseries(granularity, days, category_id=None, product_id=None):
+    """
+    Revenue, units and orders of the last ``days`` days per bucket, as
+    parallel arrays with empty buckets filled with zeros.
+    """
+    if granularity == 'hour':
+        end = _bucket_start(timezone.localtime(), 'hour')
+        since = first = end - timedelta(hours=days * 24 - 1)
+    else:
+        end = timezone.localdate()
+        since = end - timedelta(days=days - 1)
+        first = _bucket_start(since, granularity)
+
+    found = {
+        bucket: (revenue, units, orders)
+        for bucket, revenue, units, orders in _series_rows(granularity, since, category_id, product_id)
+    }
+
+    series = {'buckets': [], 'revenue': [], 'units': [], 'orders': []}
+    bucket = first
+    while bucket <= end:
+        revenue, units, orders = found.get(bucket, (0, 0, 0))
+        series['buckets'].append(bucket.isoformat())
+        series['revenue'].append(round(float(revenue or 0), 2))
+        series['units'].append(units or 0)
+        series['orders'].append(orders or 0)
+        bucket = _next_bucket(bucket, granularity)
+    return {
+        'granularity': granularity,
+        'start': since.isoformat(),
+        'end': end.isoformat(),
+        **series,
+    }
+
+
+@receiver(order_paid)
+def orders_paid(sender, order_ids, **kwargs):
+    add_orders(order_ids)
@@ -0,0 +1,117 @@
+"""
+Product performance scoring.
+
+``load`` reads the latest ``ProductAnalytics`` counters of every product into
+NumPy arrays with one query, and ``score`` computes conversion rate, cart
+ratio and the weighted performance score for all of them at once. The
+serializer scores single rows with the same function, so the ranking and the
+per-row figures agree.
+
+``ranking`` results are cached under the ``product_analytics`` version,
+which counter flushes and analytics edits bump. Without a shared cache other
+workers don't see the bump, so results are kept for ``versioning.max_age``.
+"""
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from store.models import Product
+from store.versioning import get_version, bump_version, max_age
+from .models import ProductAnalytics
+
+VERSION_NAME = 'product_analytics'
+
+CONVERSION_WEIGHT = 0.4
+VIEWS_WEIGHT = 0.3
+CART_WEIGHT = 0.3
+EXCELLENT_CONVERSION = 20  # percent
+EXCELLENT_VIEWS = 1000
+EXCELLENT_CART_RATIO = 50  # percent
+
+
+def _percent(part, whole):
+    part = np.asarray(part, dtype=float)
+    whole = np.asarray(whole, dtype=float)
+    return np.divide(part * 100, whole, out=np.zeros(np.broadcast(part, whole).shape), where=whole > 0)
+
+
+def score(views, cart_additions, purchases):
+    """
+    Conversion rate, cart ratio (both in percent) and performance score (0 to
+    100) for arrays of counters; scalars work too.
+    """
+    conversion = _percent(purchases, views)
+    cart_ratio = _percent(cart_additions, views)
+    total = (
+        np.minimum(conversion / EXCELLENT_CONVERSION * 100, 100) * CONVERSION_WEIGHT +
+        np.minimum(np.asarray(views, dtype=float) / EXCELLENT_VIEWS * 100, 100) * VIEWS_WEIGHT +
+        np.minimum(cart_ratio / EXCELLENT_CART_RATIO * 100, 100) * CART_WEIGHT
+    )
+    return conversion, cart_ratio, total
+
+
+def load():
+    """The latest counters of every product as (product_ids, views, cart_additions, purchases)."""
+    latest = ProductAnalytics.objects.values('product_id').annotate(latest=Max('id')).values('latest')
+    rows = ProductAnalytics.objects.filter(id__in=latest).values_list(
+        'product_id', 'views', 'cart_additions', 'purchases'
+    )
+    counters = np.array(list(rows), dtype=np.int64).reshape(-1, 4)
+    return counters[:, 0], counters[:, 1], counters[:, 2], counters[:, 3]
+
+
+def ranking(top=10):
+    """The ``top`` best scoring products and the score distribution."""
+    cache_key = f'analytics_ranking_{get_version(VERSION_NAME)}_{top}'
+    result = cache.get(cache_key)
+    if result is not None:
+        return result
+
+    product_ids, views, cart_additions, purchases = load()
+    conversion, cart_ratio, scores = score(views, cart_additions, purchases)
+
+    count = len(scores)
+    if count > top:
+        # Only the top entries need sorting
+        best = np.argpartition(-scores, top - 1)[:top]
+    else:
+        best = np.arange(count)
+    best = best[np.lexsort((product_ids[best], -scores[best]))]
+    ranks = np.sort(scores)
+    names = dict(Product.objects.filter(id__in=product_ids[best].tolist()).values_list('id', 'name'))
+
+    result = {
+        'count': count,
+        'percentiles': {
+            f'p{pct}': round(float(np.percentile(scores, pct)), 1) if count else 0
+            for pct in (25, 50, 75, 90, 99)
+        },
+        'top': [
+            {
+                'product': int(product_ids[i]),
+                'product_name': names.get(int(product_ids[i])),
+                'views': int(views[i]),
+                'cart_additions': int(cart_additions[i]),
+                'purchases': int(purchases[i]),
+                'conversion_rate': round(float(conversion[i]), 2),
+                'cart_ratio': round(float(cart_ratio[i]), 2),
+                'performance_score': round(float(scores[i]), 1),
+                # Share of products scoring at most as well as this one
+                'percentile': round(float(np.searchsorted(ranks, scores[i], side='right')) / count * 100, 1),
+            }
+            for i in best
+        ],
+    }
+    cache.set(cache_key, result, max_age(3600))
+    return result
+
+
+def counters_changed():
+    bump_version(VERSION_NAME)
+
+
+@receiver(post_save, sender=ProductAnalytics)
+@receiver(post_delete, sender=ProductAnalytics)
+def analytics_changed(sender, **kwargs):
+    counters_changed()
@@ -1,11 +1,54 @@
-from rest_framework import serializers
+import os
+import re
+from rest_framework import permissions, serializers
 from django.contrib.auth.models import User
-from .models import ProductAnalytics, CustomerRequest, Update
+from . import scoring
+from .models import ProductAnalytics, CustomerRequest, Update, UpdateUpload
 from store.models import Product, Order, OrderItem, Category
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from datetime import datetime
 
-class ProductAnalyticsSerializer(serializers.ModelSerializer):
+def requested_names(value):
+    """Names in a comma separated query parameter."""
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+def selected_fields(serializer_class, query_params):
+    """
+    Fields of ``serializer_class`` to render for ``?fields=`` and ``?expand=``.
+    Fields listed in ``Meta.expandable_fields`` are only rendered when
+    expanded; ``?fields=`` keeps just the fields it names.
+    """
+    meta = serializer_class.Meta
+    expandable = set(getattr(meta, 'expandable_fields', ()))
+    expand = set(requested_names(query_params.get('expand'))) & expandable
+    requested = set(requested_names(query_params.get('fields')))
+    return [
+        name for name in meta.fields
+        if name in expand or (name not in expandable and (not requested or name in requested))
+    ]
+
+class SparseFieldsMixin:
+    """
+    Drops the fields a read request didn't select (see ``selected_fields``),
+    so unrequested method fields are never computed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+        selected = set(selected_fields(type(self), request.query_params))
+        for name in list(self.fields):
+            if name not in selected:
+                self.fields.pop(name)
+
+def conversion_rate(views, purchases):
+    if not views:
+        return 0
+    return round((purchases / views) * 100, 2)
+
+class ProductAnalyticsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     category = serializers.CharField(source='product.category.name', read_only=True)
     conversion_rate = serializers.SerializerMethodField()
@@ -19,22 +62,23 @@ class ProductAnalyticsSerializer(serializers.ModelSerializer):
                  'trend', 'performance_score', 'last_updated']
     
     def get_conversion_rate(self, obj):
-        if obj.views == 0:
-            return 0
-        return round((obj.purchases / obj.views) * 100, 2)
+        return conversion_rate(obj.views, obj.purchases)
 
     def get_trend(self, obj):
-        # Compare with previous period
-        previous_analytics = ProductAnalytics.objects.filter(
-            product=obj.product,
-            last_updated__lt=obj.last_updated
-        ).order_by('-last_updated').first()
-
-        if not previous_analytics:
+        # Compare with previous period, annotated by ProductAnalyticsViewSet
+        if hasattr(obj, 'previous_views'):
+            previous = (obj.previous_views, obj.previous_purchases)
+        else:
+            previous = ProductAnalytics.objects.filter(
+                product_id=obj.product_id,
+                last_updated__lt=obj.last_updated
+            ).order_by('-last_updated').values_list('views', 'purchases').first()
+
+        if not previous or previous[0] is None:
             return 'stable'
 
         current_rate = self.get_conversion_rate(obj)
-        previous_rate = self.get_conversion_rate(previous_analytics)
+        previous_rate = conversion_rate(*previous)
         
         if current_rate > previous_rate * 1.05:  # 5% improvement
             return 'increasing'
@@ -43,21 +87,9 @@ class ProductAnalyticsSerializer(serializers.ModelSerializer):
         return 'stable'
 
     def get_performance_score(self, obj):
-        # Calculate performance score based on multiple metrics
-        conversion_weight = 0.4
-        views_weight = 0.3
-        cart_weight = 0.3
-        
-        conversion_score = min((self.get_conversion_rate(obj) / 20) * 100, 100)  # Normalize to 100
-        views_score = min((obj.views / 1000) * 100, 100)  # Assume 1000 views is excellent
-        cart_ratio = (obj.cart_additions / obj.views * 100) if obj.views > 0 else 0
-        cart_score = min(cart_ratio * 2, 100)  # Normalize to 100
-        
-        total_score = (conversion_score * conversion_weight +
-                      views_score * views_weight +
-                      cart_score * cart_weight)
-        
-        return round(total_score, 1)
+        # Same weights and normalization as the ranking endpoint
+        _, _, total_score = scoring.score(obj.views, obj.cart_additions, obj.purchases)
+        return round(float(total_score), 1)
 
     def validate(self, data):
         if data.get('purchases', 0) > data.get('cart_additions', 0):
@@ -66,7 +98,7 @@ class ProductAnalyticsSerializer(serializers.ModelSerializer):
             )
         return data
 
-class CustomerRequestSerializer(serializers.ModelSerializer):
+class CustomerRequestSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     user_email = serializers.EmailField(source='user.email', read_only=True)
     response_time = serializers.SerializerMethodField()
@@ -83,17 +115,36 @@ class CustomerRequestSerializer(serializers.ModelSerializer):
             return round(delta.total_seconds() / 3600, 1)  # hours
         return None
 
-class UpdateSerializer(serializers.ModelSerializer):
+class UpdateSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     uploaded_by_username = serializers.CharField(source='uploaded_by.username', 
                                                read_only=True)
     
     class Meta:
         model = Update
         fields = ['id', 'title', 'update_type', 'description', 'file', 
-                 'version', 'uploaded_by', 'uploaded_by_username', 
+                 'version', 'sha256', 'uploaded_by', 'uploaded_by_username', 
                  'created_at', 'is_active']
+        read_only_fields = ['sha256']
 
-class AdminUserSerializer(serializers.ModelSerializer):
+class UpdateUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UpdateUpload
+        fields = ['id', 'title', 'update_type', 'description', 'version', 'filename',
+                 'size', 'received', 'sha256', 'created_at', 'updated_at']
+        read_only_fields = ['received']
+
+    def validate_sha256(self, value):
+        if value and not re.fullmatch(r'[0-9a-fA-F]{64}', value):
+            raise serializers.ValidationError("Expected 64 hex digits")
+        return value.lower()
+
+    def validate_filename(self, value):
+        name = os.path.basename(value.replace('\\', '/'))
+        if not name:
+            raise serializers.ValidationError("A file name is required")
+        return name
+
+class AdminUserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     
     class Meta:
@@ -112,9 +163,9 @@ class AdminUserSerializer(serializers.ModelSerializer):
         return user
 
 class SalesAnalyticsSerializer(serializers.Serializer):
-    total_sales = serializers.DecimalField(max_digits=10, decimal_places=2)
+    total_sales = serializers.DecimalField(max_digits=14, decimal_places=2)
     orders_count = serializers.IntegerField()
-    average_order_value = serializers.DecimalField(max_digits=10, decimal_places=2)
+    average_order_value = serializers.DecimalField(max_digits=14, decimal_places=2)
     period = serializers.CharField()
     sales_by_category = serializers.DictField()
     top_products = serializers.ListField()
@@ -124,12 +175,12 @@ class SalesAnalyticsSerializer(serializers.Serializer):
             raise serializers.ValidationError("Total sales cannot be negative")
         return value
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name', 'slug', 'description', 'image']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     stock = serializers.IntegerField(validators=[MinValueValidator(0)])
     sales_count = serializers.IntegerField(read_only=True)
@@ -152,22 +203,30 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'product', 'product_name', 'price', 'quantity']
 
-class OrderSerializer(serializers.ModelSerializer):
-    order_items = OrderItemSerializer(many=True, read_only=True)
-    user_email = serializers.EmailField(source='user.email', read_only=True)
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True, read_only=True)
+    user_email = serializers.EmailField(source='user.email', read_only=True, default=None)
     user_name = serializers.SerializerMethodField()
-    total_cost = serializers.DecimalField(max_digits=10, decimal_places=2, 
+    total_cost = serializers.DecimalField(source='items_total', max_digits=10, decimal_places=2,
                                         read_only=True)
     status = serializers.SerializerMethodField()
+    fulfilment_status = serializers.CharField(source='status', read_only=True)
     days_since_order = serializers.SerializerMethodField()
     
     class Meta:
         model = Order
-        fields = ['id', 'user', 'user_email', 'user_name', 'created', 'updated', 
-                 'paid', 'order_items', 'total_cost', 'status', 'days_since_order']
+        fields = ['id', 'user', 'user_email', 'user_name', 'created_at', 'updated_at', 
+                 'paid', 'items', 'total_cost', 'status', 'fulfilment_status',
+                 'days_since_order']
+        # Paying goes through mark_as_paid, which rolls the order up into the sales tables
+        read_only_fields = ['paid']
+        expandable_fields = ['items']
     
     def get_user_name(self, obj):
-        return f"{obj.user.first_name} {obj.user.last_name}".strip() or obj.user.username
+        user = obj.user
+        if user is None:
+            return None
+        return f"{user.first_name} {user.last_name}".strip() or user.username
 
     def get_status(self, obj):
         if obj.paid:
@@ -175,5 +234,5 @@ class OrderSerializer(serializers.ModelSerializer):
         return "Pending Payment"
 
     def get_days_since_order(self, obj):
-        delta = timezone.now() - obj.created
-        return delta.days
\ No newline at end of file
+        delta = timezone.now() - obj.created_at
+        return delta.days
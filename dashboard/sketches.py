@@ -0,0 +1,92 @@
+"""
+HyperLogLog sketches for counting unique visitors.
+
+A sketch has ``REGISTERS`` (4096) one-byte registers and is stored as a
+4096-byte blob however many visitors it has seen. Each visitor id hashes to
+one register and a rank (the position of the first set bit in the rest of the
+hash); the register keeps the highest rank it has seen. Adding the same
+visitor twice changes nothing, and the union of two sketches is their
+register-wise maximum, so per-day sketches merge into any window.
+
+Error bounds: the relative standard error of an estimate is
+1.04 / sqrt(4096), about 1.6%; roughly 95% of estimates fall within 3.3% of
+the true count and 99% within 4.9%. Below 10240 visitors (2.5 registers per
+visitor) the estimate switches to linear counting, which is close to exact
+for small counts.
+
+``dashboard.events`` folds visitors of product pages into one sketch per
+product and day (``ProductVisitorSketch``); ``unique_visitors`` merges them
+for a window.
+"""
+import hashlib
+from itertools import groupby
+from operator import itemgetter
+import numpy as np
+from .models import ProductVisitorSketch
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+SIZE = REGISTERS  # bytes, one per register
+STANDARD_ERROR = 1.04 / REGISTERS ** 0.5
+
+_RANK_BITS = 64 - PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def hash_visitor(visitor):
+    """The register index and rank of a visitor id."""
+    h = int.from_bytes(hashlib.blake2b(str(visitor).encode(), digest_size=8).digest(), 'big')
+    rest = h & ((1 << _RANK_BITS) - 1)
+    return h >> _RANK_BITS, _RANK_BITS - rest.bit_length() + 1
+
+
+def empty():
+    return np.zeros(REGISTERS, dtype=np.uint8)
+
+
+def from_bytes(blob):
+    return np.frombuffer(bytes(blob), dtype=np.uint8).copy()
+
+
+def to_bytes(registers):
+    return registers.astype(np.uint8).tobytes()
+
+
+def estimate(registers):
+    """
+    Estimated distinct count of one sketch (1-D registers) or of each row of
+    a 2-D array of sketches.
+    """
+    registers = np.asarray(registers, dtype=np.float64)
+    raw = _ALPHA * REGISTERS ** 2 / np.sum(np.exp2(-registers), axis=-1)
+    zeros = np.sum(registers == 0, axis=-1)
+    linear = REGISTERS * np.log(REGISTERS / np.maximum(zeros, 1))
+    small = (raw <= 2.5 * REGISTERS) & (zeros > 0)
+    result = np.rint(np.where(small, linear, raw)).astype(np.int64)
+    return int(result) if result.ndim == 0 else result
+
+
+def unique_visitors(start, product_id=None):
+    """
+    Estimated unique visitors since ``start`` per product and over all of
+    them, merging the stored daily sketches. Returns (total, {product_id: count}).
+
+    Rows are streamed in product order and folded as they arrive, so only the
+    current product's sketch and the overall one are held in memory.
+    """
+    rows = ProductVisitorSketch.objects.filter(day__gte=start)
+    if product_id is not None:
+        rows = rows.filter(product_id=product_id)
+    rows = rows.order_by('product_id').values_list('product_id', 'registers').iterator(chunk_size=500)
+
+    overall = empty()
+    counts = {}
+    for row_product, group in groupby(rows, key=itemgetter(0)):
+        merged = empty()
+        for _, blob in group:
+            np.maximum(merged, np.frombuffer(bytes(blob), dtype=np.uint8), out=merged)
+        counts[row_product] = estimate(merged)
+        np.maximum(overall, merged, out=overall)
+    if not counts:
+        return 0, {}
+    return estimate(overall), counts
@@ -0,0 +1,146 @@
+"""
+Bulk stock updates for the warehouse sync.
+
+The body is read line by line, never whole: either CSV with a header naming
+a ``stock`` column and an ``id`` or ``slug`` column, or newline-delimited
+JSON objects such as ``{"id": 12, "stock": 40}`` or
+``{"slug": "usb-c-dock", "stock": 40}``. ``apply`` validates the rows as they
+stream in and writes them ``CHUNK_SIZE`` at a time, each chunk in its own
+transaction with a ``bulk_update`` of the products whose stock actually
+changes (``store.inventory.set_stock_levels``). Invalid rows, unknown
+products and slugs shared by several products are reported by line number and
+don't stop the others; within a chunk the last row for a product wins.
+"""
+import csv
+import json
+import re
+import time
+from store import inventory
+from store.models import Product
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+CSV = 'text/csv'
+NDJSON = ('application/x-ndjson', 'application/jsonl', 'application/json')
+
+_WHOLE_NUMBER = re.compile(r'\s*-?\d+\s*')
+
+
+class RowError(ValueError):
+    pass
+
+
+def _whole_number(value, name):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and _WHOLE_NUMBER.fullmatch(value):
+        return int(value)
+    raise RowError(f'{name} must be a whole number')
+
+
+def validate(product_id, slug, stock):
+    """The product key, ('id', id) or ('slug', slug), and stock of a row."""
+    if stock is None or stock == '':
+        raise RowError('stock is required')
+    stock = _whole_number(stock, 'stock')
+    if stock < 0:
+        raise RowError('stock cannot be negative')
+    if product_id not in (None, ''):
+        return ('id', _whole_number(product_id, 'id')), stock
+    if slug:
+        return ('slug', str(slug).strip()), stock
+    raise RowError('id or slug is required')
+
+
+def parse_csv(lines):
+    """(line number, row) pairs; a row is (key, stock) or the RowError."""
+    reader = csv.DictReader(lines)
+    columns = set(reader.fieldnames or ())
+    if 'stock' not in columns or not columns & {'id', 'slug'}:
+        raise ValueError('CSV needs a stock column and an id or slug column')
+    for row in reader:
+        try:
+            yield reader.line_num, validate(row.get('id'), row.get('slug'), row.get('stock'))
+        except RowError as error:
+            yield reader.line_num, error
+
+
+def parse_ndjson(lines):
+    """(line number, row) pairs; a row is (key, stock) or the RowError."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, RowError('invalid JSON')
+            continue
+        if not isinstance(row, dict):
+            yield number, RowError('expected a JSON object')
+            continue
+        try:
+            yield number, validate(row.get('id'), row.get('slug'), row.get('stock'))
+        except RowError as error:
+            yield number, error
+
+
+def parse(lines, content_type):
+    """Rows of a body in ``content_type``; ValueError if it isn't supported."""
+    if content_type == CSV:
+        return parse_csv(lines)
+    if content_type in NDJSON:
+        return parse_ndjson(lines)
+    raise ValueError('Send text/csv or application/x-ndjson')
+
+
+def apply(rows):
+    """Write the stock levels of ``rows`` in chunks; returns the report."""
+    started = time.perf_counter()
+    report = {'rows': 0, 'updated': 0, 'unchanged': 0, 'failed': 0, 'errors': []}
+
+    def fail(line, message):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'error': message})
+
+    def write(chunk):
+        ids = {key for (field, key), stock in (row for line, row in chunk) if field == 'id'}
+        slugs = {key for (field, key), stock in (row for line, row in chunk) if field == 'slug'}
+        known = {('id', pk): pk for pk in Product.objects.filter(id__in=ids).values_list('id', flat=True)}
+        # Slugs aren't unique; a slug naming several products can't say which one
+        ambiguous = set()
+        for slug, pk in Product.objects.filter(slug__in=slugs).values_list('slug', 'id'):
+            if ('slug', slug) in known:
+                ambiguous.add(('slug', slug))
+            known[('slug', slug)] = pk
+        levels = {}
+        for line, (key, stock) in chunk:
+            if key in ambiguous:
+                fail(line, f'slug {key[1]} matches several products, use the id')
+            elif key in known:
+                levels[known[key]] = stock
+            else:
+                fail(line, f'unknown product {key[1]}')
+        if levels:
+            changed = inventory.set_stock_levels(levels)
+            report['updated'] += changed
+            report['unchanged'] += len(levels) - changed
+
+    chunk = []
+    for line, row in rows:
+        report['rows'] += 1
+        if isinstance(row, RowError):
+            fail(line, str(row))
+            continue
+        chunk.append((line, row))
+        if len(chunk) == CHUNK_SIZE:
+            write(chunk)
+            chunk = []
+    if chunk:
+        write(chunk)
+
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['rows'] / elapsed) if elapsed else 0
+    return report
@@ -0,0 +1,1043 @@
+import hashlib
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+import numpy as np
+import requests
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.test import Client, LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from store.models import Category, Product, Order, OrderItem, StockReservation
+from store.benchmarks import session_cart
+from store import search_stats
+from store.orders import mark_orders_paid, place_order, transition_orders
+from . import analytics_cache, batch, downloads, eventlog, events, patches, rollups, scoring, sketches, stock_sync, uploads
+from .delta import DeltaError, apply_delta, block_checksums, make_delta, weak_checksums
+from .models import (AnalyticsEvent, CustomerRequest, DailySales, DailyProductSales, ProductAnalytics,
+                     ProductVisitorSketch, Update, UpdateDelta, UpdateUpload)
+from .serializers import ProductAnalyticsSerializer
+
+
+class DashboardTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        events.buffer.take()
+        self.admin = User.objects.create_user('admin', 'admin@example.com', 'admin-pass', is_staff=True)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+        self.laptops = Category.objects.create(name='Laptops', slug='laptops')
+        self.audio = Category.objects.create(name='Audio', slug='audio')
+        self.laptop = Product.objects.create(category=self.laptops, name='Laptop', slug='laptop',
+                                             price=Decimal('900.00'), stock=50)
+        self.headset = Product.objects.create(category=self.audio, name='Headset', slug='headset',
+                                              price=Decimal('50.00'), stock=50)
+
+    def create_order(self, lines, days_ago=0, paid=True):
+        """``lines`` is a list of (product, quantity); returns the order."""
+        order = Order.objects.create(user=self.admin)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, price=product.price, quantity=quantity)
+            for product, quantity in lines
+        )
+        order.update_totals()
+        if days_ago:
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        if paid:
+            mark_orders_paid([order.pk])
+        return order
+
+
+class SalesRollupTests(DashboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_order([(self.laptop, 1), (self.headset, 2)])
+        self.create_order([(self.headset, 3)], days_ago=3)
+        self.create_order([(self.laptop, 2)], days_ago=40)
+        self.create_order([(self.laptop, 5)], paid=False)
+
+    def test_paid_orders_are_rolled_up(self):
+        today = DailySales.objects.get(date=timezone.localdate())
+        self.assertEqual((today.revenue, today.units, today.orders), (Decimal('1000.00'), 3, 1))
+        headset = DailyProductSales.objects.filter(product=self.headset).order_by('date')
+        self.assertEqual([row.units for row in headset], [3, 2])
+
+    def test_marking_paid_twice_counts_once(self):
+        order = Order.objects.filter(paid=True).first()
+        self.assertEqual(mark_orders_paid([order.pk]), [])
+        self.assertEqual(DailySales.objects.aggregate(n=Sum('orders'))['n'], 3)
+
+    def test_rebuild_matches_incremental_rollup(self):
+        def snapshot():
+            return sorted(DailyProductSales.objects.values_list('date', 'product_id', 'revenue', 'units', 'orders'))
+        incremental = snapshot()
+        rollups.rebuild()
+        self.assertEqual(snapshot(), incremental)
+
+    def test_sales_analytics_multiplies_quantity(self):
+        response = self.api.get('/api/dashboard/sales/', {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['total_sales']), Decimal('1150.00'))
+        self.assertEqual(response.data['orders_count'], 2)
+        self.assertEqual(response.data['sales_by_category'], {'Audio': Decimal('250.00'), 'Laptops': Decimal('900.00')})
+        self.assertEqual(response.data['top_products'][0], {'name': 'Laptop', 'sales': 1, 'revenue': Decimal('900.00')})
+
+    def test_sales_analytics_reads_only_the_rollup(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.get('/api/dashboard/sales/', {'days': 365})
+        self.assertEqual(Decimal(response.data['total_sales']), Decimal('2950.00'))
+        for query in ctx.captured_queries:
+            self.assertNotIn('store_order', query['sql'])
+
+    def test_sales_analytics_rejects_bad_windows(self):
+        self.assertEqual(self.api.get('/api/dashboard/sales/', {'days': 0}).status_code, 400)
+        self.assertEqual(self.api.get('/api/dashboard/sales/', {'days': 'week'}).status_code, 400)
+
+
+class SalesCacheTests(DashboardTestCase):
+    url = '/api/dashboard/sales/'
+
+    def total(self):
+        return Decimal(self.api.get(self.url, {'days': 7}).data['total_sales'])
+
+    def test_hits_until_orders_are_paid(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_order([(self.headset, 1)])
+        self.assertEqual(self.total(), Decimal('50.00'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.total(), Decimal('50.00'))
+        self.assertFalse([query for query in queries.captured_queries if 'dashboard_' in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_order([(self.laptop, 1)])
+        self.assertEqual(self.total(), Decimal('950.00'))
+        stats = self.api.get('/api/dashboard/cache/').data['sales_analytics']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_status_changes_and_rebuilds_invalidate(self):
+        order = self.create_order([(self.headset, 1)], paid=False)
+        self.total()
+        for change in (lambda: transition_orders([order.pk], 'cancelled'), rollups.rebuild):
+            version = analytics_cache.cache_key('sales_analytics')
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertNotEqual(analytics_cache.cache_key('sales_analytics'), version)
+
+    def test_no_bump_before_commit(self):
+        version = analytics_cache.cache_key('sales_analytics')
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.create_order([(self.headset, 1)])
+        self.assertEqual(analytics_cache.cache_key('sales_analytics'), version)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_entries_age_out_without_a_shared_cache(self):
+        # A bump made by another worker never reaches this process's cache
+        with mock.patch.object(cache, 'set') as cache_set:
+            analytics_cache.save('key', 'value')
+        self.assertEqual(cache_set.call_args.args[2], 60)
+        self.assertFalse(self.api.get('/api/dashboard/cache/').data['shared'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            with mock.patch.object(cache, 'set') as cache_set:
+                analytics_cache.save('key', 'value')
+        self.assertEqual(cache_set.call_args.args[2], analytics_cache.TIMEOUT)
+
+
+class SalesWindowsTests(DashboardTestCase):
+    url = '/api/dashboard/sales/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_order([(self.laptop, 1), (self.headset, 2)])
+        self.create_order([(self.headset, 4)], days_ago=5)
+        self.create_order([(self.laptop, 2), (self.headset, 1)], days_ago=20)
+        self.create_order([(self.headset, 10)], days_ago=60)
+        self.create_order([(self.laptop, 3)], days_ago=200)
+
+    def test_windows_match_separate_queries(self):
+        data = self.api.get(self.url, {'windows': '7,30,90'}).data['windows']
+        self.assertEqual(list(data), ['7', '30', '90'])
+        for days in (7, 30, 90):
+            start = timezone.localdate() - timedelta(days=days - 1)
+            items = OrderItem.objects.filter(order__paid=True, order__created_at__date__gte=start)
+            revenue = sum(item.price * item.quantity for item in items)
+            orders = items.values('order_id').distinct().count()
+            self.assertEqual(Decimal(data[str(days)]['total_sales']), revenue)
+            self.assertEqual(data[str(days)]['orders_count'], orders)
+            cache.clear()
+            self.assertEqual(self.api.get(self.url, {'days': days}).data, data[str(days)])
+
+    def test_windows_only_list_what_sold(self):
+        data = self.api.get(self.url, {'windows': '1,7'}).data['windows']
+        self.assertEqual(data['1']['sales_by_category'], {'Audio': Decimal('100.00'), 'Laptops': Decimal('900.00')})
+        self.assertEqual([p['sales'] for p in data['7']['top_products']], [1, 6])
+
+    def test_query_count_does_not_grow_with_windows(self):
+        with self.assertNumQueries(3):
+            self.api.get(self.url, {'windows': '7'})
+        with self.assertNumQueries(3):
+            self.api.get(self.url, {'windows': '1,7,30,90,180,365'})
+
+    def test_invalid_windows(self):
+        self.assertEqual(self.api.get(self.url, {'windows': '7,month'}).status_code, 400)
+        self.assertEqual(self.api.get(self.url, {'windows': '7,400'}).status_code, 400)
+        self.assertEqual(self.api.get(self.url, {'windows': '1,2,3,4,5,6,7'}).status_code, 400)
+
+
+class ProductAnalyticsListTests(DashboardTestCase):
+    url = '/api/dashboard/analytics/'
+
+    def add_rows(self, product, *figures):
+        """One ProductAnalytics row per (views, purchases), oldest first."""
+        for age, (views, purchases) in zip(range(len(figures), 0, -1), figures):
+            row = ProductAnalytics.objects.create(product=product, views=views, cart_additions=purchases,
+                                                  purchases=purchases)
+            ProductAnalytics.objects.filter(pk=row.pk).update(last_updated=timezone.now() - timedelta(days=age))
+
+    def test_trend_uses_the_previous_row(self):
+        self.add_rows(self.laptop, (100, 10), (100, 20))
+        self.add_rows(self.headset, (100, 10), (100, 10), (100, 5))
+        rows = {(row['product'], row['purchases']): row for row in self.api.get(self.url).data}
+        self.assertEqual(rows[self.laptop.id, 20]['trend'], 'increasing')
+        self.assertEqual(rows[self.laptop.id, 10]['trend'], 'stable')
+        self.assertEqual(rows[self.headset.id, 5]['trend'], 'decreasing')
+        self.assertEqual(rows[self.headset.id, 5]['category'], 'Audio')
+
+    def test_query_count_is_constant(self):
+        self.add_rows(self.laptop, (100, 10), (100, 20))
+        with CaptureQueriesContext(connection) as few:
+            self.api.get(self.url)
+        for n in range(10):
+            product = Product.objects.create(category=self.audio, name=f'Speaker {n}', slug=f'speaker-{n}',
+                                             price=Decimal('20.00'), stock=5)
+            self.add_rows(product, (50, 5), (60, 5))
+        with CaptureQueriesContext(connection) as many:
+            data = self.api.get(self.url).data
+        self.assertEqual(len(data), 22)
+        self.assertEqual(len(many.captured_queries), len(few.captured_queries))
+        self.assertEqual(len(many.captured_queries), 1)
+
+
+class OrderListTests(DashboardTestCase):
+    url = '/api/dashboard/orders/'
+
+    def test_pages_follow_the_cursor(self):
+        orders = [self.create_order([(self.headset, 1)], days_ago=n % 3, paid=False) for n in range(5)]
+        expected = [order.pk for order in sorted(orders, key=lambda order: (
+            Order.objects.get(pk=order.pk).created_at, order.pk), reverse=True)]
+        seen = []
+        response = self.api.get(self.url, {'page_size': 2})
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.api.get(response.data['next'])
+        self.assertEqual(seen, expected)
+
+    def test_order_fields(self):
+        order = self.create_order([(self.laptop, 2), (self.headset, 1)])
+        row = self.api.get(self.url, {'expand': 'items'}).data['results'][0]
+        self.assertEqual(row['id'], order.pk)
+        self.assertEqual(row['total_cost'], '1850.00')
+        self.assertEqual(row['user_email'], 'admin@example.com')
+        self.assertEqual(row['user_name'], 'admin')
+        self.assertEqual(sorted(item['product_name'] for item in row['items']), ['Headset', 'Laptop'])
+        self.assertEqual(row['days_since_order'], 0)
+
+    def test_query_count_is_constant(self):
+        self.create_order([(self.laptop, 1)])
+        with CaptureQueriesContext(connection) as few:
+            self.api.get(self.url, {'expand': 'items'})
+        for n in range(10):
+            user = User.objects.create_user(f'customer-{n}', f'customer-{n}@example.com')
+            order = self.create_order([(self.laptop, 1), (self.headset, 2)])
+            Order.objects.filter(pk=order.pk).update(user=user)
+        with CaptureQueriesContext(connection) as many:
+            data = self.api.get(self.url, {'expand': 'items'}).data
+        self.assertEqual(len(data['results']), 11)
+        self.assertEqual(len(many.captured_queries), len(few.captured_queries))
+
+    def test_paid_only_changes_through_mark_as_paid(self):
+        order = self.create_order([(self.laptop, 1)], paid=False)
+        self.api.patch(f'{self.url}{order.pk}/', {'paid': True}, format='json')
+        self.assertFalse(Order.objects.get(pk=order.pk).paid)
+        self.assertEqual(self.api.post(f'{self.url}{order.pk}/mark_as_paid/').status_code, 200)
+        sales = self.api.get('/api/dashboard/sales/', {'days': 7}).data
+        self.assertEqual((Decimal(sales['total_sales']), sales['orders_count']), (Decimal('900.00'), 1))
+
+
+class OrderTransitionEndpointTests(DashboardTestCase):
+    url = '/api/dashboard/orders/transition/'
+
+    def test_bulk_transition(self):
+        orders = [self.create_order([(self.headset, 1)], paid=False) for _ in range(3)]
+        Order.objects.filter(pk=orders[0].pk).update(status='cancelled')
+        ids = [order.pk for order in orders]
+        data = self.api.post(self.url, {'ids': ids, 'status': 'processing'}, format='json').data
+        self.assertEqual(data['changed'], ids[1:])
+        self.assertEqual(data['rejected'], [{'id': ids[0], 'current_status': 'cancelled'}])
+        rows = self.api.get('/api/dashboard/orders/', {'status': 'processing', 'fields': 'id'}).data['results']
+        self.assertEqual(sorted(row['id'] for row in rows), ids[1:])
+        self.assertEqual(orders[1].status_log.get().changed_by, self.admin)
+
+    def test_invalid_requests(self):
+        for body in ({'ids': [1], 'status': 'pending'}, {'ids': [1], 'status': 'lost'},
+                     {'ids': 'all', 'status': 'shipped'}, {'ids': [1]},
+                     {'ids': list(range(1001)), 'status': 'shipped'}):
+            self.assertEqual(self.api.post(self.url, body, format='json').status_code, 400)
+
+
+class CustomerRequestQueueTests(DashboardTestCase):
+    url = '/api/dashboard/requests/'
+
+    def add_request(self, request_type, status, hours_ago, answered_after=None):
+        request = CustomerRequest.objects.create(user=self.admin, request_type=request_type, status=status,
+                                                 subject='Help', message='Please')
+        created = timezone.now() - timedelta(hours=hours_ago)
+        updated = created + timedelta(hours=answered_after) if answered_after is not None else created
+        CustomerRequest.objects.filter(pk=request.pk).update(created_at=created, updated_at=updated)
+        return request.pk
+
+    def test_open_queue_oldest_first(self):
+        newest = self.add_request('support', 'pending', 1)
+        oldest = self.add_request('return', 'processing', 30)
+        self.add_request('support', 'completed', 20, answered_after=2)
+        middle = self.add_request('support', 'pending', 5)
+        seen = []
+        response = self.api.get(self.url, {'status': 'open', 'page_size': 2})
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.api.get(response.data['next'])
+        self.assertEqual(seen, [oldest, middle, newest])
+        rows = self.api.get(self.url, {'status': 'open', 'request_type': 'return'}).data['results']
+        self.assertEqual([row['id'] for row in rows], [oldest])
+
+    def test_summary(self):
+        for hours in (1, 2, 3, 10):
+            self.add_request('support', 'completed', 48, answered_after=hours)
+        self.add_request('support', 'pending', 6)
+        self.add_request('complaint', 'cancelled', 3)
+        self.add_request('support', 'completed', 24 * 40, answered_after=100)  # outside the window
+        with CaptureQueriesContext(connection) as queries:
+            data = self.api.get(f'{self.url}summary/', {'days': 30}).data
+        support = data['types']['support']
+        self.assertEqual((support['requests'], support['open'], support['completed']), (5, 1, 4))
+        self.assertEqual(support['response_time_hours']['mean'], 4.0)
+        self.assertEqual(support['response_time_hours']['p50'], 2.5)
+        self.assertEqual(support['oldest_open_hours'], 6.0)
+        self.assertIsNone(data['types']['complaint']['response_time_hours'])
+        self.assertEqual(data['types']['inquiry']['requests'], 0)
+        self.assertEqual(data['overall']['requests'], 6)
+        self.assertEqual(len([q for q in queries.captured_queries if 'dashboard_customerrequest' in q['sql']]), 1)
+
+    def test_summary_counts_the_whole_open_queue(self):
+        self.add_request('return', 'pending', 24 * 45)
+        self.add_request('return', 'processing', 12)
+        self.add_request('return', 'completed', 24 * 40, answered_after=5)
+        data = self.api.get(f'{self.url}summary/', {'days': 30}).data
+        returns = data['types']['return']
+        self.assertEqual((returns['requests'], returns['open'], returns['completed']), (1, 2, 0))
+        self.assertEqual(returns['oldest_open_hours'], 24 * 45.0)
+        self.assertIsNone(returns['response_time_hours'])
+        self.assertEqual(data['overall']['open'], 2)
+
+
+class UpdateUploadTests(DashboardTestCase):
+    url = '/api/dashboard/update-uploads/'
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.content = os.urandom(250000)
+
+    def start(self, **fields):
+        data = {'title': 'Firmware', 'update_type': 'system', 'description': 'Nightly', 'version': '2.1',
+                'filename': 'firmware.bin', 'size': len(self.content), **fields}
+        response = self.api.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def put(self, upload_id, offset, end):
+        return self.api.put(f'{self.url}{upload_id}/?offset={offset}', self.content[offset:end],
+                            content_type='application/octet-stream')
+
+    def test_chunks_resume_and_complete(self):
+        upload_id = self.start(sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.put(upload_id, 0, 100000).data['received'], 100000)
+        # A retried chunk that already arrived is refused with the current offset
+        response = self.put(upload_id, 0, 100000)
+        self.assertEqual((response.status_code, response.data['received']), (409, 100000))
+        self.assertEqual(self.api.post(f'{self.url}{upload_id}/complete/').status_code, 400)
+        self.put(upload_id, 100000, 200000)
+        # Lose the worker's hash state: completion hashes the file instead
+        uploads._hashers.clear()
+        self.assertEqual(self.api.get(f'{self.url}{upload_id}/').data['received'], 200000)
+        self.put(upload_id, 200000, len(self.content))
+
+        response = self.api.post(f'{self.url}{upload_id}/complete/')
+        self.assertEqual(response.status_code, 201)
+        update = Update.objects.get(pk=response.data['id'])
+        self.assertEqual(update.sha256, hashlib.sha256(self.content).hexdigest())
+        with update.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(UpdateUpload.objects.exists())
+        self.assertEqual(os.listdir(uploads.upload_dir()), [])
+
+    def test_hash_mismatch_keeps_the_upload(self):
+        upload_id = self.start(sha256='0' * 64)
+        self.put(upload_id, 0, len(self.content))
+        response = self.api.post(f'{self.url}{upload_id}/complete/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Update.objects.exists())
+        self.assertEqual(self.api.delete(f'{self.url}{upload_id}/').status_code, 204)
+        self.assertEqual(os.listdir(uploads.upload_dir()), [])
+
+    def test_chunk_past_the_declared_size(self):
+        upload_id = self.start(size=10)
+        self.assertEqual(self.put(upload_id, 0, 11).status_code, 400)
+
+
+class UpdateDownloadTests(LiveServerTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        admin = User.objects.create_user('admin', 'admin@example.com', 'admin-pass', is_staff=True)
+        self.content = os.urandom(300000)
+        self.update = Update.objects.create(title='Firmware', update_type='system', description='Nightly',
+                                            version='2.1', uploaded_by=admin,
+                                            file=ContentFile(self.content, name='firmware.bin'))
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Token {Token.objects.create(user=admin).key}'
+        self.url = f'{self.live_server_url}/api/dashboard/updates/{self.update.pk}/download/'
+
+    def test_partial_and_resumed_download(self):
+        first = self.session.get(self.url, headers={'Range': 'bytes=0-99999'})
+        self.assertEqual(first.status_code, 206)
+        self.assertEqual(first.headers['Content-Range'], 'bytes 0-99999/300000')
+        self.assertEqual(first.content, self.content[:100000])
+        etag = first.headers['ETag']
+        self.assertEqual(etag, f'"{hashlib.sha256(self.content).hexdigest()}"')
+
+        rest = self.session.get(self.url, headers={'Range': 'bytes=100000-', 'If-Range': etag})
+        self.assertEqual(rest.status_code, 206)
+        self.assertEqual(first.content + rest.content, self.content)
+
+        tail = self.session.get(self.url, headers={'Range': 'bytes=-10'})
+        self.assertEqual(tail.content, self.content[-10:])
+
+    def test_revalidation_and_stale_ranges(self):
+        full = self.session.get(self.url)
+        self.assertEqual((full.status_code, full.content), (200, self.content))
+        etag = full.headers['ETag']
+        self.assertEqual(self.session.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+        # A partial copy of another version restarts from scratch
+        stale = self.session.get(self.url, headers={'Range': 'bytes=100-', 'If-Range': '"other"'})
+        self.assertEqual((stale.status_code, len(stale.content)), (200, len(self.content)))
+        beyond = self.session.get(self.url, headers={'Range': 'bytes=400000-'})
+        self.assertEqual((beyond.status_code, beyond.headers['Content-Range']), (416, 'bytes */300000'))
+
+
+class SparseFieldsetTests(DashboardTestCase):
+    def test_fields_narrow_the_output_and_the_query(self):
+        self.create_order([(self.laptop, 1)])
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.api.get('/api/dashboard/orders/', {'fields': 'id,paid'}).data['results']
+        self.assertEqual(set(rows[0]), {'id', 'paid'})
+        self.assertEqual(len(queries.captured_queries), 1)
+        sql = queries.captured_queries[0]['sql']
+        self.assertNotIn('auth_user', sql)
+        self.assertNotIn('items_total', sql)
+
+    def test_nested_items_only_when_expanded(self):
+        self.create_order([(self.laptop, 1)])
+        row = self.api.get('/api/dashboard/orders/').data['results'][0]
+        self.assertNotIn('items', row)
+        self.assertIn('user_name', row)
+        row = self.api.get('/api/dashboard/orders/', {'fields': 'id', 'expand': 'items'}).data['results'][0]
+        self.assertEqual(set(row), {'id', 'items'})
+        self.assertEqual(row['items'][0]['product_name'], 'Laptop')
+
+    def test_unrequested_method_fields_are_not_computed(self):
+        ProductAnalytics.objects.create(product=self.laptop, views=100, cart_additions=10, purchases=5)
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.api.get('/api/dashboard/analytics/', {'fields': 'product_name,views'}).data
+        self.assertEqual(rows, [{'product_name': 'Laptop', 'views': 100}])
+        sql = queries.captured_queries[0]['sql']
+        self.assertNotIn('store_category', sql)
+        self.assertEqual(sql.count('SELECT'), 1)  # no trend subqueries
+
+
+class BulkStockTests(DashboardTestCase):
+    url = '/api/dashboard/products/bulk-stock/'
+
+    def test_csv_rows_are_applied_and_errors_reported(self):
+        StockReservation.objects.create(product=self.laptop, cart_token='cart', quantity=3,
+                                        expires_at=timezone.now() + timedelta(minutes=5))
+        body = 'id,slug,stock\n{},,40\n,headset,7\n,,5\n999,,1\n{},,-2\n'.format(self.laptop.id, self.headset.id)
+        report = self.api.generic('POST', self.url, body, content_type='text/csv').data
+        self.assertEqual((report['rows'], report['updated'], report['failed']), (5, 2, 3))
+        self.assertEqual([error['line'] for error in report['errors']], [4, 6, 5])
+        self.assertEqual(report['errors'][2]['error'], 'unknown product 999')
+        self.laptop.refresh_from_db()
+        self.headset.refresh_from_db()
+        # Units held by carts are in the warehouse count but not free to sell
+        self.assertEqual(self.laptop.stock, 37)
+        self.assertEqual(self.headset.stock, 7)
+
+    def test_single_product_stock_subtracts_holds(self):
+        StockReservation.objects.create(product=self.laptop, cart_token='cart', quantity=3,
+                                        expires_at=timezone.now() + timedelta(minutes=5))
+        response = self.api.post(f'/api/dashboard/products/{self.laptop.pk}/update_stock/', {'stock': 20},
+                                 format='json')
+        self.assertEqual(response.status_code, 200)
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.stock, 17)
+
+    def test_ndjson_is_written_in_chunks(self):
+        products = [
+            Product(category=self.audio, name=f'Cable {n}', slug=f'cable-{n}', price=Decimal('5.00'), stock=0)
+            for n in range(25)
+        ]
+        Product.objects.bulk_create(products)
+        body = '\n'.join(f'{{"slug": "cable-{n}", "stock": {n}}}' for n in range(25)) + '\nnot json\n'
+        with mock.patch.object(stock_sync, 'CHUNK_SIZE', 10), \
+                CaptureQueriesContext(connection) as queries:
+            report = self.api.generic('POST', self.url, body, content_type='application/x-ndjson').data
+        self.assertEqual((report['updated'], report['unchanged'], report['failed']), (24, 1, 1))
+        self.assertEqual(report['errors'], [{'line': 26, 'error': 'invalid JSON'}])
+        stock = dict(Product.objects.filter(slug__startswith='cable-').values_list('slug', 'stock'))
+        self.assertEqual(stock, {f'cable-{n}': n for n in range(25)})
+        updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+
+    def test_ambiguous_slugs_are_reported(self):
+        twin = Product.objects.create(category=self.audio, name='Headset (refurbished)', slug='headset',
+                                      price=Decimal('30.00'), stock=5)
+        body = 'id,slug,stock\n,headset,9\n,laptop,8\n{},,4\n'.format(twin.id)
+        report = self.api.generic('POST', self.url, body, content_type='text/csv').data
+        self.assertEqual((report['updated'], report['failed']), (2, 1))
+        self.assertEqual(report['errors'], [{'line': 2, 'error': 'slug headset matches several products, use the id'}])
+        self.headset.refresh_from_db()
+        twin.refresh_from_db()
+        self.assertEqual((self.headset.stock, twin.stock), (50, 4))
+
+    def test_unsupported_body(self):
+        response = self.api.generic('POST', self.url, 'stock\n1\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        response = self.api.generic('POST', self.url, '<stock/>', content_type='application/xml')
+        self.assertEqual(response.status_code, 400)
+
+
+class UniqueVisitorTests(DashboardTestCase):
+    url = '/api/dashboard/analytics/visitors/'
+
+    def view(self, product, visitors):
+        for visitor in visitors:
+            events.buffer.record(product.id, 'views', visitor=f'visitor-{visitor}')
+        events.buffer.flush()
+
+    def test_sketch_estimates_within_error_bounds(self):
+        registers = sketches.empty()
+        for n in range(50000):
+            register, rank = sketches.hash_visitor(f'visitor-{n}')
+            registers[register] = max(registers[register], rank)
+        self.assertLess(abs(sketches.estimate(registers) - 50000) / 50000, 3 * sketches.STANDARD_ERROR)
+        self.assertEqual(len(sketches.to_bytes(registers)), sketches.SIZE)
+
+    def test_page_views_feed_the_daily_sketch(self):
+        client = Client()
+        client.force_login(self.admin)
+        for _ in range(3):
+            client.get(self.laptop.get_absolute_url())
+        Client().get(self.laptop.get_absolute_url(), REMOTE_ADDR='10.0.0.1')
+        Client().get(self.laptop.get_absolute_url(), REMOTE_ADDR='10.0.0.2')
+        events.buffer.flush()
+        sketch = ProductVisitorSketch.objects.get(product=self.laptop, day=timezone.localdate())
+        self.assertEqual(len(sketch.registers), 4096)
+        self.assertEqual(sketches.estimate(sketches.from_bytes(sketch.registers)), 3)
+
+    def test_window_merges_days_and_products(self):
+        self.view(self.laptop, range(100))
+        ProductVisitorSketch.objects.update(day=timezone.localdate() - timedelta(days=10))
+        self.view(self.laptop, range(50, 200))
+        self.view(self.headset, range(150, 250))
+
+        week = self.api.get(self.url, {'days': 7}).data
+        month = self.api.get(self.url, {'days': 30}).data
+        self.assertEqual([p['product'] for p in week['products']], [self.laptop.id, self.headset.id])
+        self.assertAlmostEqual(week['products'][0]['unique_visitors'], 150, delta=5)
+        self.assertAlmostEqual(month['products'][0]['unique_visitors'], 200, delta=6)
+        self.assertAlmostEqual(month['unique_visitors'], 250, delta=8)
+        only_headset = self.api.get(self.url, {'days': 30, 'product': self.headset.id}).data
+        self.assertEqual(len(only_headset['products']), 1)
+
+    def test_flushes_merge_into_the_stored_sketch(self):
+        self.view(self.headset, range(100))
+        self.view(self.headset, range(50, 150))
+        self.assertEqual(ProductVisitorSketch.objects.count(), 1)
+        data = self.api.get(self.url).data
+        self.assertAlmostEqual(data['unique_visitors'], 150, delta=5)
+
+
+class RankingTests(DashboardTestCase):
+    url = '/api/dashboard/analytics/ranking/'
+
+    def setUp(self):
+        super().setUp()
+        self.products = [self.laptop, self.headset] + [
+            Product.objects.create(category=self.audio, name=f'Speaker {n}', slug=f'speaker-{n}',
+                                   price=Decimal('20.00'), stock=5)
+            for n in range(8)
+        ]
+        for n, product in enumerate(self.products):
+            ProductAnalytics.objects.create(product=product, views=1, cart_additions=0, purchases=0)
+            ProductAnalytics.objects.create(product=product, views=100 * (n + 1), cart_additions=10 * n, purchases=n)
+
+    def test_scores_match_the_serializer(self):
+        serialized = {row['id']: row for row in self.api.get('/api/dashboard/analytics/').data}
+        rows = ProductAnalytics.objects.order_by('id')
+        _, _, scores = scoring.score(*(np.array([getattr(r, f) for r in rows])
+                                       for f in ('views', 'cart_additions', 'purchases')))
+        for row, value in zip(rows, scores):
+            self.assertEqual(serialized[row.id]['performance_score'], round(float(value), 1))
+
+    def test_ranking_uses_latest_rows(self):
+        with self.assertNumQueries(2):
+            data = self.api.get(self.url, {'top': 3}).data
+        self.assertEqual(data['count'], 10)
+        latest = {row.product_id: row for row in ProductAnalytics.objects.order_by('id')}
+        expected = sorted(
+            latest.values(),
+            key=lambda row: -ProductAnalyticsSerializer(row).data['performance_score']
+        )[:3]
+        self.assertEqual([entry['product'] for entry in data['top']], [row.product_id for row in expected])
+        self.assertEqual(data['top'][0]['percentile'], 100.0)
+        self.assertEqual(data['top'][0]['product_name'], expected[0].product.name)
+        self.assertLessEqual(data['percentiles']['p25'], data['percentiles']['p75'])
+
+    def test_ranking_is_cached_until_counters_flush(self):
+        self.api.get(self.url)
+        with self.assertNumQueries(0):
+            self.api.get(self.url)
+        events.buffer.record(self.products[0].id, 'purchases', 500)
+        events.buffer.flush()
+        data = self.api.get(self.url).data
+        self.assertEqual(data['top'][0]['product'], self.products[0].id)
+
+    def test_ranking_ages_out_without_a_shared_cache(self):
+        with mock.patch.object(cache, 'set') as cache_set:
+            scoring.ranking()
+        self.assertEqual(cache_set.call_args.args[2], 60)
+
+    def test_invalid_top(self):
+        self.assertEqual(self.api.get(self.url, {'top': 0}).status_code, 400)
+        self.assertEqual(self.api.get(self.url, {'top': 'all'}).status_code, 400)
+
+
+class ProductEventTests(DashboardTestCase):
+    def counters(self, product):
+        row = ProductAnalytics.objects.filter(product=product).latest('id')
+        return row.views, row.cart_additions, row.purchases
+
+    def test_store_events_are_counted_after_a_flush(self):
+        client = Client()
+        client.get(self.laptop.get_absolute_url())
+        client.get(self.laptop.get_absolute_url())
+        client.post(f'/cart/add/{self.headset.id}/', {'quantity': 2})
+        cart = session_cart()
+        cart.add(self.headset, quantity=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(cart, self.admin)
+        self.assertFalse(ProductAnalytics.objects.exists())
+
+        self.assertEqual(events.buffer.flush(), 2)
+        self.assertEqual(self.counters(self.laptop), (2, 0, 0))
+        self.assertEqual(self.counters(self.headset), (0, 1, 3))
+
+    def test_flush_adds_to_the_latest_row(self):
+        old = ProductAnalytics.objects.create(product=self.laptop, views=100)
+        latest = ProductAnalytics.objects.create(product=self.laptop, views=7)
+        events.buffer.record(self.laptop.id, 'views', 5)
+        events.buffer.flush()
+        old.refresh_from_db()
+        latest.refresh_from_db()
+        self.assertEqual((old.views, latest.views), (100, 12))
+
+    def test_buffer_flushes_by_size(self):
+        buffer = events.EventBuffer(size=3, interval=3600)
+        buffer.record(self.laptop.id, 'views')
+        buffer.record(self.headset.id, 'views')
+        self.assertFalse(ProductAnalytics.objects.exists())
+        buffer.record(self.laptop.id, 'cart_additions')
+        self.assertEqual(self.counters(self.laptop), (1, 1, 0))
+        self.assertEqual(buffer.pending, 0)
+
+    def test_buffer_flushes_by_age(self):
+        buffer = events.EventBuffer(size=1000, interval=60)
+        buffer.record(self.laptop.id, 'views')
+        buffer.oldest -= 61
+        buffer.record(self.laptop.id, 'views')
+        self.assertEqual(self.counters(self.laptop), (2, 0, 0))
+
+    def test_failed_flush_on_record_keeps_events_and_backs_off(self):
+        buffer = events.EventBuffer(size=2, interval=60)
+        buffer.record(self.laptop.id, 'views')
+        with mock.patch.object(events, 'write_counts', side_effect=DatabaseError('database is locked')), \
+                self.assertLogs('dashboard.events', 'ERROR'):
+            buffer.record(self.laptop.id, 'views')
+        self.assertEqual(buffer.pending, 2)
+        # No new attempt until the interval has passed
+        with mock.patch.object(buffer, 'flush') as flush:
+            buffer.record(self.laptop.id, 'views')
+        flush.assert_not_called()
+        buffer.retry_at = 0
+        buffer.record(self.laptop.id, 'views')
+        self.assertEqual(self.counters(self.laptop), (4, 0, 0))
+        # Explicit flushes still raise
+        buffer.record(self.laptop.id, 'views')
+        with mock.patch.object(events, 'write_counts', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError):
+                buffer.flush()
+
+    def test_deleted_products_are_dropped(self):
+        events.buffer.record(self.headset.id, 'views')
+        events.buffer.record(self.laptop.id, 'views')
+        self.headset.delete()
+        events.buffer.flush()
+        self.assertEqual(list(ProductAnalytics.objects.values_list('product_id', flat=True)), [self.laptop.id])
+
+
+class EventLogTests(DashboardTestCase):
+    def setUp(self):
+        super().setUp()
+        client = Client()
+        client.force_login(self.admin)
+        client.get(self.laptop.get_absolute_url())
+        client.get('/products/', {'search': 'laptop'})
+        client.get('/products/', {'search': 'laptop', 'page': 2})
+        client.post(f'/cart/add/{self.laptop.id}/', {'quantity': 1})
+        Client().get(self.headset.get_absolute_url())
+        events.buffer.flush()
+
+    def test_events_are_logged_in_one_batch(self):
+        events.buffer.record(self.laptop.id, 'views')
+        events.buffer.record_search('headset')
+        with self.assertNumQueries(2 + 3):
+            # One transaction: counters (read, update) and a single insert for the log
+            events.buffer.flush()
+        logged = AnalyticsEvent.objects.order_by('id')
+        self.assertEqual(
+            [(e.event_type, e.product_id, e.user_id, e.query) for e in logged],
+            [
+                (AnalyticsEvent.VIEW, self.laptop.id, self.admin.id, ''),
+                (AnalyticsEvent.SEARCH, None, self.admin.id, 'laptop'),
+                (AnalyticsEvent.CART_ADD, self.laptop.id, self.admin.id, ''),
+                (AnalyticsEvent.VIEW, self.headset.id, None, ''),
+                (AnalyticsEvent.VIEW, self.laptop.id, None, ''),
+                (AnalyticsEvent.SEARCH, None, None, 'headset'),
+            ]
+        )
+        self.assertEqual(set(logged.values_list('day', flat=True)), {timezone.localdate()})
+
+    def test_export_columns(self):
+        AnalyticsEvent.objects.filter(product_id=self.headset.id).update(day=timezone.localdate() - timedelta(days=3))
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(eventlog.export(timezone.localdate(), timezone.localdate(), directory), 3)
+            columns = eventlog.load(directory)
+            self.assertIsInstance(columns['product_id'], np.memmap)
+            self.assertEqual(columns['event_type'].tolist(), [AnalyticsEvent.VIEW, AnalyticsEvent.SEARCH, AnalyticsEvent.CART_ADD])
+            self.assertEqual(columns['product_id'].tolist(), [self.laptop.id, 0, self.laptop.id])
+            self.assertEqual(columns['user_id'].tolist(), [self.admin.id] * 3)
+            first = AnalyticsEvent.objects.order_by('id').first().created_at
+            self.assertEqual(columns['timestamp'][0], np.datetime64(first.replace(tzinfo=None), 'us'))
+
+    def test_export_and_prune_commands(self):
+        AnalyticsEvent.objects.filter(product_id=self.headset.id).update(day=timezone.localdate() - timedelta(days=40))
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('export_events', directory, '--start', str(timezone.localdate() - timedelta(days=60)), stdout=open(os.devnull, 'w'))
+            self.assertEqual(len(eventlog.load(directory)['timestamp']), 4)
+        call_command('prune_analytics_events', '--keep-days', '30', stdout=open(os.devnull, 'w'))
+        self.assertFalse(AnalyticsEvent.objects.filter(product_id=self.headset.id).exists())
+        self.assertEqual(AnalyticsEvent.objects.count(), 3)
+
+
+class CohortTests(DashboardTestCase):
+    url = '/api/dashboard/cohorts/'
+
+    def order_in_month(self, user, months_ago, product=None):
+        """A paid order of ``user`` placed mid-month, ``months_ago`` months back."""
+        today = timezone.localdate()
+        index = today.year * 12 + today.month - 1 - months_ago
+        placed = timezone.make_aware(timezone.datetime(index // 12, index % 12 + 1, 15, 12))
+        order = self.create_order([(product or self.headset, 1)])
+        Order.objects.filter(pk=order.pk).update(user=user, created_at=placed)
+
+    def setUp(self):
+        super().setUp()
+        a, b, c, d = (User.objects.create_user(name) for name in 'abcd')
+        for months_ago in (2, 1, 0):
+            self.order_in_month(a, months_ago)
+        self.order_in_month(b, 2, self.laptop)
+        self.order_in_month(b, 2)
+        self.order_in_month(c, 5)
+        self.order_in_month(c, 1)
+        self.order_in_month(d, 0)
+
+    def test_cohort_matrices(self):
+        data = self.api.get(self.url, {'months': 3}).data
+        self.assertEqual(data['customers'], [2, 0, 1])
+        self.assertEqual(data['orders'], 6)
+        self.assertEqual(data['retention'], [[1.0, 0.5, 0.5], [0.0, 0.0], [1.0]])
+        self.assertEqual(data['repeat_purchase'], [[0.5, 1.0, 1.0], [0.0, 0.0], [0.0]])
+        self.assertEqual(data['revenue'], [[1000.0, 50.0, 50.0], [0.0, 0.0], [50.0]])
+
+    def test_earlier_first_orders_keep_customers_in_their_cohort(self):
+        data = self.api.get(self.url, {'months': 6}).data
+        self.assertEqual(data['customers'], [1, 0, 0, 2, 0, 1])
+        self.assertEqual(data['retention'][0], [1.0, 0.0, 0.0, 0.0, 1.0, 0.0])
+
+    def test_cached_per_day(self):
+        self.api.get(self.url)
+        with self.assertNumQueries(0):
+            self.api.get(self.url)
+        self.assertEqual(self.api.get(self.url, {'months': 61}).status_code, 400)
+
+
+class SearchStatsEndpointTests(DashboardTestCase):
+    url = '/api/dashboard/searches/'
+
+    def test_top_and_zero_result_queries(self):
+        self.assertEqual(self.api.get(self.url).data['top'], [])
+        tracker = search_stats.SearchTracker(interval=3600)
+        for query, results in [('laptop', 2), ('laptop', 2), ('usb hub', 0), ('headset', 1)]:
+            tracker.record(query, results)
+        tracker.flush()
+        data = self.api.get(self.url, {'limit': 1}).data
+        self.assertEqual(data['top'], [{'query': 'laptop', 'count': 2}])
+        self.assertEqual(data['zero_results'], [{'query': 'usb hub', 'count': 1}])
+        self.assertEqual(data['total_searches'], 4)
+        self.assertEqual(self.api.get(self.url, {'limit': 0}).status_code, 400)
+
+
+class SalesTimeseriesTests(DashboardTestCase):
+    url = '/api/dashboard/sales/timeseries/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_order([(self.laptop, 1), (self.headset, 2)])
+        self.create_order([(self.headset, 1), (self.headset, 1)])
+        self.create_order([(self.headset, 3)], days_ago=3)
+
+    def test_daily_series_is_gap_filled(self):
+        with self.assertNumQueries(1):
+            data = self.api.get(self.url, {'days': 7}).data
+        self.assertEqual(len(data['buckets']), 7)
+        self.assertEqual(data['buckets'][-1], timezone.localdate().isoformat())
+        self.assertEqual(data['revenue'], [0, 0, 0, 150.0, 0, 0, 1100.0])
+        self.assertEqual(data['orders'], [0, 0, 0, 1, 0, 0, 2])
+        self.assertEqual(data['units'][-1], 5)
+
+    def test_category_filter_counts_each_order_once(self):
+        data = self.api.get(self.url, {'days': 7, 'category': self.audio.id}).data
+        self.assertEqual(data['orders'][-1], 2)
+        self.assertEqual(data['revenue'][-1], 200.0)
+
+    def test_product_filter(self):
+        data = self.api.get(self.url, {'days': 7, 'product': self.laptop.id}).data
+        self.assertEqual(sum(data['revenue']), 900.0)
+
+    def test_coarser_granularities_cover_the_window(self):
+        weekly = self.api.get(self.url, {'days': 30, 'granularity': 'week'}).data
+        monthly = self.api.get(self.url, {'days': 90, 'granularity': 'month'}).data
+        self.assertEqual(sum(weekly['revenue']), 1250.0)
+        self.assertEqual(sum(monthly['orders']), 3)
+        self.assertTrue(all(date.fromisoformat(b).weekday() == 0 for b in weekly['buckets']))
+
+    def test_hourly_series(self):
+        data = self.api.get(self.url, {'days': 1, 'granularity': 'hour'}).data
+        self.assertEqual(len(data['buckets']), 24)
+        self.assertEqual(data['revenue'][-1], 1100.0)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.api.get(self.url, {'granularity': 'year'}).status_code, 400)
+        self.assertEqual(self.api.get(self.url, {'granularity': 'hour', 'days': 90}).status_code, 400)
+        self.assertEqual(self.api.get(self.url, {'category': 'audio'}).status_code, 400)
+
+
+class UpdateDeltaTests(DashboardTestCase):
+    url = '/api/dashboard/updates/'
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.v1 = os.urandom(400000)
+        # Bytes inserted, removed and changed at a few places
+        self.v2 = self.v1[:50000] + b'patched' * 300 + self.v1[50000:200000] + self.v1[210000:390000] + os.urandom(5000)
+        # Build in the request, where the test transaction can be seen (see BackgroundDeltaTests)
+        self.enterContext(mock.patch.object(patches, 'build_later', patches.build))
+
+    def upload(self, title, version, content):
+        response = self.api.post(self.url, {
+            'title': title, 'update_type': 'system', 'description': 'Nightly', 'version': version,
+            'uploaded_by': self.admin.pk, 'file': ContentFile(content, name='firmware.bin')
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_make_and_apply_delta(self):
+        delta = make_delta(self.v1, self.v2)
+        self.assertLess(len(delta), len(self.v2) // 20)
+        self.assertEqual(apply_delta(self.v1, delta), self.v2)
+        self.assertEqual(apply_delta(b'', make_delta(b'', b'new')), b'new')
+        # Patching the wrong source fails verification
+        with self.assertRaises(DeltaError):
+            apply_delta(self.v1[:1000] + b'?' + self.v1[1001:], delta)
+        with self.assertRaises(DeltaError):
+            apply_delta(self.v1, delta[:-10])
+
+    def test_segments_give_the_same_delta(self):
+        self.assertEqual(block_checksums(self.v1, 2048).tolist(), weak_checksums(self.v1, 2048)[::2048].tolist())
+        delta = make_delta(self.v1, self.v2)
+        # Matches that straddle segment boundaries are still found
+        with mock.patch('dashboard.delta.SEGMENT_SIZE', 5000):
+            self.assertEqual(block_checksums(self.v1, 2048).tolist(), weak_checksums(self.v1, 2048)[::2048].tolist())
+            self.assertEqual(make_delta(self.v1, self.v2), delta)
+
+    def test_delta_built_on_upload_and_served(self):
+        self.upload('Firmware', '1.0', self.v1)
+        update_id = self.upload('Firmware', '1.1', self.v2)
+        delta = UpdateDelta.objects.get(target_id=update_id)
+        self.assertEqual(delta.source.version, '1.0')
+
+        response = self.api.get(f'{self.url}{update_id}/delta/?from_version=1.0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Target-SHA256'], hashlib.sha256(self.v2).hexdigest())
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), delta.size)
+        self.assertEqual(apply_delta(self.v1, body), self.v2)
+
+        missing = self.api.get(f'{self.url}{update_id}/delta/?from_version=0.9')
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(missing.data['download'], f'{self.url}{update_id}/download/')
+
+    def test_falls_back_to_update_type_and_skips_unrelated_files(self):
+        self.upload('Firmware', '1.0', self.v1)
+        # No earlier update of this title: diffed against the same type
+        patched = self.upload('Firmware beta', '1.1-beta', self.v2)
+        self.assertTrue(UpdateDelta.objects.filter(target_id=patched, source__version='1.0').exists())
+        # A delta no smaller than the file isn't kept
+        unrelated = self.upload('Firmware', '2.0', os.urandom(100000))
+        self.assertFalse(UpdateDelta.objects.filter(target_id=unrelated).exists())
+
+
+class BackgroundDeltaTests(TransactionTestCase):
+    def test_delta_built_after_the_upload_commits(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        admin = User.objects.create_user('admin', 'admin@example.com', 'admin-pass', is_staff=True)
+        api = APIClient()
+        api.force_authenticate(admin)
+        v1 = os.urandom(200000)
+        ids = []
+        for version, content in (('1.0', v1), ('1.1', v1[:100000] + b'patched' + v1[100000:])):
+            response = api.post('/api/dashboard/updates/', {
+                'title': 'Firmware', 'update_type': 'system', 'description': 'Nightly', 'version': version,
+                'uploaded_by': admin.pk,
+                'file': ContentFile(content, name='firmware.bin')
+            }, format='multipart')
+            self.assertEqual(response.status_code, 201)
+            ids.append(response.data['id'])
+        # Builds run in order on one thread: once this no-op is done, so are they
+        patches.builder.submit(lambda: None).result()
+        self.assertEqual(list(UpdateDelta.objects.values_list('source_id', 'target_id')), [tuple(ids)])
+
+
+class BatchTests(DashboardTestCase):
+    url = '/api/dashboard/batch/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_order([(self.laptop, 1)])
+        CustomerRequest.objects.create(user=self.admin, request_type='support', status='new',
+                                       subject='Help', message='Please')
+
+    def test_sub_requests_in_one_round_trip(self):
+        token = Token.objects.create(user=self.admin)
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        with CaptureQueriesContext(connection) as queries:
+            response = api.post(self.url, {'requests': [
+                {'id': 'sales', 'path': '/api/dashboard/sales/', 'params': {'days': 7}},
+                {'id': 'requests', 'path': '/api/dashboard/requests/?fields=id,status', 'params': {'page_size': 10}},
+                {'id': 'bad', 'path': '/api/dashboard/sales/', 'params': {'days': 'many'}},
+                {'id': 'missing', 'path': '/api/dashboard/nowhere/'},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['responses']
+        self.assertEqual(results['sales']['status'], 200)
+        self.assertEqual(results['sales']['body']['total_sales'], '900.00')
+        self.assertEqual(list(results['requests']['body']['results'][0]), ['id', 'status'])
+        self.assertEqual(results['bad']['status'], 400)
+        self.assertEqual(results['missing']['status'], 404)
+        # The token is looked up once for the whole batch
+        token_queries = [q for q in queries.captured_queries if Token._meta.db_table in q['sql']]
+        self.assertEqual(len(token_queries), 1)
+
+    def test_rejects_malformed_batches(self):
+        for data in (
+            {},
+            {'requests': [{'path': '/api/dashboard/sales/', 'method': 'POST'}]},
+            {'requests': [{'path': '/admin/'}]},
+            {'requests': [{'path': '/api/dashboard/batch/'}]},
+            {'requests': [{'id': 'a', 'path': '/api/dashboard/sales/'}] * 2},
+            {'requests': [{'path': '/api/dashboard/sales/'}] * (batch.MAX_REQUESTS + 1)},
+        ):
+            self.assertEqual(self.api.post(self.url, data, format='json').status_code, 400)
+        # Endpoints that stream files can't be batched
+        update = Update.objects.create(title='Firmware', update_type='system', description='Nightly',
+                                       version='1.0', uploaded_by=self.admin,
+                                       file=ContentFile(b'firmware', name='firmware.bin'))
+        self.addCleanup(update.file.delete, save=False)
+        with mock.patch.object(downloads, 'serve') as serve:
+            response = self.api.post(self.url, {'requests': [
+                {'id': 'file', 'path': f'/api/dashboard/updates/{update.pk}/download/'},
+                {'id': 'delta', 'path': f'/api/dashboard/updates/{update.pk}/delta/', 'params': {'from_version': '0.9'}},
+            ]}, format='json')
+        results = response.data['responses']
+        self.assertEqual((results['file']['status'], results['delta']['status']), (400, 400))
+        # Rejected before the file is opened
+        serve.assert_not_called()
+
+
+class ConcurrentBatchTests(TransactionTestCase):
+    def test_concurrent_sub_requests(self):
+        admin = User.objects.create_user('admin', 'admin@example.com', 'admin-pass', is_staff=True)
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        Product.objects.create(category=category, name='Laptop', slug='laptop', price=Decimal('900.00'), stock=5)
+        api = APIClient()
+        api.force_authenticate(admin)
+        paths = ['/api/dashboard/products/', '/api/dashboard/categories/', '/api/dashboard/requests/',
+                 '/api/dashboard/sales/timeseries/', '/api/dashboard/cache/']
+        response = api.post('/api/dashboard/batch/', {
+            'requests': [{'id': path, 'path': path} for path in paths],
+            'concurrent': True,
+        }, format='json')
+        results = response.data['responses']
+        self.assertEqual([results[path]['status'] for path in paths], [200] * len(paths))
+        self.assertEqual(results['/api/dashboard/products/']['body'][0]['name'], 'Laptop')
@@ -0,0 +1,155 @@
+"""
+Chunked, resumable uploads of update files.
+
+1. ``POST /api/dashboard/update-uploads/`` with the update's fields plus the
+   ``filename``, total ``size`` and optionally the expected ``sha256``
+   creates an ``UpdateUpload``.
+2. ``PUT /api/dashboard/update-uploads/<id>/?offset=N`` with the raw bytes of
+   a chunk appends them to a temporary file. ``offset`` must equal the bytes
+   received so far; a client that lost track (timeout, restart) asks
+   ``GET /api/dashboard/update-uploads/<id>/`` and carries on from
+   ``received``.
+3. ``POST /api/dashboard/update-uploads/<id>/complete/`` checks the size and
+   hash and only then creates the ``Update``.
+
+The SHA-256 is computed as the chunks stream in. Hash state can't be stored,
+so it lives in the worker that received the chunks; if a chunk lands on
+another worker, or the worker restarted, the file is hashed again on
+completion instead.
+"""
+import hashlib
+import os
+import threading
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from .models import Update, UpdateUpload
+
+CHUNK_SIZE = 4 * 1024 * 1024  # suggested to clients
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """The chunk doesn't start where the upload stands; ``received`` says where it does."""
+
+    def __init__(self, received):
+        self.received = received
+        super().__init__(f'Upload is at byte {received}')
+
+
+def upload_dir():
+    return getattr(settings, 'UPDATE_UPLOAD_DIR', os.path.join(settings.MEDIA_ROOT, 'partial_uploads'))
+
+
+def temp_path(upload):
+    return os.path.join(upload_dir(), f'{upload.pk}.part')
+
+
+def start(upload):
+    """Create the empty temporary file of a new upload."""
+    os.makedirs(upload_dir(), exist_ok=True)
+    open(temp_path(upload), 'wb').close()
+    with _hashers_lock:
+        _hashers[upload.pk] = (0, hashlib.sha256())
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Write ``length`` bytes read from ``stream`` at ``offset``. Returns the
+    bytes received so far.
+    """
+    if offset != upload.received:
+        raise OffsetMismatch(upload.received)
+    if length > MAX_CHUNK_SIZE:
+        raise UploadError(f'Chunks can be at most {MAX_CHUNK_SIZE} bytes')
+    if offset + length > upload.size:
+        raise UploadError(f'Chunk ends past the declared size of {upload.size} bytes')
+
+    with _hashers_lock:
+        position, hasher = _hashers.pop(upload.pk, (None, None))
+    if position != offset:
+        hasher = None
+
+    written = 0
+    with open(temp_path(upload), 'r+b') as f:
+        # Drop whatever a failed earlier attempt left past the offset
+        f.seek(offset)
+        f.truncate()
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            f.write(block)
+            if hasher is not None:
+                hasher.update(block)
+            written += len(block)
+    if written != length:
+        raise UploadError(f'Expected {length} bytes, received {written}')
+
+    received = offset + written
+    # Conditional, a concurrent retry of the same chunk may have been first
+    if not UpdateUpload.objects.filter(pk=upload.pk, received=offset).update(received=received):
+        raise OffsetMismatch(UpdateUpload.objects.get(pk=upload.pk).received)
+    upload.received = received
+    if hasher is not None:
+        with _hashers_lock:
+            _hashers[upload.pk] = (received, hasher)
+    return received
+
+
+def complete(upload):
+    """Turn a fully received upload into an ``Update``; returns it."""
+    if upload.received != upload.size:
+        raise UploadError(f'Only {upload.received} of {upload.size} bytes received')
+    path = temp_path(upload)
+    with _hashers_lock:
+        position, hasher = _hashers.pop(upload.pk, (None, None))
+    if position == upload.size:
+        sha256 = hasher.hexdigest()
+    else:
+        with open(path, 'rb') as f:
+            sha256 = file_sha256(File(f))
+    if upload.sha256 and upload.sha256.lower() != sha256:
+        raise UploadError(f'SHA-256 mismatch: received {sha256}')
+
+    with transaction.atomic():
+        with open(path, 'rb') as f:
+            update = Update.objects.create(
+                title=upload.title,
+                update_type=upload.update_type,
+                description=upload.description,
+                version=upload.version,
+                file=File(f, name=upload.filename),
+                sha256=sha256,
+                uploaded_by=upload.uploaded_by
+            )
+        upload.delete()
+    os.remove(path)
+    return update
+
+
+def abort(upload):
+    path = temp_path(upload)
+    with _hashers_lock:
+        _hashers.pop(upload.pk, None)
+    upload.delete()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def file_sha256(file):
+    """Hex SHA-256 of an uploaded or stored file, read in chunks."""
+    hasher = hashlib.sha256()
+    for block in file.chunks(BLOCK_SIZE):
+        hasher.update(block)
+    return hasher.hexdigest()
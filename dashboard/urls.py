@@ -9,9 +9,15 @@ router.register(r'orders', views.OrderViewSet)
 router.register(r'analytics', views.ProductAnalyticsViewSet)
 router.register(r'requests', views.CustomerRequestViewSet)
 router.register(r'updates', views.UpdateViewSet)
+router.register(r'update-uploads', views.UpdateUploadViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
     path('sales/', views.get_sales_analytics, name='sales-analytics'),
+    path('sales/timeseries/', views.get_sales_timeseries, name='sales-timeseries'),
+    path('batch/', views.run_batch, name='batch'),
+    path('cache/', views.get_cache_stats, name='cache-stats'),
+    path('cohorts/', views.get_cohort_analytics, name='cohort-analytics'),
+    path('searches/', views.get_search_stats, name='search-stats'),
     path('register-admin/', views.register_admin, name='register-admin'),
 ]
\ No newline at end of file
@@ -1,18 +1,67 @@
-from rest_framework import viewsets, permissions, status
+from rest_framework import mixins, viewsets, permissions, status
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Avg, Q
+from django.db.models import OuterRef, Subquery
+from django.http import FileResponse
 from django.utils import timezone
 from datetime import timedelta
-from django.core.cache import cache
 from rest_framework.filters import SearchFilter, OrderingFilter
-from .models import ProductAnalytics, CustomerRequest, Update
+from . import analytics_cache, batch, cohorts, downloads, patches, rollups, scoring, sketches, sla, stock_sync, uploads
+from .models import ProductAnalytics, CustomerRequest, Update, UpdateUpload
+from .pagination import OrderCursorPagination, RequestQueuePagination
 from .serializers import (ProductAnalyticsSerializer, CustomerRequestSerializer,
                         UpdateSerializer, AdminUserSerializer, SalesAnalyticsSerializer, 
-                        CategorySerializer, ProductSerializer, OrderSerializer)
-from store.models import Order, Product, Category, OrderItem
+                        CategorySerializer, ProductSerializer, OrderSerializer,
+                        UpdateUploadSerializer, selected_fields)
+from store import inventory, search_stats
+from store.models import Order, Product, Category, SearchSketch
+from store.orders import InvalidTransition, mark_orders_paid, transition_orders
 
-class CategoryViewSet(viewsets.ModelViewSet):
+MAX_ANALYTICS_DAYS = 365
+MAX_HOURLY_DAYS = 31
+MAX_SALES_WINDOWS = 6
+MAX_RANKING_TOP = 100
+MAX_COHORT_MONTHS = 60
+MAX_TRANSITION_ORDERS = 1000
+
+class SparseFieldsetMixin:
+    """
+    Narrows read querysets to the serializer fields selected with ``?fields=``
+    and ``?expand=``: ``only()`` the columns they read, joining and
+    prefetching relations only for the fields that need them.
+    ``field_sources`` maps a serializer field to the model paths it reads;
+    other fields read the column of the same name.
+    """
+    field_sources = {}
+
+    def selected_fields(self):
+        return selected_fields(self.get_serializer_class(), self.request.query_params)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in permissions.SAFE_METHODS:
+            return queryset
+
+        opts = queryset.model._meta
+        columns, joins, prefetches = {opts.pk.name}, set(), set()
+        for name in self.selected_fields():
+            for path in self.field_sources.get(name, [name]):
+                field = opts.get_field(path.split('__')[0])
+                if field.one_to_many or field.many_to_many:
+                    prefetches.add(path)
+                    continue
+                columns.add(path)
+                if '__' in path:
+                    joins.add(path.rsplit('__', 1)[0])
+        if OrderingFilter in self.filter_backends:
+            # Pagination reads the ordering values back from the rows
+            ordering = OrderingFilter().get_ordering(self.request, queryset, self) or ()
+            columns.update(term.lstrip('-') for term in ordering)
+        return queryset.select_related(None).prefetch_related(None).select_related(
+            *joins
+        ).prefetch_related(*prefetches).only(*columns)
+
+class CategoryViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAdminUser]
@@ -28,10 +77,11 @@ class CategoryViewSet(viewsets.ModelViewSet):
         serializer = ProductSerializer(products, many=True)
         return Response(serializer.data)
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAdminUser]
+    field_sources = {'category_name': ['category__name'], 'sales_count': []}
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['name', 'description', 'category__name']
     ordering_fields = ['name', 'price', 'stock', 'created']
@@ -45,7 +95,7 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def update_stock(self, request, pk=None):
-        """Update product stock level"""
+        """Set the product's warehouse stock level; units held by carts are subtracted"""
         product = self.get_object()
         try:
             new_stock = int(request.data.get('stock', 0))
@@ -54,8 +104,8 @@ class ProductViewSet(viewsets.ModelViewSet):
                     {'error': 'Stock cannot be negative'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            product.stock = new_stock
-            product.save()
+            # The warehouse count, less the units held by carts
+            inventory.set_stock_levels({product.pk: new_stock})
             return Response({'status': 'stock updated'})
         except ValueError:
             return Response(
@@ -63,22 +113,70 @@ class ProductViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+    @action(detail=False, methods=['post'], url_path='bulk-stock')
+    def bulk_stock(self, request):
+        """Set the stock of many products from a streamed CSV or NDJSON body"""
+        content_type = request.content_type.split(';')[0].strip().lower()
+        lines = (line.decode('utf-8-sig', errors='replace') for line in request.stream or ())
+        try:
+            rows = stock_sync.parse(lines, content_type)
+            report = stock_sync.apply(rows)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
+class OrderViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    # Users and items (with their products) are fetched once per page
+    queryset = Order.objects.select_related('user').prefetch_related('items__product')
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = OrderCursorPagination
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['id', 'user__username', 'user__email']
-    ordering_fields = ['created', 'updated', 'paid']
+    ordering_fields = ['created_at', 'updated_at']
+    ordering = OrderCursorPagination.ordering
+    field_sources = {
+        'user_email': ['user__email'],
+        'user_name': ['user__first_name', 'user__last_name', 'user__username'],
+        'items': ['items__product'],
+        'total_cost': ['items_total'],
+        'status': ['paid'],
+        'fulfilment_status': ['status'],
+        'days_since_order': ['created_at'],
+    }
 
     @action(detail=True, methods=['post'])
     def mark_as_paid(self, request, pk=None):
         """Mark an order as paid"""
         order = self.get_object()
-        order.paid = True
-        order.save()
+        mark_orders_paid([order.pk])
         return Response({'status': 'order marked as paid'})
 
+    @action(detail=False, methods=['post'])
+    def transition(self, request):
+        """Move many orders to a new status, skipping those that can't make the move"""
+        order_ids = request.data.get('ids')
+        if (not isinstance(order_ids, list) or not order_ids or
+                not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in order_ids)):
+            return Response({'error': 'ids must be a list of order ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(order_ids) > MAX_TRANSITION_ORDERS:
+            return Response(
+                {'error': f'At most {MAX_TRANSITION_ORDERS} orders per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        target = request.data.get('status')
+        if not isinstance(target, str):
+            return Response({'error': 'status is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            changed, rejected = transition_orders(order_ids, target, request.user)
+        except InvalidTransition as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'status': target,
+            'changed': changed,
+            'rejected': [{'id': pk, 'current_status': current} for pk, current in rejected.items()],
+        })
+
     def get_queryset(self):
         queryset = super().get_queryset()
         status = self.request.query_params.get('status', None)
@@ -86,84 +184,360 @@ class OrderViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(paid=True)
         elif status == 'unpaid':
             queryset = queryset.filter(paid=False)
+        elif status in dict(Order.STATUS_CHOICES):
+            queryset = queryset.filter(status=status)
         return queryset
 
-class ProductAnalyticsViewSet(viewsets.ModelViewSet):
-    queryset = ProductAnalytics.objects.all()
+class ProductAnalyticsViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = ProductAnalytics.objects.select_related('product__category')
     serializer_class = ProductAnalyticsSerializer
     permission_classes = [permissions.IsAdminUser]
+    field_sources = {
+        'product_name': ['product__name'],
+        'category': ['product__category__name'],
+        'conversion_rate': ['views', 'purchases'],
+        'trend': ['product', 'views', 'purchases', 'last_updated'],
+        'performance_score': ['views', 'cart_additions', 'purchases'],
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if 'trend' not in self.selected_fields():
+            return queryset
+        # The serializer's trend compares against the product's previous
+        # row; annotate it here instead of querying it per row
+        previous = ProductAnalytics.objects.filter(
+            product=OuterRef('product'),
+            last_updated__lt=OuterRef('last_updated')
+        ).order_by('-last_updated')
+        return queryset.annotate(
+            previous_views=Subquery(previous.values('views')[:1]),
+            previous_purchases=Subquery(previous.values('purchases')[:1])
+        )
 
-class CustomerRequestViewSet(viewsets.ModelViewSet):
-    queryset = CustomerRequest.objects.all()
+    @action(detail=False, methods=['get'])
+    def ranking(self, request):
+        """Top products by performance score, with the score distribution"""
+        try:
+            top = int(request.query_params.get('top', 10))
+        except ValueError:
+            return Response({'error': 'top must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= top <= MAX_RANKING_TOP:
+            return Response(
+                {'error': f'top must be between 1 and {MAX_RANKING_TOP}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(scoring.ranking(top))
+
+    @action(detail=False, methods=['get'])
+    def visitors(self, request):
+        """Estimated unique visitors per product over the last ``days`` days"""
+        days, error = parse_days(request)
+        if error:
+            return error
+        product_id = request.query_params.get('product')
+        if product_id is not None:
+            try:
+                product_id = int(product_id)
+            except ValueError:
+                return Response({'error': 'product must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        start = timezone.localdate() - timedelta(days=days - 1)
+        total, per_product = sketches.unique_visitors(start, product_id)
+        names = dict(Product.objects.filter(id__in=per_product).values_list('id', 'name'))
+        return Response({
+            'period': f'Last {days} days',
+            'unique_visitors': total,
+            # Estimates are within this fraction of the true count about
+            # two times in three, and within twice it 95% of the time
+            'standard_error': round(sketches.STANDARD_ERROR, 4),
+            'products': [
+                {'product': pk, 'product_name': names.get(pk), 'unique_visitors': count}
+                for pk, count in sorted(per_product.items(), key=lambda item: -item[1])
+            ]
+        })
+
+class CustomerRequestViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = CustomerRequest.objects.select_related('user')
     serializer_class = CustomerRequestSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = RequestQueuePagination
+    filter_backends = [SearchFilter, OrderingFilter]
+    search_fields = ['subject', 'user__username', 'user__email']
+    ordering_fields = ['created_at', 'updated_at']
+    ordering = RequestQueuePagination.ordering
+    field_sources = {
+        'username': ['user__username'],
+        'user_email': ['user__email'],
+        'response_time': ['status', 'created_at', 'updated_at'],
+    }
 
-class UpdateViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        # ``?status=open`` is the queue: pending and processing requests
+        queryset = super().get_queryset()
+        status = self.request.query_params.get('status', None)
+        if status == 'open':
+            queryset = queryset.filter(status__in=CustomerRequest.OPEN_STATUSES)
+        elif status:
+            queryset = queryset.filter(status__in=status.split(','))
+        request_type = self.request.query_params.get('request_type', None)
+        if request_type:
+            queryset = queryset.filter(request_type__in=request_type.split(','))
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """The open queue, and request counts and response times over the last ``days`` days, per request type"""
+        days, error = parse_days(request)
+        if error:
+            return error
+        return Response({
+            'period': f'Last {days} days',
+            **sla.summary(timezone.now() - timedelta(days=days)),
+        })
+
+class UpdateViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Update.objects.all()
     serializer_class = UpdateSerializer
     permission_classes = [permissions.IsAdminUser]
+    field_sources = {'uploaded_by_username': ['uploaded_by__username']}
 
     def perform_create(self, serializer):
-        serializer.save(uploaded_by=self.request.user)
+        update = serializer.save(
+            uploaded_by=self.request.user,
+            sha256=uploads.file_sha256(serializer.validated_data['file'])
+        )
+        patches.build_later(update)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """The update's file, with Range and ETag support"""
+        return downloads.serve(request, self.get_object())
+
+    @action(detail=True, methods=['get'])
+    def delta(self, request, pk=None):
+        """The patch from ``?from_version=`` to this update, if one was built"""
+        update = self.get_object()
+        from_version = request.query_params.get('from_version')
+        if not from_version:
+            return Response({'error': 'from_version is required'}, status=status.HTTP_400_BAD_REQUEST)
+        delta = patches.find(update, from_version)
+        if delta is None:
+            return Response(
+                {'error': f'No delta from version {from_version}', 'download': f'/api/dashboard/updates/{update.pk}/download/'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        response = FileResponse(delta.file.open('rb'), as_attachment=True, filename=delta.file.name.rsplit('/', 1)[-1])
+        response.headers['X-Source-Version'] = delta.source.version
+        response.headers['X-Target-SHA256'] = downloads.etag(update).strip('"')
+        return response
+
+class UpdateUploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                          mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """Chunked, resumable upload of an update file (see dashboard.uploads)"""
+    queryset = UpdateUpload.objects.all()
+    serializer_class = UpdateUploadSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(uploaded_by=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data['chunk_size'] = uploads.CHUNK_SIZE
+        return response
+
+    def perform_create(self, serializer):
+        uploads.start(serializer.save(uploaded_by=self.request.user))
+
+    def update(self, request, pk=None):
+        """Append the chunk in the body at ``?offset=``"""
+        upload = self.get_object()
+        try:
+            offset = int(request.query_params.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({'error': 'offset must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            received = uploads.write_chunk(upload, offset, request.stream, length)
+        except uploads.OffsetMismatch as error:
+            return Response({'error': str(error), 'received': error.received}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'received': received, 'size': upload.size})
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Create the Update once every byte has arrived and the hash matches"""
+        upload = self.get_object()
+        try:
+            update = uploads.complete(upload)
+        except uploads.UploadError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        patches.build_later(update)
+        return Response(UpdateSerializer(update, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+    def perform_destroy(self, instance):
+        uploads.abort(instance)
+
+def parse_days(request, maximum=MAX_ANALYTICS_DAYS, default=30):
+    """Read the ``days`` window; returns (days, error response)."""
+    try:
+        days = int(request.GET.get('days', default))
+    except ValueError:
+        return None, Response({'error': 'days must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= days <= maximum:
+        return None, Response(
+            {'error': f'days must be between 1 and {maximum}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return days, None
+
+def parse_windows(request, maximum=MAX_ANALYTICS_DAYS):
+    """Read a comma separated ``windows`` list of days; returns (windows, error response)."""
+    try:
+        windows = sorted({int(days) for days in request.GET['windows'].split(',')})
+    except ValueError:
+        return None, Response({'error': 'windows must be comma separated numbers'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(windows) > MAX_SALES_WINDOWS:
+        return None, Response(
+            {'error': f'At most {MAX_SALES_WINDOWS} windows can be requested'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not all(1 <= days <= maximum for days in windows):
+        return None, Response(
+            {'error': f'windows must be between 1 and {maximum} days'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return windows, None
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def get_sales_analytics(request):
-    """Get sales analytics with caching"""
-    days = int(request.GET.get('days', 30))
-    cache_key = f'sales_analytics_{days}'
+    """
+    Get sales analytics from the daily rollup, cached until orders change.
+    ``?windows=7,30,90`` returns several windows side by side, computed together.
+    """
+    several = 'windows' in request.GET
+    if several:
+        windows, error = parse_windows(request)
+    else:
+        days, error = parse_days(request)
+        windows = [days]
+    if error:
+        return error
+    if several:
+        cache_key = analytics_cache.cache_key('sales_analytics', 'windows', '-'.join(map(str, windows)))
+    else:
+        cache_key = analytics_cache.cache_key('sales_analytics', days)
     
-    # Try to get cached data
-    cached_data = cache.get(cache_key)
-    if cached_data:
+    # Keys embed the sales version, so a hit is always current
+    cached_data = analytics_cache.lookup('sales_analytics', cache_key)
+    if cached_data is not None:
         return Response(cached_data)
     
-    start_date = timezone.now() - timedelta(days=days)
-    orders = Order.objects.filter(created__gte=start_date, paid=True)
-    order_items = OrderItem.objects.filter(order__in=orders)
+    summary = rollups.sales_summary(windows)
+    results = {}
+    for days, figures in summary.items():
+        orders_count = figures['orders_count']
+        results[days] = SalesAnalyticsSerializer({
+            **figures,
+            'average_order_value': figures['total_sales'] / orders_count if orders_count > 0 else 0,
+            'period': f'Last {days} days',
+        }).data
     
-    total_sales = order_items.aggregate(total=Sum('price'))['total'] or 0
-    orders_count = orders.count()
-    average_order_value = total_sales / orders_count if orders_count > 0 else 0
+    if several:
+        data = {'windows': {str(days): results[days] for days in windows}}
+    else:
+        data = results[days]
     
-    # Get sales by category
-    sales_by_category = {}
-    categories = Category.objects.annotate(
-        total_sales=Sum('products__order_items__price', 
-                       filter=Q(products__order_items__order__in=orders))
-    )
-    for category in categories:
-        sales_by_category[category.name] = category.total_sales or 0
+    analytics_cache.save(cache_key, data)
     
-    # Get top products
-    top_products = Product.objects.filter(
-        order_items__order__in=orders
-    ).annotate(
-        total_sales=Count('order_items'),
-        revenue=Sum('order_items__price')
-    ).order_by('-revenue')[:5]
+    return Response(data)
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def run_batch(request):
+    """Several dashboard GETs in one round trip, optionally run concurrently (see dashboard.batch)"""
+    try:
+        items = batch.parse(request.data)
+    except batch.BatchError as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'responses': batch.run(request, items, concurrent=bool(request.data.get('concurrent')))})
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def get_cache_stats(request):
+    """Hit and miss counts of the versioned analytics cache"""
+    return Response(analytics_cache.stats())
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def get_sales_timeseries(request):
+    """Revenue, orders and units per hour, day, week or month as columnar arrays"""
+    granularity = request.GET.get('granularity', 'day')
+    if granularity not in rollups.GRANULARITIES:
+        return Response(
+            {'error': f"granularity must be one of {', '.join(rollups.GRANULARITIES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    maximum = MAX_HOURLY_DAYS if granularity == 'hour' else MAX_ANALYTICS_DAYS
+    days, error = parse_days(request, maximum=maximum)
+    if error:
+        return error
     
-    data = {
-        'total_sales': total_sales,
-        'orders_count': orders_count,
-        'average_order_value': average_order_value,
-        'period': f'Last {days} days',
-        'sales_by_category': sales_by_category,
-        'top_products': [
-            {
-                'name': p.name,
-                'sales': p.total_sales,
-                'revenue': p.revenue
-            }
-            for p in top_products
-        ]
-    }
+    filters = {}
+    for name in ('category', 'product'):
+        value = request.GET.get(name)
+        if value:
+            try:
+                filters[f'{name}_id'] = int(value)
+            except ValueError:
+                return Response({'error': f'{name} must be an id'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Cache the data for 1 hour
-    cache.set(cache_key, data, 3600)
+    return Response(rollups.sales_timeseries(granularity, days, **filters))
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def get_cohort_analytics(request):
+    """Retention, revenue and repeat purchases of monthly customer cohorts"""
+    try:
+        months = int(request.GET.get('months', 12))
+    except ValueError:
+        return Response({'error': 'months must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= months <= MAX_COHORT_MONTHS:
+        return Response(
+            {'error': f'months must be between 1 and {MAX_COHORT_MONTHS}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(cohorts.cohort_analytics(months))
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def get_search_stats(request):
+    """Most searched queries and most searched queries without results"""
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= limit <= search_stats.TOP_K:
+        return Response(
+            {'error': f'limit must be between 1 and {search_stats.TOP_K}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    serializer = SalesAnalyticsSerializer(data)
-    return Response(serializer.data)
+    stored = {sketch.name: sketch for sketch in SearchSketch.objects.all()}
+    data = {'total_searches': 0, 'updated_at': None}
+    for name, key in ((search_stats.SEARCHES, 'top'), (search_stats.ZERO_RESULTS, 'zero_results')):
+        sketch = stored.get(name)
+        data[key] = [
+            {'query': query, 'count': count}
+            for query, count in (sketch.top[:limit] if sketch else [])
+        ]
+    if search_stats.SEARCHES in stored:
+        data['total_searches'] = stored[search_stats.SEARCHES].total
+        data['updated_at'] = stored[search_stats.SEARCHES].updated_at
+    return Response(data)
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
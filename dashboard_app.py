@@ -1,3 +1,5 @@
+import hashlib
+import os
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                            QHBoxLayout, QPushButton, QLabel, QLineEdit,
@@ -9,15 +11,19 @@ import requests
 import json
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import matplotlib.pyplot as plt
-import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
+from dashboard.delta import DeltaError, apply_delta
 
 class APIClient:
+    UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
     def __init__(self):
         self.token = None
         self.session = requests.Session()
+        # Unfinished chunked uploads by (file path, SHA-256), to resume them
+        self.pending_uploads = {}
         self.base_url = 'http://localhost:8080'
-        self.debug = True  # Enable debug mode for better error messages
+        self.debug = False  # Set to print every request and response
     
     def set_token(self, token):
         self.token = token
@@ -72,9 +78,37 @@ class APIClient:
         return result if success else None
     
     def get_requests(self):
-        """Get customer requests"""
-        success, result = self.make_request('GET', '/api/dashboard/requests/')
-        return result if success else None
+        """Get customer requests, only the columns the table shows"""
+        success, result = self.make_request(
+            'GET',
+            '/api/dashboard/requests/',
+            params={'fields': 'id,username,request_type,status,created_at', 'page_size': 200}
+        )
+        return result['results'] if success else None
+    
+    def batch(self, requests, concurrent=True):
+        """
+        Run several dashboard GETs in one round trip. ``requests`` maps an id
+        to (path, params); returns the bodies of the successful ones by id.
+        """
+        success, result = self.make_request(
+            'POST',
+            '/api/dashboard/batch/',
+            json={
+                'requests': [
+                    {'id': request_id, 'path': path, 'params': params}
+                    for request_id, (path, params) in requests.items()
+                ],
+                'concurrent': concurrent,
+            }
+        )
+        if not success or not isinstance(result, dict) or 'responses' not in result:
+            return {}
+        return {
+            request_id: response['body']
+            for request_id, response in result['responses'].items()
+            if response['status'] == 200
+        }
     
     def get_sales_analytics(self, days=30):
         """Get sales analytics data"""
@@ -85,21 +119,172 @@ class APIClient:
         )
         return result if success else None
     
-    def upload_update(self, file_path, data):
-        """Upload a file update"""
+    def get_sales_summary(self, windows=(7, 30, 90)):
+        """Get sales analytics for several windows in one request"""
+        success, result = self.make_request(
+            'GET',
+            '/api/dashboard/sales/',
+            params={'windows': ','.join(map(str, windows))}
+        )
+        return result['windows'] if success else None
+    
+    def get_sales_timeseries(self, granularity='day', days=7, category=None, product=None):
+        """Get revenue, orders and units per time bucket"""
+        params = {'granularity': granularity, 'days': days}
+        if category:
+            params['category'] = category
+        if product:
+            params['product'] = product
+        success, result = self.make_request(
+            'GET',
+            '/api/dashboard/sales/timeseries/',
+            params=params
+        )
+        return result if success else None
+    
+    def upload_update(self, file_path, data, retries=3):
+        """
+        Upload an update file in chunks. A failed chunk is retried from
+        wherever the server says the upload stands, and uploading the same
+        file again resumes an upload that ran out of retries.
+        """
+        try:
+            size = os.path.getsize(file_path)
+            sha256 = self.file_sha256(file_path)
+        except IOError as e:
+            return False, f"File error: {str(e)}"
+
+        key = (file_path, sha256)
+        status = None
+        if key in self.pending_uploads:
+            status = self.upload_status(self.pending_uploads[key])
+        if status is None:
+            success, status = self.make_request(
+                'POST',
+                '/api/dashboard/update-uploads/',
+                json={**data, 'filename': os.path.basename(file_path), 'size': size, 'sha256': sha256}
+            )
+            if not success or not isinstance(status, dict) or 'id' not in status:
+                return False, status
+            self.pending_uploads[key] = status['id']
+        upload_url = f"/api/dashboard/update-uploads/{status['id']}/"
+        chunk_size = status.get('chunk_size', self.UPLOAD_CHUNK_SIZE)
+        offset = status['received']
+
+        failures = 0
         try:
             with open(file_path, 'rb') as f:
-                files = {'file': f}
-                success, result = self.make_request(
-                    'POST',
-                    '/api/dashboard/updates/',
-                    data=data,
-                    files=files
-                )
-                return success, result
+                while offset < size:
+                    f.seek(offset)
+                    success, result = self.make_request(
+                        'PUT',
+                        upload_url,
+                        params={'offset': offset},
+                        data=f.read(chunk_size),
+                        headers={'Content-Type': 'application/octet-stream'}
+                    )
+                    if success and isinstance(result, dict) and 'received' in result:
+                        # Also what the server answers to a chunk at the wrong offset
+                        offset = result['received']
+                        continue
+                    failures += 1
+                    if failures > retries:
+                        return False, result
+                    current = self.upload_status(status['id'])
+                    if current is not None:
+                        offset = current['received']
+        except IOError as e:
+            return False, f"File error: {str(e)}"
+
+        success, result = self.make_request('POST', upload_url + 'complete/')
+        if success and isinstance(result, dict) and 'sha256' in result:
+            del self.pending_uploads[key]
+            return True, result
+        return False, result
+
+    def download_update(self, update_id, file_path):
+        """
+        Download an update's file. An interrupted download resumes from the
+        partial copy, and a local copy that is still current isn't fetched
+        again. The ETag is kept next to the file in ``<file_path>.etag``.
+        """
+        url = f"{self.base_url}/api/dashboard/updates/{update_id}/download/"
+        partial_path = file_path + '.part'
+        etag_path = file_path + '.etag'
+        etag = None
+        if os.path.exists(etag_path):
+            with open(etag_path) as f:
+                etag = f.read().strip() or None
+
+        headers = {}
+        if etag and os.path.exists(file_path):
+            headers['If-None-Match'] = etag
+        elif etag and os.path.exists(partial_path):
+            headers['Range'] = f'bytes={os.path.getsize(partial_path)}-'
+            headers['If-Range'] = etag
+        try:
+            with self.session.get(url, headers=headers, stream=True) as response:
+                if response.status_code == 304:
+                    return True, file_path
+                if response.status_code not in (200, 206):
+                    return False, f"Download failed with status {response.status_code}"
+                with open(etag_path, 'w') as f:
+                    f.write(response.headers.get('ETag', ''))
+                # 206 continues the partial copy, 200 starts over
+                with open(partial_path, 'ab' if response.status_code == 206 else 'wb') as f:
+                    for block in response.iter_content(1024 * 1024):
+                        f.write(block)
+            os.replace(partial_path, file_path)
+            return True, file_path
+        except requests.exceptions.RequestException as e:
+            return False, f"Download interrupted, call again to resume: {str(e)}"
         except IOError as e:
             return False, f"File error: {str(e)}"
 
+    def patch_update(self, update_id, current_path, current_version, file_path):
+        """
+        Bring the copy of an update at ``current_path`` (version
+        ``current_version``) up to date as ``file_path`` using the server's
+        delta. The patched file must hash to what the server expects; without
+        a usable delta the whole file is downloaded instead.
+        """
+        url = f"{self.base_url}/api/dashboard/updates/{update_id}/delta/"
+        try:
+            response = self.session.get(url, params={'from_version': current_version})
+            if response.status_code != 200:
+                return self.download_update(update_id, file_path)
+            with open(current_path, 'rb') as f:
+                patched = apply_delta(f.read(), response.content)
+            if hashlib.sha256(patched).hexdigest() != response.headers.get('X-Target-SHA256'):
+                return self.download_update(update_id, file_path)
+            with open(file_path + '.part', 'wb') as f:
+                f.write(patched)
+            os.replace(file_path + '.part', file_path)
+            with open(file_path + '.etag', 'w') as f:
+                f.write(f'"{response.headers["X-Target-SHA256"]}"')
+            return True, file_path
+        except DeltaError:
+            return self.download_update(update_id, file_path)
+        except requests.exceptions.RequestException as e:
+            return False, f"Request failed: {str(e)}"
+        except IOError as e:
+            return False, f"File error: {str(e)}"
+
+    def upload_status(self, upload_id):
+        """The server's view of an unfinished upload, None if it is gone"""
+        success, result = self.make_request('GET', f'/api/dashboard/update-uploads/{upload_id}/')
+        if success and isinstance(result, dict) and 'received' in result:
+            return result
+        return None
+
+    @staticmethod
+    def file_sha256(file_path):
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+
 class DashboardWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -219,24 +404,19 @@ class DashboardWindow(QMainWindow):
         charts_widget = QWidget()
         charts_layout = QHBoxLayout(charts_widget)
 
-        # Sales chart
+        # Sales chart, filled by update_sales_chart
         fig1, ax1 = plt.subplots(figsize=(6, 4))
-        dates = [datetime.now() - timedelta(days=x) for x in range(7)]
-        values = [100, 120, 95, 134, 156, 145, 162]
-        ax1.plot(dates, values)
         ax1.set_title('Weekly Sales')
         canvas1 = FigureCanvas(fig1)
         charts_layout.addWidget(canvas1)
+        self.sales_chart = (ax1, canvas1)
 
-        # Products chart
+        # Products chart, filled by update_products_chart
         fig2, ax2 = plt.subplots(figsize=(6, 4))
-        products = ['Laptop', 'Mouse', 'Keyboard', 'Monitor', 'Headphones']
-        values = [45, 32, 28, 21, 18]
-        ax2.bar(products, values)
         ax2.set_title('Top Selling Products')
-        plt.xticks(rotation=45)
         canvas2 = FigureCanvas(fig2)
         charts_layout.addWidget(canvas2)
+        self.products_chart = (ax2, canvas2)
 
         layout.addWidget(charts_widget)
         self.content_stack.addWidget(overview_page)
@@ -310,24 +490,26 @@ class DashboardWindow(QMainWindow):
         charts_widget = QWidget()
         charts_layout = QHBoxLayout(charts_widget)
 
-        # Sales trend
+        # Sales trend, filled by update_trend_chart
         fig1, ax1 = plt.subplots(figsize=(6, 4))
-        dates = [datetime.now() - timedelta(days=x) for x in range(30)]
-        values = np.random.normal(1000, 100, 30)
-        ax1.plot(dates, values)
         ax1.set_title('30-Day Sales Trend')
-        plt.xticks(rotation=45)
         canvas1 = FigureCanvas(fig1)
         charts_layout.addWidget(canvas1)
+        self.trend_chart = (ax1, canvas1)
 
-        # Category distribution
+        # Category distribution, filled by update_category_chart
         fig2, ax2 = plt.subplots(figsize=(6, 4))
-        categories = ['Electronics', 'Accessories', 'Software', 'Services']
-        sales = [4500, 2300, 1800, 1200]
-        ax2.pie(sales, labels=categories, autopct='%1.1f%%')
         ax2.set_title('Sales by Category')
         canvas2 = FigureCanvas(fig2)
         charts_layout.addWidget(canvas2)
+        self.category_chart = (ax2, canvas2)
+
+        # Most viewed products, filled by update_analytics_charts
+        fig3, ax3 = plt.subplots(figsize=(6, 4))
+        ax3.set_title('Most Viewed Products')
+        canvas3 = FigureCanvas(fig3)
+        charts_layout.addWidget(canvas3)
+        self.views_chart = (ax3, canvas3)
 
         layout.addWidget(charts_widget)
         self.content_stack.addWidget(analytics_page)
@@ -360,32 +542,94 @@ class DashboardWindow(QMainWindow):
             QMessageBox.warning(self, "Login Failed", error or "Failed to connect to server")
 
     def update_dashboard_data(self):
+        # Everything the pages show, in one round trip
+        data = self.api_client.batch({
+            'sales': ('/api/dashboard/sales/', {'days': 30}),
+            'weekly': ('/api/dashboard/sales/timeseries/', {'days': 7}),
+            'monthly': ('/api/dashboard/sales/timeseries/', {'days': 30}),
+            'requests': ('/api/dashboard/requests/', {
+                'fields': 'id,username,request_type,status,created_at', 'page_size': 200
+            }),
+            'analytics': ('/api/dashboard/analytics/', {'fields': 'product_name,views,cart_additions,purchases'}),
+        })
+        
         # Update overview data
-        sales_data = self.api_client.get_sales_analytics()
-        if sales_data:
-            self.update_overview_stats(sales_data)
+        if data.get('sales'):
+            self.update_overview_stats(data['sales'])
+        
+        # Update sales charts from the time series endpoint
+        if data.get('weekly'):
+            self.update_sales_chart(data['weekly'])
+        if data.get('monthly'):
+            self.update_trend_chart(data['monthly'])
         
         # Update requests data
-        requests_data = self.api_client.get_requests()
-        if requests_data:
-            self.update_requests_table(requests_data)
+        if data.get('requests'):
+            self.update_requests_table(data['requests']['results'])
         
         # Update analytics data
-        analytics_data = self.api_client.get_analytics()
-        if analytics_data:
-            self.update_analytics_charts(analytics_data)
+        if data.get('analytics'):
+            self.update_analytics_charts(data['analytics'])
 
     def update_overview_stats(self, data):
         if not hasattr(self, 'stats_values'):
             return
         
         self.stats_values['Total Sales'].setText(f"${data['total_sales']}")
-        self.stats_values['Orders'].setText(str(data['orders_count']))
-        self.stats_values['Avg Order'].setText(f"${data['average_order_value']}")
+        self.stats_values['New Orders'].setText(str(data['orders_count']))
         
         # Update charts
-        self.update_sales_chart(data.get('sales_by_day', []))
         self.update_products_chart(data.get('top_products', []))
+        self.update_category_chart(data.get('sales_by_category', {}))
+
+    def _plot_series(self, chart, series, title):
+        ax, canvas = chart
+        ax.clear()
+        dates = [datetime.fromisoformat(bucket) for bucket in series['buckets']]
+        ax.plot(dates, series['revenue'])
+        ax.set_title(title)
+        ax.tick_params(axis='x', labelrotation=45)
+        canvas.draw()
+
+    def update_sales_chart(self, series):
+        self._plot_series(self.sales_chart, series, 'Weekly Sales')
+
+    def update_trend_chart(self, series):
+        self._plot_series(self.trend_chart, series, '30-Day Sales Trend')
+
+    def update_products_chart(self, top_products):
+        ax, canvas = self.products_chart
+        ax.clear()
+        ax.bar([p['name'] for p in top_products], [p['sales'] for p in top_products])
+        ax.set_title('Top Selling Products')
+        ax.tick_params(axis='x', labelrotation=45)
+        canvas.draw()
+
+    def update_category_chart(self, sales_by_category):
+        ax, canvas = self.category_chart
+        ax.clear()
+        values = {name: float(total) for name, total in sales_by_category.items() if float(total) > 0}
+        if values:
+            ax.pie(list(values.values()), labels=list(values.keys()), autopct='%1.1f%%')
+        ax.set_title('Sales by Category')
+        canvas.draw()
+
+    def update_analytics_charts(self, analytics, top=10):
+        ax, canvas = self.views_chart
+        ax.clear()
+        rows = sorted(analytics, key=lambda row: row['views'], reverse=True)[:top]
+        names = [row['product_name'] for row in rows]
+        positions = range(len(rows))
+        width = 0.25
+        for shift, (field, label) in enumerate((('views', 'Views'), ('cart_additions', 'Cart additions'),
+                                                ('purchases', 'Purchases'))):
+            ax.bar([x + (shift - 1) * width for x in positions], [row[field] for row in rows], width, label=label)
+        ax.set_xticks(list(positions))
+        ax.set_xticklabels(names, rotation=45, ha='right')
+        if rows:
+            ax.legend()
+        ax.set_title('Most Viewed Products')
+        canvas.draw()
 
     def update_requests_table(self, requests):
         table = self.findChild(QTableWidget)
@@ -86,6 +86,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts so concurrent
+            # checkouts queue on the busy timeout instead of failing
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # File-backed so tests can exercise real concurrent connections
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -145,6 +155,12 @@ LOGIN_URL = '/users/login/'  # Login page URL
 
 # Cart settings
 CART_SESSION_ID = 'cart'
+CART_HOLD_MINUTES = 15  # How long cart items keep their stock reserved
+
+# Product event counters (dashboard.events) are written in batches
+ANALYTICS_FLUSH_SIZE = 500  # Events buffered per worker before a flush
+ANALYTICS_FLUSH_SECONDS = 5  # Longest an event waits in the buffer
+SEARCH_STATS_FLUSH_SECONDS = 30  # How often workers add their search counts (store.search_stats)
 
 # REST Framework settings
 REST_FRAMEWORK = {
@@ -170,13 +186,25 @@ REST_FRAMEWORK = {
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 CORS_ALLOW_CREDENTIALS = True
 
-# Cache settings
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Cache settings. Version tokens (store.versioning) only reach every worker
+# through a shared cache: set REDIS_URL when running more than one worker.
+# The local memory cache suits a single process; derived data is then kept
+# for at most CACHE_LOCAL_MAX_AGE seconds.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
     }
-}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
+    }
+CACHE_LOCAL_MAX_AGE = 60
 
 # Cache timeouts
 CACHE_MIDDLEWARE_SECONDS = 300  # 5 minutes
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Category, Product, Order, OrderItem, Review, ProductImage, ProductSpecification
+from .orders import mark_orders_paid, transition_orders
+from .models import Category, Product, Order, OrderItem, OrderStatusLog, Review, ProductImage, ProductSpecification, PromoCode, StockReservation, deferred_order_totals
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -17,12 +18,56 @@ class OrderItemInline(admin.TabularInline):
     model = OrderItem
     raw_id_fields = ['product']
 
+class OrderStatusLogInline(admin.TabularInline):
+    model = OrderStatusLog
+    fields = ['created_at', 'from_status', 'to_status', 'changed_by']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'created_at', 'updated_at', 'paid', 'status']
+    list_display = ['id', 'user', 'created_at', 'updated_at', 'item_count', 'total_amount', 'paid', 'status']
     list_filter = ['paid', 'created_at', 'updated_at', 'status']
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, OrderStatusLogInline]
     search_fields = ['id', 'user__username', 'shipping_address']
+    # Status only changes through the transitions, which keep the audit log,
+    # and payment through mark_paid, which records the sale
+    readonly_fields = ['status', 'paid']
+    actions = ['mark_paid', 'mark_processing', 'mark_shipped', 'mark_delivered', 'mark_cancelled']
+
+    def save_related(self, request, form, formsets, change):
+        # One totals update for the order, not one per inline item
+        with deferred_order_totals():
+            super().save_related(request, form, formsets, change)
+
+    @admin.action(description='Mark selected orders as paid')
+    def mark_paid(self, request, queryset):
+        changed = mark_orders_paid(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'{len(changed)} orders marked as paid.')
+
+    def _transition(self, request, queryset, status):
+        changed, rejected = transition_orders(list(queryset.values_list('pk', flat=True)), status, request.user)
+        self.message_user(request, f'{len(changed)} orders marked as {status}, {len(rejected)} skipped.')
+
+    @admin.action(description='Mark selected orders as processing')
+    def mark_processing(self, request, queryset):
+        self._transition(request, queryset, 'processing')
+
+    @admin.action(description='Mark selected orders as shipped')
+    def mark_shipped(self, request, queryset):
+        self._transition(request, queryset, 'shipped')
+
+    @admin.action(description='Mark selected orders as delivered')
+    def mark_delivered(self, request, queryset):
+        self._transition(request, queryset, 'delivered')
+
+    @admin.action(description='Mark selected orders as cancelled')
+    def mark_cancelled(self, request, queryset):
+        self._transition(request, queryset, 'cancelled')
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
@@ -41,3 +86,19 @@ class ProductSpecificationAdmin(admin.ModelAdmin):
     list_display = ['product', 'name', 'value']
     list_filter = ['product']
     search_fields = ['product__name', 'name', 'value']
+
+@admin.register(PromoCode)
+class PromoCodeAdmin(admin.ModelAdmin):
+    list_display = ['code', 'discount_type', 'value', 'category', 'minimum_spend',
+                    'times_used', 'usage_limit', 'valid_from', 'valid_until', 'active']
+    list_filter = ['discount_type', 'active', 'category']
+    list_editable = ['active']
+    readonly_fields = ['times_used']
+    search_fields = ['code']
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'cart_token', 'quantity', 'expires_at']
+    list_filter = ['expires_at']
+    raw_id_fields = ['product']
+    search_fields = ['product__name', 'cart_token']
@@ -0,0 +1,142 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks never touch the development database: ``benchmark_database``
+creates a throwaway copy of the test database, runs the block and drops it.
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from .cart import Cart
+from .models import Category, Product
+
+
+@contextmanager
+def benchmark_database():
+    setup_test_environment()
+    # create_test_db returns the test database's name, not the one it replaces
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def seed_catalog(products=1000, categories=20, stock=10 ** 6):
+    """Create a catalog of ``products`` products spread over ``categories``."""
+    category_objs = Category.objects.bulk_create(
+        Category(name=f'Category {i}', slug=f'category-{i}') for i in range(categories)
+    )
+    Product.objects.bulk_create(
+        (
+            Product(
+                category=category_objs[i % categories],
+                name=f'Product {i}',
+                slug=f'product-{i}',
+                description=f'Benchmark product number {i}',
+                price=Decimal(10 + i % 90),
+                stock=stock
+            )
+            for i in range(products)
+        ),
+        batch_size=500
+    )
+    return list(Product.objects.order_by('id'))
+
+
+def benchmark_user(username='bench'):
+    return User.objects.create_user(username, f'{username}@example.com', 'bench-pass')
+
+
+def session_cart():
+    """A Cart backed by a fresh session, without going through a view."""
+    request = RequestFactory().get('/')
+    request.session = SessionStore()
+    return Cart(request)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def measure(request, iterations, setup=None, alloc_iterations=20):
+    """
+    Time ``request()`` and count its queries; ``setup()`` runs untimed before
+    each call. Allocations (peak traced bytes per call) are sampled in a
+    separate tracemalloc pass so the tracing overhead does not leak into the
+    latencies.
+    """
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        with CaptureQueriesContext(connection) as ctx, Timer() as timer:
+            request()
+        timings.append(timer.elapsed)
+        queries.append(len(ctx.captured_queries))
+
+    allocated = []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_iterations):
+            if setup:
+                setup()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            request()
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'queries_per_request': max(queries),
+        'alloc_kib_per_request': round(sum(allocated) / max(len(allocated), 1) / 1024, 1),
+    }
+
+
+def find_regressions(baseline, current, threshold):
+    """
+    Compare two result sets. Latency and allocations may grow by ``threshold``
+    percent; any extra query is a regression.
+    """
+    regressions = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'alloc_kib_per_request'):
+            if result[metric] > base[metric] * (1 + threshold / 100):
+                regressions.append(f'{name}: {metric} {base[metric]} -> {result[metric]}')
+        if result['queries_per_request'] > base['queries_per_request']:
+            regressions.append(
+                f"{name}: queries_per_request {base['queries_per_request']} -> {result['queries_per_request']}"
+            )
+    return regressions
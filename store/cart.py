@@ -1,6 +1,8 @@
+import uuid
 from decimal import Decimal
 from django.conf import settings
 from .models import Product
+from . import inventory, promotions
 
 class Cart:
     def __init__(self, request):
@@ -13,29 +15,43 @@ class Cart:
             # save an empty cart in the session
             cart = self.session[settings.CART_SESSION_ID] = {}
         self.cart = cart
-        # Initialize discount and shipping flags
-        self.discount_percentage = self.session.get('discount_percentage', 0)
-        self.free_shipping = self.session.get('free_shipping', False)
+        # Promo codes applied to the cart
+        self.promo_codes = self.session.get('promo_codes', [])
+
+    @property
+    def token(self):
+        """
+        Identifier the cart's stock holds are stored under. Kept in the session
+        data (not the session key) so it survives the key rotation on login.
+        """
+        token = self.session.get('cart_token')
+        if not token:
+            token = self.session['cart_token'] = uuid.uuid4().hex
+        return token
 
     def add(self, product, quantity=1, update_quantity=False):
         """
         Add a product to the cart or update its quantity.
+        Raises inventory.InsufficientStock if the units cannot be reserved.
         """
         product_id = str(product.id)
+        current = self.cart[product_id]['quantity'] if product_id in self.cart else 0
+        new_quantity = quantity if update_quantity else current + quantity
+        inventory.set_hold(self.token, product.id, new_quantity)
         if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 0, 'price': str(product.price)}
-        if update_quantity:
-            self.cart[product_id]['quantity'] = quantity
-        else:
-            self.cart[product_id]['quantity'] += quantity
+            self.cart[product_id] = {
+                'quantity': 0,
+                'price': str(product.price),
+                'category_id': product.category_id
+            }
+        self.cart[product_id]['quantity'] = new_quantity
         self.save()
 
     def save(self):
         # mark the session as "modified" to make sure it gets saved
         self.session.modified = True
-        # Save discount and shipping flags to session
-        self.session['discount_percentage'] = self.discount_percentage
-        self.session['free_shipping'] = self.free_shipping
+        # Save applied promo codes to session
+        self.session['promo_codes'] = self.promo_codes
 
     def remove(self, product):
         """
@@ -43,6 +59,7 @@ class Cart:
         """
         product_id = str(product.id)
         if product_id in self.cart:
+            inventory.set_hold(self.token, product.id, 0)
             del self.cart[product_id]
             self.save()
 
@@ -53,7 +70,8 @@ class Cart:
         product_ids = self.cart.keys()
         # get the product objects and add them to the cart
         products = Product.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
+        # copy the items too, the session must only ever hold JSON values
+        cart = {product_id: dict(item) for product_id, item in self.cart.items()}
         for product in products:
             cart[str(product.id)]['product'] = product
         for item in cart.values():
@@ -71,30 +89,28 @@ class Cart:
         """
         Calculate total cost of items in cart.
         """
-        subtotal = sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        subtotal = self.get_subtotal()
+        promo = self.get_promotions()
         
         # Apply discount if any
-        if self.discount_percentage > 0:
-            discount = (subtotal * Decimal(self.discount_percentage)) / 100
-            subtotal -= discount
+        subtotal -= promo.discount
         
         # Add shipping if required
-        if not self.free_shipping and subtotal < 50:
+        if not promo.free_shipping and subtotal < 50:
             subtotal += Decimal('5.00')  # $5 shipping
         
         return subtotal
 
-    def clear(self):
+    def clear(self, release_stock=True):
         """
-        Remove cart from session.
+        Remove cart from session. Pass release_stock=False once the holds have
+        been committed to an order.
         """
+        if release_stock and 'cart_token' in self.session:
+            inventory.release_holds(self.session['cart_token'])
         del self.session[settings.CART_SESSION_ID]
-        if 'discount_percentage' in self.session:
-            del self.session['discount_percentage']
-        if 'free_shipping' in self.session:
-            del self.session['free_shipping']
-        self.discount_percentage = 0
-        self.free_shipping = False
+        self.session.pop('cart_token', None)
+        self.promo_codes = []
         self.save()
     
     # Additional cart methods referenced in views.py
@@ -108,31 +124,53 @@ class Cart:
             return Decimal(self.cart[product_id]['price']) * self.cart[product_id]['quantity']
         return 0
     
-    def has_discount(self):
+    def _promo_lines(self):
+        return [
+            (item.get('category_id'), Decimal(item['price']), item['quantity'])
+            for item in self.cart.values()
+        ]
+    
+    def get_promotions(self):
         """
-        Check if the cart has a discount applied
+        Evaluate the applied promo codes against the cart (no queries)
         """
-        return self.discount_percentage > 0
+        return promotions.get_evaluator().evaluate(self.promo_codes, self._promo_lines())
     
-    def apply_discount(self, percentage):
+    def apply_promo(self, code):
         """
-        Apply a percentage discount to the cart
+        Apply a promo code to the cart. Raises promotions.PromoError with a
+        user facing message if the code cannot be used.
         """
-        self.discount_percentage = percentage
+        rule = promotions.get_evaluator().validate(code, self.promo_codes, self._promo_lines())
+        self.promo_codes.append(rule.code)
         self.save()
+        return rule
     
-    def has_free_shipping(self):
+    def remove_promo(self, code):
         """
-        Check if the cart has free shipping
+        Remove a promo code from the cart
         """
-        return self.free_shipping or self.get_subtotal() >= 50
+        if code in self.promo_codes:
+            self.promo_codes.remove(code)
+            self.save()
     
-    def apply_free_shipping(self):
+    def get_discount(self):
         """
-        Apply free shipping to the cart
+        Get the amount taken off by promo codes
         """
-        self.free_shipping = True
-        self.save()
+        return self.get_promotions().discount
+    
+    def has_discount(self):
+        """
+        Check if the cart has a discount applied
+        """
+        return self.get_discount() > 0
+    
+    def has_free_shipping(self):
+        """
+        Check if the cart has free shipping
+        """
+        return self.get_promotions().free_shipping or self.get_subtotal() >= 50
     
     def get_subtotal(self):
         """
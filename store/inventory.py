@@ -0,0 +1,226 @@
+"""
+Stock reservations.
+
+``Product.stock`` holds the units that are still free to sell. Putting a
+product in the cart moves units out of ``stock`` into a time-limited
+``StockReservation``; checkout consumes the reservation and holds that expire
+are handed back to stock. Every stock change is a conditional
+``UPDATE ... SET stock = stock - q WHERE stock >= q`` so concurrent requests
+never oversell and never need ``select_for_update`` (which would serialize
+everything on SQLite).
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Product, StockReservation
+
+
+class InsufficientStock(Exception):
+    """Raised when a product cannot cover the requested quantity."""
+
+    def __init__(self, product_id, quantity):
+        self.product_id = product_id
+        self.quantity = quantity
+        super().__init__(f'Not enough stock for product {product_id} (requested {quantity})')
+
+
+def hold_expiry():
+    return timezone.now() + timedelta(minutes=getattr(settings, 'CART_HOLD_MINUTES', 15))
+
+
+def take_stock(product_id, quantity):
+    """
+    Remove ``quantity`` units from stock if (and only if) they are available.
+    """
+    if quantity <= 0:
+        return True
+    return Product.objects.filter(
+        id=product_id, stock__gte=quantity
+    ).update(stock=F('stock') - quantity) == 1
+
+
+def return_stock(product_id, quantity):
+    """
+    Put ``quantity`` units back into stock.
+    """
+    if quantity > 0:
+        Product.objects.filter(id=product_id).update(stock=F('stock') + quantity)
+
+
+def set_stock_levels(levels):
+    """
+    Set the stock of many products at once. ``levels`` maps product ids to the
+    units counted in the warehouse; units held by carts are still in the
+    warehouse but not free to sell, so they are subtracted (never below 0).
+    Products already at their level are left alone, the rest are written with
+    ``bulk_update`` in one transaction. Returns the number of products changed.
+    """
+    with transaction.atomic():
+        held = dict(
+            StockReservation.objects.filter(product_id__in=list(levels))
+            .values('product_id').annotate(units=Sum('quantity'))
+            .values_list('product_id', 'units')
+        )
+        current = dict(Product.objects.filter(id__in=list(levels)).values_list('id', 'stock'))
+        changed = []
+        for product_id, units in levels.items():
+            stock = max(units - held.get(product_id, 0), 0)
+            if current.get(product_id, stock) != stock:
+                changed.append(Product(id=product_id, stock=stock))
+        Product.objects.bulk_update(changed, ['stock'])
+    return len(changed)
+
+
+def _take_or_raise(product_id, quantity):
+    if take_stock(product_id, quantity):
+        return
+    # Stale holds may be sitting on the units we need
+    if release_expired(product_ids=[product_id]) and take_stock(product_id, quantity):
+        return
+    raise InsufficientStock(product_id, quantity)
+
+
+def set_hold(cart_token, product_id, quantity):
+    """
+    Make the cart's hold on a product exactly ``quantity`` units, taking or
+    returning the difference. A quantity of 0 drops the hold.
+    """
+    if quantity < 0:
+        raise ValueError(f'Cannot hold {quantity} units')
+    with transaction.atomic():
+        hold = StockReservation.objects.filter(
+            product_id=product_id, cart_token=cart_token
+        ).first()
+        held = hold.quantity if hold else 0
+
+        if quantity > held:
+            _take_or_raise(product_id, quantity - held)
+        elif quantity < held:
+            return_stock(product_id, held - quantity)
+
+        if hold is None:
+            if quantity:
+                StockReservation.objects.create(
+                    product_id=product_id,
+                    cart_token=cart_token,
+                    quantity=quantity,
+                    expires_at=hold_expiry()
+                )
+            return
+
+        # Only touch the hold if the expiry job has not released it meanwhile
+        holds = StockReservation.objects.filter(pk=hold.pk, quantity=held)
+        if quantity:
+            changed = holds.update(quantity=quantity, expires_at=hold_expiry())
+        else:
+            changed = holds.delete()[0]
+        if not changed:
+            # The old units went back to stock, so take them again
+            _take_or_raise(product_id, held)
+            if quantity:
+                StockReservation.objects.update_or_create(
+                    product_id=product_id,
+                    cart_token=cart_token,
+                    defaults={'quantity': quantity, 'expires_at': hold_expiry()}
+                )
+
+
+def release_holds(cart_token):
+    """
+    Drop every hold of a cart and return the units to stock.
+    """
+    with transaction.atomic():
+        for hold in StockReservation.objects.filter(cart_token=cart_token):
+            _release(hold)
+
+
+class _HoldsChanged(Exception):
+    pass
+
+
+def commit_holds(cart_token, lines):
+    """
+    Turn the cart's holds into sold units. ``lines`` maps product ids to the
+    quantities being ordered.
+
+    A line whose hold is still in place (expired or not) is paid for by that
+    hold; otherwise the units are taken from stock directly. Must run inside
+    the order transaction so a failing line rolls back every other line.
+    """
+    holds = {
+        hold.product_id: hold
+        for hold in StockReservation.objects.filter(cart_token=cart_token)
+    }
+    covered = {
+        product_id: holds[product_id].pk
+        for product_id, quantity in lines.items()
+        if product_id in holds and holds[product_id].quantity == quantity
+    }
+    try:
+        with transaction.atomic():
+            # Consume every matching hold in one statement
+            deleted = StockReservation.objects.filter(pk__in=covered.values()).delete()[0]
+            if deleted != len(covered):
+                raise _HoldsChanged
+    except _HoldsChanged:
+        # The expiry job got in between, settle line by line instead
+        _commit_lines(cart_token, lines)
+        return
+
+    for product_id, quantity in lines.items():
+        if product_id in covered:
+            continue
+        # No matching hold: hand back whatever is left and take the full amount
+        if product_id in holds:
+            _release(holds[product_id])
+        _take_or_raise(product_id, quantity)
+
+
+def _commit_lines(cart_token, lines):
+    for product_id, quantity in lines.items():
+        consumed = StockReservation.objects.filter(
+            product_id=product_id, cart_token=cart_token, quantity=quantity
+        ).delete()[0]
+        if consumed:
+            continue
+        for hold in StockReservation.objects.filter(product_id=product_id, cart_token=cart_token):
+            _release(hold)
+        _take_or_raise(product_id, quantity)
+
+
+def _release(hold):
+    # Conditional delete, so a hold consumed or updated concurrently is left alone
+    if StockReservation.objects.filter(pk=hold.pk, quantity=hold.quantity).delete()[0]:
+        return_stock(hold.product_id, hold.quantity)
+        return hold.quantity
+    return 0
+
+
+def release_expired(product_ids=None):
+    """
+    Return the units of expired holds (of ``product_ids``, or all) to stock.
+    Returns the number of units released.
+    """
+    expired = StockReservation.objects.filter(expires_at__lte=timezone.now())
+    if product_ids is not None:
+        expired = expired.filter(product_id__in=product_ids)
+    released = 0
+    with transaction.atomic():
+        for hold in expired:
+            released += _release(hold)
+    return released
+
+
+def refresh_sold_out(products):
+    """
+    Release the expired holds of those ``products`` that show as sold out and
+    update their ``stock`` in place, so carts abandoned since the last run of
+    ``release_stock_holds`` can't keep a product off sale.
+    """
+    sold_out = {product.pk: product for product in products if product.stock <= 0}
+    if not sold_out or not release_expired(product_ids=list(sold_out)):
+        return
+    for product_id, stock in Product.objects.filter(pk__in=list(sold_out)).values_list('pk', 'stock'):
+        sold_out[product_id].stock = stock
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from store.benchmarks import (benchmark_database, seed_catalog, benchmark_user,
+                              session_cart, percentile, Timer)
+from store.orders import place_order
+
+
+class Command(BaseCommand):
+    help = 'Measure order placement throughput (orders/sec) on a throwaway database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200, help='Number of orders to place')
+        parser.add_argument('--lines', type=int, default=50, help='Cart lines per order')
+        parser.add_argument('--products', type=int, default=1000, help='Catalog size')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            products = seed_catalog(products=max(options['products'], options['lines']))
+            user = benchmark_user()
+            timings = []
+            queries = []
+
+            for n in range(options['orders']):
+                # Filling the cart is setup, only placing the order is timed
+                cart = session_cart()
+                offset = (n * options['lines']) % len(products)
+                for product in (products + products)[offset:offset + options['lines']]:
+                    cart.add(product, quantity=1)
+
+                with CaptureQueriesContext(connection) as ctx, Timer() as timer:
+                    place_order(cart, user, shipping_address='Benchmark St', idempotency_key=f'bench-{n}')
+                timings.append(timer.elapsed)
+                queries.append(len(ctx.captured_queries))
+
+            total = sum(timings)
+            self.stdout.write(f"Placed {options['orders']} orders with {options['lines']} lines each")
+            self.stdout.write(f'  orders/sec:      {len(timings) / total:.1f}')
+            self.stdout.write(f'  p50 latency:     {percentile(timings, 50) * 1000:.2f} ms')
+            self.stdout.write(f'  p95 latency:     {percentile(timings, 95) * 1000:.2f} ms')
+            self.stdout.write(f'  queries / order: {max(queries)}')
@@ -0,0 +1,129 @@
+import json
+import platform
+import random
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from store.benchmarks import (benchmark_database, seed_catalog, benchmark_user,
+                              measure, find_regressions)
+
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the cart and checkout views through the test client on a seeded '
+            'throwaway catalog. Reports p50/p95/p99 latency, queries and allocations '
+            'per request, optionally as JSON and compared against a stored baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Timed requests per scenario')
+        parser.add_argument('--products', type=int, default=5000, help='Catalog size')
+        parser.add_argument('--cart-lines', type=int, default=10, help='Lines in the cart every scenario starts from')
+        parser.add_argument('--seed', type=int, default=1234, help='Random seed for product picks')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Baseline JSON file to check the results against')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Allowed latency/allocation growth in percent when comparing')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        with benchmark_database():
+            self.products = seed_catalog(products=options['products'])
+            self.client = Client()
+            self.client.force_login(benchmark_user())
+            results = self.run_scenarios(options['iterations'], options['cart_lines'])
+
+        report = {
+            'meta': {
+                'iterations': options['iterations'],
+                'products': options['products'],
+                'cart_lines': options['cart_lines'],
+                'seed': options['seed'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'results': results,
+        }
+        self.print_table(results)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+            regressions = find_regressions(baseline, results, options['threshold'])
+            if regressions:
+                raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
+
+    def run_scenarios(self, iterations, cart_lines):
+        client = self.client
+        counter = iter(range(10 ** 9))
+
+        def clear_cart():
+            client.post(reverse('store:clear_cart'))
+
+        def fill_cart():
+            clear_cart()
+            for product in self.rng.sample(self.products, cart_lines):
+                client.post(reverse('store:cart_add', args=[product.id]), {'quantity': 1})
+
+        def add(**extra):
+            product = self.rng.choice(self.products)
+            return lambda: client.post(reverse('store:cart_add', args=[product.id]), {'quantity': 1}, **extra)
+
+        def update():
+            product_id = int(self.rng.choice(list(client.session['cart'])))
+            client.post(reverse('store:update_cart', args=[product_id]),
+                        {'quantity': self.rng.randint(1, 5)}, **AJAX)
+
+        def reset_promos():
+            session = client.session
+            session['promo_codes'] = []
+            session.save()
+
+        def checkout():
+            client.post(reverse('store:checkout'), {
+                'shipping_address': 'Benchmark St',
+                'idempotency_key': f'bench-{next(counter)}',
+            })
+
+        def run(request_factory, setup):
+            # A fresh callable per iteration lets scenarios pick random products
+            state = {}
+
+            def prepare():
+                if setup:
+                    setup()
+                state['request'] = request_factory()
+
+            return measure(lambda: state['request'](), iterations, setup=prepare)
+
+        results = {
+            # Every scenario sees a cart of --cart-lines lines
+            'cart_add': run(lambda: add(), fill_cart),
+            'cart_add_ajax': run(lambda: add(**AJAX), fill_cart),
+            'cart_update': run(lambda: update, None),
+            'cart_detail': run(lambda: lambda: client.get(reverse('store:cart_detail')), None),
+            'apply_promo': run(
+                lambda: lambda: client.post(reverse('store:apply_promo'), {'code': 'WELCOME10'}),
+                reset_promos
+            ),
+            'checkout': run(lambda: checkout, fill_cart),
+        }
+        clear_cart()
+        return results
+
+    def print_table(self, results):
+        header = f"{'scenario':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'alloc KiB':>11}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<16}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                f"{r['queries_per_request']:>9}{r['alloc_kib_per_request']:>11.1f}"
+            )
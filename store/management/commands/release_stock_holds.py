@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from store.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Return the stock of expired cart holds. Run it periodically (e.g. from cron).'
+
+    def handle(self, *args, **options):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} held units back to stock'))
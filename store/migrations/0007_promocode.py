@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-19 12:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromoCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, unique=True)),
+                ('discount_type', models.CharField(choices=[('percentage', 'Percentage'), ('fixed', 'Fixed Amount'), ('free_shipping', 'Free Shipping')], max_length=20)),
+                ('value', models.DecimalField(decimal_places=2, default=0, help_text='Percentage or amount off; ignored for free shipping', max_digits=10)),
+                ('minimum_spend', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('usage_limit', models.PositiveIntegerField(blank=True, null=True)),
+                ('times_used', models.PositiveIntegerField(default=0)),
+                ('valid_from', models.DateTimeField(blank=True, null=True)),
+                ('valid_until', models.DateTimeField(blank=True, null=True)),
+                ('active', models.BooleanField(default=True)),
+                ('category', models.ForeignKey(blank=True, help_text='Only discount products in this category', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promo_codes', to='store.category')),
+            ],
+            options={
+                'ordering': ['code'],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def seed_promo_codes(apps, schema_editor):
+    """Carry over the codes that used to be hardcoded in apply_promo."""
+    PromoCode = apps.get_model('store', 'PromoCode')
+    PromoCode.objects.get_or_create(code='WELCOME10', defaults={'discount_type': 'percentage', 'value': 10})
+    PromoCode.objects.get_or_create(code='FREESHIP', defaults={'discount_type': 'free_shipping'})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_promocode'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_promo_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:00
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    totals = OrderItem.objects.values('order_id').annotate(
+        count=Sum('quantity'),
+        total=Sum(F('price') * F('quantity'))
+    )
+    orders = []
+    for row in totals.iterator():
+        orders.append(Order(id=row['order_id'], item_count=row['count'], items_total=row['total']))
+    Order.objects.bulk_update(orders, ['item_count', 'items_total'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_seed_promo_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_order_item_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, unique=True)),
+                ('counters', models.BinaryField()),
+                ('top', models.JSONField(default=list)),
+                ('total', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
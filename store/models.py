@@ -3,6 +3,13 @@ from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from contextlib import contextmanager
+from decimal import Decimal
+import threading
 
 class Category(models.Model):
     name = models.CharField(max_length=200)
@@ -120,15 +127,54 @@ class Order(models.Model):
     paid = models.BooleanField(default=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Aggregates over the order's items, kept up to date on write
+    item_count = models.PositiveIntegerField(default=0)
+    items_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Unique per customer, see Meta.unique_together
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        unique_together = ('user', 'idempotency_key')
+        indexes = [
+            # Cursor pagination of the order API
+            models.Index(fields=['-created_at', '-id']),
+            # Dashboard filters on status and payment, newest first
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['paid', 'created_at']),
+        ]
     
     def __str__(self):
         return f'Order {self.id}'
     
     def get_total_cost(self):
-        return sum(item.get_cost() for item in self.items.all())
+        return self.items_total
+    
+    def update_totals(self):
+        """Recompute the stored item aggregates with a single query."""
+        totals = self.items.aggregate(
+            count=Sum('quantity'),
+            total=Sum(F('price') * F('quantity'))
+        )
+        self.item_count = totals['count'] or 0
+        self.items_total = totals['total'] or 0
+        Order.objects.filter(pk=self.pk).update(
+            item_count=self.item_count,
+            items_total=self.items_total
+        )
+    
+    @classmethod
+    def update_totals_for(cls, order_ids):
+        """Recompute the stored item aggregates of many orders with one UPDATE."""
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        cls.objects.filter(pk__in=order_ids).update(
+            item_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), 0),
+            items_total=Coalesce(
+                Subquery(items.annotate(total=Sum(F('price') * F('quantity'))).values('total')),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=10, decimal_places=2)
+            )
+        )
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
@@ -141,3 +187,119 @@ class OrderItem(models.Model):
     
     def get_cost(self):
         return self.price * self.quantity
+
+class OrderStatusLog(models.Model):
+    """One row per status change, written by store.orders.transition_orders; never updated."""
+    order = models.ForeignKey(Order, related_name='status_log', on_delete=models.CASCADE)
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    changed_by = models.ForeignKey(User, related_name='order_status_changes', on_delete=models.SET_NULL,
+                                   null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['order', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f'Order {self.order_id}: {self.from_status} -> {self.to_status}'
+
+
+_deferred_totals = threading.local()
+
+
+@contextmanager
+def deferred_order_totals():
+    """
+    Recompute order aggregates once per order when the block ends, rather than
+    on every item saved or deleted in it (admin inlines, scripted edits).
+    """
+    if getattr(_deferred_totals, 'order_ids', None) is not None:
+        # Nested: the outermost block recomputes
+        yield
+        return
+    _deferred_totals.order_ids = set()
+    try:
+        yield
+        order_ids = _deferred_totals.order_ids
+    finally:
+        _deferred_totals.order_ids = None
+    if order_ids:
+        Order.update_totals_for(order_ids)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, origin=None, **kwargs):
+    """Keep the order aggregates in step with item edits (admin, API)"""
+    # Items deleted along with their order leave no totals to keep
+    if isinstance(origin, Order) or (isinstance(origin, models.QuerySet) and origin.model is Order):
+        return
+    order_ids = getattr(_deferred_totals, 'order_ids', None)
+    if order_ids is not None:
+        order_ids.add(instance.order_id)
+    else:
+        Order.update_totals_for([instance.order_id])
+
+class PromoCode(models.Model):
+    DISCOUNT_TYPES = (
+        ('percentage', 'Percentage'),
+        ('fixed', 'Fixed Amount'),
+        ('free_shipping', 'Free Shipping'),
+    )
+    
+    code = models.CharField(max_length=50, unique=True)
+    discount_type = models.CharField(max_length=20, choices=DISCOUNT_TYPES)
+    value = models.DecimalField(max_digits=10, decimal_places=2, default=0,
+                                help_text='Percentage or amount off; ignored for free shipping')
+    category = models.ForeignKey(Category, related_name='promo_codes', on_delete=models.CASCADE,
+                                 null=True, blank=True, help_text='Only discount products in this category')
+    minimum_spend = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    usage_limit = models.PositiveIntegerField(null=True, blank=True)
+    times_used = models.PositiveIntegerField(default=0)
+    valid_from = models.DateTimeField(null=True, blank=True)
+    valid_until = models.DateTimeField(null=True, blank=True)
+    active = models.BooleanField(default=True)
+    
+    class Meta:
+        ordering = ['code']
+    
+    def __str__(self):
+        return self.code
+    
+    def save(self, *args, **kwargs):
+        self.code = self.code.strip().upper()
+        super().save(*args, **kwargs)
+
+class StockReservation(models.Model):
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    cart_token = models.CharField(max_length=32)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('product', 'cart_token')
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} held for {self.cart_token}'
+    
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+class SearchSketch(models.Model):
+    """Search counts persisted by store.search_stats, one row per tracked stream."""
+    name = models.CharField(max_length=30, unique=True)
+    counters = models.BinaryField()
+    top = models.JSONField(default=list)
+    total = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f'{self.name} searches'
@@ -0,0 +1,171 @@
+"""
+Order placement.
+
+``place_order`` turns a cart into an order in one transaction: the reserved
+stock is committed, the order row and all of its items are written with a
+single ``bulk_create`` and the total is taken once from the cart's pricing
+snapshot. Orders carry the idempotency key issued with the checkout form, so a
+double-clicked or retried submit returns the order that was already placed.
+
+``mark_orders_paid`` is the one place orders become paid; it sends
+``signals.order_paid`` so reporting can follow along. New orders are announced
+with ``signals.order_placed`` once their transaction has committed.
+
+Fulfilment statuses only move along ``TRANSITIONS``; ``transition_orders``
+moves any number of orders with one conditional UPDATE per current status,
+records each move that actually happened in the ``OrderStatusLog`` audit
+trail and sends ``signals.order_status_changed``. Cancelled orders hand their
+units back to stock.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from . import inventory, promotions
+from .models import Order, OrderItem, OrderStatusLog
+from .signals import order_paid, order_placed, order_status_changed
+
+IDEMPOTENCY_KEY_LENGTH = 64
+
+# Status an order can move to from each status
+TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+
+
+class InvalidTransition(Exception):
+    """Raised for a status no order can be moved to."""
+
+
+def clean_idempotency_key(value):
+    """Return a usable idempotency key or None."""
+    value = (value or '').strip()
+    if not value or len(value) > IDEMPOTENCY_KEY_LENGTH:
+        return None
+    return value
+
+
+def get_order_for_key(user, idempotency_key):
+    """Return the order already placed by ``user`` with this key, if any."""
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(user=user, idempotency_key=idempotency_key).first()
+
+
+def place_order(cart, user, shipping_address='', idempotency_key=None):
+    """
+    Place an order for everything in ``cart``.
+
+    Returns ``(order, created)``; ``created`` is False when the key had already
+    been used and the original order is returned. Raises
+    ``inventory.InsufficientStock`` if a line cannot be covered and
+    ``promotions.PromoUnavailable`` if a promo code ran out of uses, in which
+    case nothing is written.
+    """
+    existing = get_order_for_key(user, idempotency_key)
+    if existing:
+        return existing, False
+
+    # One pricing snapshot for the lines, the promo codes and the total
+    lines = [item for item in cart.items if item['quantity'] > 0]
+    promo_codes = cart.get_promotions().applied
+    total = cart.get_total_price()
+
+    try:
+        with transaction.atomic():
+            inventory.commit_holds(cart.token, {
+                item['product'].id: item['quantity'] for item in lines
+            })
+            promotions.redeem(promo_codes)
+            order = Order.objects.create(
+                user=user,
+                shipping_address=shipping_address,
+                total_amount=total,
+                item_count=sum(item['quantity'] for item in lines),
+                items_total=sum(item['total_price'] for item in lines),
+                status='pending',
+                idempotency_key=idempotency_key
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=item['product'],
+                    price=item['price'],
+                    quantity=item['quantity']
+                )
+                for item in lines
+            ])
+    except IntegrityError:
+        # A concurrent submit with the same key got there first
+        existing = get_order_for_key(user, idempotency_key)
+        if existing is None:
+            raise
+        return existing, False
+
+    placed = [(item['product'].id, item['quantity']) for item in lines]
+    transaction.on_commit(lambda: order_placed.send(sender=Order, order=order, lines=placed))
+    return order, True
+
+
+def mark_orders_paid(order_ids):
+    """
+    Mark the given orders as paid. Orders that already were are left alone.
+    Returns the ids that changed.
+    """
+    with transaction.atomic():
+        pending = list(Order.objects.filter(pk__in=order_ids, paid=False).values_list('pk', flat=True))
+        if pending:
+            Order.objects.filter(pk__in=pending, paid=False).update(paid=True, updated_at=timezone.now())
+            order_paid.send(sender=Order, order_ids=pending)
+    return pending
+
+
+def transition_orders(order_ids, status, user=None):
+    """
+    Move the given orders to ``status``. Orders whose current status doesn't
+    allow it are left alone. Returns ``(changed, rejected)``: the ids that
+    moved and a dict of the others' current status (None if there is no such
+    order). Raises ``InvalidTransition`` for an unknown or initial status.
+    """
+    sources = [source for source, targets in TRANSITIONS.items() if status in targets]
+    if not sources:
+        raise InvalidTransition(f'Orders cannot be moved to {status!r}')
+
+    with transaction.atomic():
+        current = dict(Order.objects.filter(pk__in=order_ids).values_list('pk', 'status'))
+        by_status = {}
+        for pk, old in current.items():
+            if old in sources:
+                by_status.setdefault(old, []).append(pk)
+        changed = []
+        now = timezone.now()
+        for old, pks in by_status.items():
+            moved = Order.objects.filter(pk__in=pks, status=old).update(status=status, updated_at=now)
+            if moved != len(pks):
+                # Some moved concurrently since they were read: keep the ones this call moved
+                pks = list(Order.objects.filter(pk__in=pks, status=status, updated_at=now).values_list('pk', flat=True))
+            changed.extend(pks)
+        changed.sort()
+        if changed:
+            OrderStatusLog.objects.bulk_create([
+                OrderStatusLog(order_id=pk, from_status=current[pk], to_status=status, changed_by=user)
+                for pk in changed
+            ])
+            if status == 'cancelled':
+                restock(changed)
+            order_status_changed.send(sender=Order, order_ids=changed, status=status)
+    moved = set(changed)
+    rejected = {pk: current.get(pk) for pk in order_ids if pk not in moved}
+    return changed, rejected
+
+
+def restock(order_ids):
+    """Put the units of the given orders back into stock, one UPDATE per product."""
+    units = OrderItem.objects.filter(order_id__in=order_ids).values('product_id').annotate(
+        quantity=Sum('quantity')
+    ).order_by().values_list('product_id', 'quantity')
+    for product_id, quantity in units:
+        inventory.return_stock(product_id, quantity)
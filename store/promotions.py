@@ -0,0 +1,186 @@
+"""
+Promo codes.
+
+Active ``PromoCode`` rows are compiled into a ``PromoEvaluator`` once per
+worker. The compiled evaluator remembers the ``promo_rules`` version it was
+built from; saving or deleting a code bumps the version and every worker
+recompiles on its next lookup. Without a shared cache the bump only reaches
+the worker that made it, so evaluators are also rebuilt once they are
+``versioning.max_age()`` seconds old. Evaluating a cart is plain Python over the
+session data, so showing discounts on every cart render costs no queries.
+
+Usage counts are only touched when an order is placed, with a conditional
+``F()`` increment that refuses to go past ``usage_limit``.
+"""
+import time
+from decimal import Decimal
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import PromoCode
+from .versioning import get_version, bump_version, max_age
+
+VERSION_NAME = 'promo_rules'
+CENTS = Decimal('0.01')
+
+
+class PromoError(Exception):
+    """A code that cannot be applied to the cart; the message is user facing."""
+
+
+class PromoUnavailable(PromoError):
+    """Raised at checkout when a code ran out of uses."""
+
+    def __init__(self, code):
+        self.code = code
+        super().__init__(f'Promo code {code} is no longer available.')
+
+
+class CompiledPromo:
+    """Plain-Python snapshot of one PromoCode row."""
+
+    def __init__(self, promo):
+        self.code = promo.code
+        self.discount_type = promo.discount_type
+        self.value = promo.value
+        self.category_id = promo.category_id
+        self.minimum_spend = promo.minimum_spend
+        self.usage_limit = promo.usage_limit
+        self.times_used = promo.times_used
+        self.valid_from = promo.valid_from
+        self.valid_until = promo.valid_until
+
+    @property
+    def is_free_shipping(self):
+        return self.discount_type == 'free_shipping'
+
+    @property
+    def description(self):
+        if self.is_free_shipping:
+            return 'Free shipping!'
+        if self.discount_type == 'percentage':
+            return f'You get {self.value.normalize()}% off!'
+        return f'You get ${self.value} off!'
+
+    def check(self, subtotal, now):
+        """Return the reason the code cannot be used, or None."""
+        if self.valid_from and now < self.valid_from:
+            return f'Promo code {self.code} is not active yet.'
+        if self.valid_until and now >= self.valid_until:
+            return f'Promo code {self.code} has expired.'
+        if self.usage_limit is not None and self.times_used >= self.usage_limit:
+            return f'Promo code {self.code} is no longer available.'
+        if subtotal < self.minimum_spend:
+            return f'Spend at least ${self.minimum_spend} to use {self.code}.'
+        return None
+
+    def discount(self, lines):
+        """Amount taken off ``lines`` (category id, price, quantity)."""
+        if self.is_free_shipping:
+            return Decimal('0.00')
+        eligible = sum(
+            (price * quantity for category_id, price, quantity in lines
+             if self.category_id is None or category_id == self.category_id),
+            Decimal('0.00')
+        )
+        if self.discount_type == 'percentage':
+            return (eligible * self.value / 100).quantize(CENTS)
+        return min(self.value, eligible)
+
+
+class PromoResult:
+    def __init__(self):
+        self.discount = Decimal('0.00')
+        self.free_shipping = False
+        self.applied = []
+
+
+class PromoEvaluator:
+    """All usable codes, keyed by code."""
+
+    def __init__(self, promos):
+        self.rules = {promo.code: CompiledPromo(promo) for promo in promos}
+
+    def validate(self, code, applied_codes, lines, now=None):
+        """
+        Check that ``code`` can be added next to ``applied_codes``. Returns the
+        compiled rule or raises PromoError.
+        """
+        now = now or timezone.now()
+        rule = self.rules.get(code)
+        if rule is None:
+            raise PromoError('Invalid promo code. Please try again.')
+        for other in self._rules_for(applied_codes):
+            if other.code == code:
+                raise PromoError(f'Promo code {code} is already applied to your cart.')
+            if other.is_free_shipping == rule.is_free_shipping:
+                kind = 'Free shipping' if rule.is_free_shipping else 'A discount'
+                raise PromoError(f'{kind} is already applied to your cart.')
+        problem = rule.check(_subtotal(lines), now)
+        if problem:
+            raise PromoError(problem)
+        return rule
+
+    def evaluate(self, codes, lines, now=None):
+        """Total effect of ``codes`` on the cart. Unusable codes are skipped."""
+        now = now or timezone.now()
+        result = PromoResult()
+        subtotal = _subtotal(lines)
+        for rule in self._rules_for(codes):
+            if rule.check(subtotal, now):
+                continue
+            result.applied.append(rule.code)
+            if rule.is_free_shipping:
+                result.free_shipping = True
+            else:
+                result.discount += rule.discount(lines)
+        result.discount = min(result.discount, subtotal)
+        return result
+
+    def _rules_for(self, codes):
+        return [self.rules[code] for code in codes if code in self.rules]
+
+
+def _subtotal(lines):
+    return sum((price * quantity for category_id, price, quantity in lines), Decimal('0.00'))
+
+
+_compiled = {'version': None, 'evaluator': None, 'built': 0.0}
+
+
+def get_evaluator():
+    """The worker's compiled evaluator, rebuilt when the rules version moves or it gets too old."""
+    version = get_version(VERSION_NAME)
+    age = max_age()
+    expired = age is not None and time.monotonic() - _compiled['built'] > age
+    if _compiled['version'] != version or expired:
+        now = timezone.now()
+        promos = PromoCode.objects.filter(active=True).filter(
+            Q(valid_until__isnull=True) | Q(valid_until__gt=now)
+        )
+        _compiled['evaluator'] = PromoEvaluator(promos)
+        _compiled['version'] = version
+        _compiled['built'] = time.monotonic()
+    return _compiled['evaluator']
+
+
+def redeem(codes):
+    """
+    Count one use of every code. Run it inside the order transaction so a code
+    that ran out rolls the order back.
+    """
+    for code in codes:
+        used = PromoCode.objects.filter(code=code, active=True).filter(
+            Q(usage_limit__isnull=True) | Q(times_used__lt=F('usage_limit'))
+        ).update(times_used=F('times_used') + 1)
+        if not used:
+            # Let every worker drop the exhausted code
+            bump_version(VERSION_NAME)
+            raise PromoUnavailable(code)
+
+
+@receiver(post_save, sender=PromoCode)
+@receiver(post_delete, sender=PromoCode)
+def promo_codes_changed(sender, **kwargs):
+    bump_version(VERSION_NAME)
@@ -0,0 +1,224 @@
+"""
+Popular search tracking.
+
+Every query sent to the live product search is normalized and counted in a
+Count-Min Sketch: ``DEPTH`` rows of ``WIDTH`` counters, one hashed counter per
+row, so recording a query costs a fixed ``DEPTH`` increments however many
+distinct queries exist. The estimate of a query is the smallest of its
+counters; it never undercounts and overcounts by at most 0.13% (e / WIDTH) of
+all recorded searches with 98% probability (1 - e^-DEPTH). A heap of the
+``TOP_K`` best estimates is kept next to the sketch. Searches that found
+nothing are tracked in a second sketch of their own.
+
+Each worker counts into a local sketch and adds it to the stored one
+(``SearchSketch``) every ``SEARCH_STATS_FLUSH_SECONDS`` seconds. Sketches add
+up counter by counter, and the stored top queries are re-ranked against the
+merged counts. A crashed worker loses the searches since its last flush. A
+flush that fails keeps the counts for the next one; recording a search never
+raises, a failed flush is logged instead.
+"""
+import atexit
+import hashlib
+import heapq
+import logging
+import re
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from .models import SearchSketch
+from .versioning import max_age
+
+WIDTH = 2048
+DEPTH = 4
+TOP_K = 50
+MAX_QUERY_LENGTH = 100
+
+logger = logging.getLogger(__name__)
+
+SEARCHES = 'searches'
+ZERO_RESULTS = 'zero_results'
+
+
+def normalize(query):
+    """Lowercase a query and collapse its whitespace."""
+    return re.sub(r'\s+', ' ', query.lower()).strip()[:MAX_QUERY_LENGTH]
+
+
+def _columns(query):
+    digest = hashlib.blake2b(query.encode(), digest_size=4 * DEPTH).digest()
+    return np.frombuffer(digest, dtype='<u4') % WIDTH
+
+
+_ROWS = np.arange(DEPTH)
+
+
+class CountMinSketch:
+    def __init__(self, counters=None):
+        self.counters = np.zeros((DEPTH, WIDTH), dtype=np.uint32) if counters is None else counters
+
+    def add(self, query, count=1):
+        """Count ``query``; returns its new estimate."""
+        columns = _columns(query)
+        self.counters[_ROWS, columns] += count
+        return int(self.counters[_ROWS, columns].min())
+
+    def estimate(self, query):
+        return int(self.counters[_ROWS, _columns(query)].min())
+
+    def to_bytes(self):
+        return self.counters.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        return cls(np.frombuffer(bytes(blob), dtype=np.uint32).reshape(DEPTH, WIDTH).copy())
+
+
+class TopQueries:
+    """The ``size`` queries with the highest estimates, smallest on top of a heap."""
+
+    def __init__(self, size=TOP_K):
+        self.size = size
+        self.counts = {}
+        self.heap = []
+
+    def offer(self, query, estimate):
+        if query in self.counts:
+            self.counts[query] = estimate
+            heapq.heappush(self.heap, (estimate, query))
+        elif len(self.counts) < self.size:
+            self.counts[query] = estimate
+            heapq.heappush(self.heap, (estimate, query))
+        else:
+            smallest, candidate = self._smallest()
+            if estimate <= smallest:
+                return
+            heapq.heappop(self.heap)
+            del self.counts[candidate]
+            self.counts[query] = estimate
+            heapq.heappush(self.heap, (estimate, query))
+        if len(self.heap) > 4 * self.size:
+            # Drop entries outdated by later offers of the same query
+            self.heap = [(count, query) for query, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def _smallest(self):
+        # Entries are pushed again when a count grows; skip the outdated ones
+        while self.heap[0][0] != self.counts.get(self.heap[0][1]):
+            heapq.heappop(self.heap)
+        return self.heap[0]
+
+    def items(self):
+        """(query, estimate) pairs, most searched first."""
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+class SearchTracker:
+    def __init__(self, interval=None):
+        self.interval = interval or getattr(settings, 'SEARCH_STATS_FLUSH_SECONDS', 30)
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.sketches = {SEARCHES: CountMinSketch(), ZERO_RESULTS: CountMinSketch()}
+        self.top = {SEARCHES: TopQueries(), ZERO_RESULTS: TopQueries()}
+        self.totals = {SEARCHES: 0, ZERO_RESULTS: 0}
+        self.started = time.monotonic()
+        self.database = None
+
+    def record(self, query, results):
+        """Count a search that returned ``results`` results."""
+        query = normalize(query)
+        if not query:
+            return
+        with self.lock:
+            if self.database is None:
+                self.database = connection.settings_dict['NAME']
+            names = (SEARCHES, ZERO_RESULTS) if not results else (SEARCHES,)
+            for name in names:
+                self.top[name].offer(query, self.sketches[name].add(query))
+                self.totals[name] += 1
+            due = time.monotonic() - self.started >= self.interval
+        if due:
+            try:
+                self.flush()
+            except Exception:
+                # The counts were kept; the next interval tries again
+                logger.exception('Flushing search statistics failed')
+
+    def flush(self):
+        """Add the local counts to the stored sketches."""
+        with self.lock:
+            sketches, top, totals, database = self.sketches, self.top, self.totals, self.database
+            self._reset()
+        if not totals[SEARCHES]:
+            return
+        try:
+            with transaction.atomic():
+                for name in (SEARCHES, ZERO_RESULTS):
+                    if totals[name]:
+                        _merge(name, sketches[name], top[name], totals[name])
+        except Exception:
+            # Put the counts back, merged with whatever arrived meanwhile
+            with self.lock:
+                for name in (SEARCHES, ZERO_RESULTS):
+                    self.sketches[name].counters += sketches[name].counters
+                    self.totals[name] += totals[name]
+                    for query in set(top[name].counts) | set(self.top[name].counts):
+                        self.top[name].offer(query, self.sketches[name].estimate(query))
+                if self.database is None:
+                    self.database = database
+            raise
+        cache.delete(POPULAR_CACHE_KEY)
+
+
+def _merge(name, local, local_top, total):
+    stored = SearchSketch.objects.select_for_update().filter(name=name).first()
+    if stored is None:
+        stored = SearchSketch(name=name, counters=CountMinSketch().to_bytes())
+    merged = CountMinSketch.from_bytes(stored.counters)
+    merged.counters += local.counters
+
+    # Candidates are the stored and the local top queries, re-estimated
+    # against the merged counts
+    top = TopQueries()
+    for query in {query for query, count in stored.top} | set(local_top.counts):
+        top.offer(query, merged.estimate(query))
+
+    stored.counters = merged.to_bytes()
+    stored.top = top.items()
+    stored.total += total
+    stored.save()
+
+
+POPULAR_CACHE_KEY = 'popular_searches'
+
+
+def popular(name=SEARCHES, limit=TOP_K):
+    """The most searched queries as (query, estimated count), from the stored sketch."""
+    if name == SEARCHES:
+        cached = cache.get(POPULAR_CACHE_KEY)
+        if cached is not None:
+            return cached[:limit]
+    stored = SearchSketch.objects.filter(name=name).values_list('top', flat=True).first() or []
+    top = [tuple(item) for item in stored]
+    if name == SEARCHES:
+        # Only the flushing worker drops the entry; without a shared cache the others wait it out
+        cache.set(POPULAR_CACHE_KEY, top, max_age(3600))
+    return top[:limit]
+
+
+tracker = SearchTracker()
+
+
+@atexit.register
+def flush_at_exit():
+    # Counts recorded against another database (a test run's) stay there
+    if tracker.database != connection.settings_dict['NAME']:
+        return
+    try:
+        tracker.flush()
+    except DatabaseError:
+        pass
@@ -0,0 +1,27 @@
+"""
+Signals other apps can listen to without the store depending on them.
+"""
+from django.dispatch import Signal
+
+# Sent inside the transaction that flips ``Order.paid``; ``order_ids`` lists
+# the orders that actually changed.
+order_paid = Signal()
+
+# Sent by the product detail page and by every cart addition with
+# ``product_id``, ``user_id`` (None for anonymous visitors) and, for cart
+# additions, ``quantity``. Page views also carry ``visitor``, a stable id for
+# the user or browser. Receivers run inside the request, keep them cheap.
+product_viewed = Signal()
+product_added_to_cart = Signal()
+
+# Sent inside the transaction of ``orders.transition_orders`` with
+# ``order_ids``, the orders that moved, and their new ``status``.
+order_status_changed = Signal()
+
+# Sent for searches submitted to the product list (not the live search as
+# the user types) with ``query`` and ``user_id``.
+products_searched = Signal()
+
+# Sent once a new order has been committed, with ``order`` and ``lines``, a
+# list of (product_id, quantity).
+order_placed = Signal()
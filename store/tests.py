@@ -1,3 +1,483 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, QuerySet, Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from . import inventory, promotions, search_stats, versioning
+from .cart import Cart
+from .models import (Category, Product, Order, OrderItem, OrderStatusLog, PromoCode, SearchSketch,
+                     StockReservation, deferred_order_totals)
+from .orders import InvalidTransition, place_order, transition_orders
+from .views import get_search_suggestions
 
-# Create your tests here.
+
+def make_product(stock=10, price='20.00', name='Laptop', category=None):
+    if category is None:
+        category, _ = Category.objects.get_or_create(name='Computers', slug='computers')
+    return Product.objects.create(
+        category=category,
+        name=name,
+        slug=name.lower().replace(' ', '-'),
+        price=Decimal(price),
+        stock=stock
+    )
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.product = make_product(stock=5)
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-pass')
+
+    def add(self, quantity, product=None):
+        product = product or self.product
+        return self.client.post(reverse('store:cart_add', args=[product.id]), {'quantity': quantity})
+
+    def test_cart_add_holds_stock(self):
+        self.add(2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+    def test_cart_add_rejects_more_than_available(self):
+        self.add(4)
+        response = self.add(2)
+        self.assertEqual(response.status_code, 400)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+
+    def test_update_and_remove_return_stock(self):
+        self.add(4)
+        self.client.post(reverse('store:update_cart', args=[self.product.id]), {'quantity': 1})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 4)
+        self.client.post(reverse('store:cart_remove', args=[self.product.id]))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_invalid_quantities_are_rejected(self):
+        self.add(2)
+        for quantity in (0, -3, 'many'):
+            self.assertEqual(self.add(quantity).status_code, 400)
+        update = reverse('store:update_cart', args=[self.product.id])
+        self.assertEqual(self.client.post(update, {'quantity': -1}).status_code, 400)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        with self.assertRaises(ValueError):
+            inventory.set_hold('cart', self.product.id, -1)
+        # Updating to 0 empties the line
+        self.client.post(update, {'quantity': 0})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expired_holds_go_back_to_stock(self):
+        self.add(3)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(inventory.release_expired(), 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_abandoned_holds_do_not_keep_a_product_sold_out(self):
+        self.add(5)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        response = self.client.get(reverse('store:product_detail', args=[self.product.slug]))
+        self.assertEqual(response.context['product'].stock, 5)
+        self.assertFalse(StockReservation.objects.exists())
+        self.add(5)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        response = self.client.get(reverse('store:product_list'))
+        self.assertEqual([product.stock for product in response.context['products']], [5])
+
+    def test_checkout_consumes_hold(self):
+        self.client.force_login(self.user)
+        self.add(2)
+        response = self.client.post(reverse('store:checkout'), {'shipping_address': '1 Main St'})
+        self.assertEqual(response.status_code, 302)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(OrderItem.objects.get().quantity, 2)
+
+    def test_checkout_after_released_hold_takes_stock_again(self):
+        self.client.force_login(self.user)
+        self.add(2)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        inventory.release_expired()
+        Product.objects.filter(id=self.product.id).update(stock=1)
+        response = self.client.post(reverse('store:checkout'), {'shipping_address': '1 Main St'})
+        self.assertRedirects(response, reverse('store:cart_detail'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+
+
+class CheckoutIdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-pass')
+        self.client.force_login(self.user)
+        self.products = [make_product(stock=5, name=f'Item {i}') for i in range(3)]
+        for product in self.products:
+            self.client.post(reverse('store:cart_add', args=[product.id]), {'quantity': 2})
+
+    def submit(self, key):
+        return self.client.post(reverse('store:checkout'), {
+            'shipping_address': '1 Main St',
+            'idempotency_key': key,
+        })
+
+    def test_checkout_form_issues_key(self):
+        response = self.client.get(reverse('store:checkout'))
+        self.assertEqual(len(response.context['idempotency_key']), 32)
+
+    def test_retried_submit_returns_original_order(self):
+        first = self.submit('key-1')
+        second = self.submit('key-1')
+        order = Order.objects.get()
+        self.assertEqual(first.url, second.url)
+        self.assertEqual(order.idempotency_key, 'key-1')
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.total_amount, Decimal('120.00'))
+        self.assertEqual((order.item_count, order.items_total), (6, Decimal('120.00')))
+        for product in self.products:
+            product.refresh_from_db()
+            self.assertEqual(product.stock, 3)
+
+    def test_order_placement_is_constant_in_queries(self):
+        cart = Cart(self.session_request())
+        # Compile the promo rules now so their queries aren't counted
+        promotions.get_evaluator()
+        # Key lookup, products, holds select + delete, order insert, one bulk
+        # insert for the items, plus the savepoints around them
+        with self.assertNumQueries(10):
+            place_order(cart, self.user, idempotency_key='bulk')
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+    def test_keys_are_per_customer(self):
+        self.submit('key-1')
+        other = User.objects.create_user('other', 'other@example.com', 'secret-pass')
+        self.client.force_login(other)
+        self.client.post(reverse('store:cart_add', args=[self.products[0].id]), {'quantity': 1})
+        response = self.submit('key-1')
+        order = Order.objects.get(user=other)
+        self.assertRedirects(response, reverse('store:order_confirmation', args=[order.id]),
+                             fetch_redirect_response=False)
+        self.assertEqual(order.item_count, 1)
+
+    def session_request(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        return request
+
+
+class PromoCodeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-pass')
+        self.client.force_login(self.user)
+        self.laptop = make_product(stock=10, price='40.00')
+        self.cable = make_product(stock=10, price='10.00', name='Cable',
+                                  category=Category.objects.create(name='Accessories', slug='accessories'))
+        for product in (self.laptop, self.cable):
+            self.client.post(reverse('store:cart_add', args=[product.id]), {'quantity': 1})
+
+    def apply(self, code):
+        self.client.post(reverse('store:apply_promo'), {'code': code})
+        return Cart(self.session_request())
+
+    def session_request(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        return request
+
+    def test_seeded_codes_keep_working(self):
+        cart = self.apply('welcome10')
+        self.assertEqual(cart.get_discount(), Decimal('5.00'))
+        cart = self.apply('FREESHIP')
+        self.assertTrue(cart.has_free_shipping())
+        self.assertEqual(cart.get_total_price(), Decimal('45.00'))
+
+    def test_category_scoped_fixed_discount(self):
+        PromoCode.objects.create(code='CABLE20', discount_type='fixed', value=20, category=self.cable.category)
+        cart = self.apply('CABLE20')
+        # Capped at what the category contributes to the cart
+        self.assertEqual(cart.get_discount(), Decimal('10.00'))
+
+    def test_minimum_spend_and_date_window(self):
+        PromoCode.objects.create(code='BIGSPEND', discount_type='percentage', value=50, minimum_spend=100)
+        PromoCode.objects.create(code='OLD', discount_type='percentage', value=50,
+                                 valid_until=timezone.now() - timedelta(days=1))
+        self.assertEqual(self.apply('BIGSPEND').promo_codes, [])
+        self.assertEqual(self.apply('OLD').promo_codes, [])
+
+    def test_new_codes_invalidate_compiled_rules(self):
+        self.assertEqual(self.apply('SUMMER').promo_codes, [])
+        PromoCode.objects.create(code='SUMMER', discount_type='percentage', value=20)
+        self.assertEqual(self.apply('SUMMER').promo_codes, ['SUMMER'])
+
+    def test_compiled_rules_age_out_without_a_shared_cache(self):
+        self.assertFalse(versioning.shared())
+        self.apply('WELCOME10')
+        # Edited by another worker: its version bump never reaches this one
+        PromoCode.objects.filter(code='WELCOME10').update(value=50)
+        self.assertEqual(Cart(self.session_request()).get_discount(), Decimal('5.00'))
+        with override_settings(CACHE_LOCAL_MAX_AGE=0):
+            self.assertEqual(Cart(self.session_request()).get_discount(), Decimal('25.00'))
+
+    def test_cart_evaluation_runs_no_queries(self):
+        cart = self.apply('WELCOME10')
+        with self.assertNumQueries(0):
+            cart.get_total_price()
+            cart.has_free_shipping()
+
+    def test_usage_limit_is_enforced_at_checkout(self):
+        PromoCode.objects.create(code='ONCE', discount_type='fixed', value=5, usage_limit=1)
+        self.apply('ONCE')
+        PromoCode.objects.filter(code='ONCE').update(times_used=F('times_used') + 1)
+        response = self.client.post(reverse('store:checkout'), {'shipping_address': '1 Main St'})
+        self.assertRedirects(response, reverse('store:cart_detail'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(PromoCode.objects.get(code='ONCE').times_used, 1)
+
+    def test_checkout_counts_usage(self):
+        self.apply('WELCOME10')
+        self.client.post(reverse('store:checkout'), {'shipping_address': '1 Main St'})
+        # 10% off a $50 cart drops it under the free shipping threshold
+        self.assertEqual(Order.objects.get().total_amount, Decimal('50.00'))
+        self.assertEqual(PromoCode.objects.get(code='WELCOME10').times_used, 1)
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-pass')
+        self.client.force_login(self.user)
+        self.products = [make_product(name=f'Item {i}') for i in range(3)]
+
+    def create_orders(self, count):
+        orders = Order.objects.bulk_create(Order(user=self.user) for _ in range(count))
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, price=Decimal('5.00'), quantity=2)
+            for order in orders for product in self.products
+        )
+        Order.update_totals_for([order.pk for order in orders])
+
+    def history_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('store:my_orders'), {'page': 2})
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_order_history(self):
+        self.create_orders(25)
+        small = self.history_queries()
+        self.create_orders(3000)
+        self.assertEqual(self.history_queries(), small)
+
+    def test_item_edits_keep_order_totals(self):
+        order = Order.objects.create(user=self.user)
+        item = order.items.create(product=self.products[0], price=Decimal('7.50'), quantity=2)
+        order.items.create(product=self.products[1], price=Decimal('1.00'), quantity=1)
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.get_total_cost()), (3, Decimal('16.00')))
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.get_total_cost()), (1, Decimal('1.00')))
+
+    def test_totals_are_recomputed_once_per_order(self):
+        self.create_orders(2)
+        order = Order.objects.first()
+        self.assertEqual((order.item_count, order.items_total), (6, Decimal('30.00')))
+        with self.assertNumQueries(3 + 1):
+            with deferred_order_totals():
+                for item in order.items.all()[:2]:
+                    item.quantity = 1
+                    item.save()
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.items_total), (4, Decimal('20.00')))
+        # Items deleted with their order don't touch the totals
+        with CaptureQueriesContext(connection) as queries:
+            order.delete()
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')])
+
+
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('staff', 'staff@example.com', 'secret-pass', is_staff=True)
+        self.orders = Order.objects.bulk_create(Order(status='pending') for _ in range(4))
+
+    def test_only_allowed_moves_happen(self):
+        ids = [order.pk for order in self.orders]
+        Order.objects.filter(pk=ids[0]).update(status='delivered')
+        changed, rejected = transition_orders(ids + [0], 'processing', self.user)
+        self.assertEqual(changed, ids[1:])
+        self.assertEqual(rejected, {ids[0]: 'delivered', 0: None})
+        changed, rejected = transition_orders(ids[1:2], 'delivered')
+        self.assertEqual((changed, rejected), ([], {ids[1]: 'processing'}))
+        with self.assertRaises(InvalidTransition):
+            transition_orders(ids, 'pending')
+
+    def test_one_update_and_one_audit_insert(self):
+        ids = [order.pk for order in self.orders]
+        with CaptureQueriesContext(connection) as queries:
+            transition_orders(ids, 'processing', self.user)
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual([sql for sql in statements if sql in ('SELECT', 'UPDATE', 'INSERT')],
+                         ['SELECT', 'UPDATE', 'INSERT'])
+        log = OrderStatusLog.objects.filter(order_id__in=ids)
+        self.assertEqual(set(log.values_list('from_status', 'to_status', 'changed_by')),
+                         {('pending', 'processing', self.user.pk)})
+        self.assertEqual(log.count(), 4)
+
+    def test_concurrent_moves_are_not_logged(self):
+        ids = [order.pk for order in self.orders]
+        update = QuerySet.update
+
+        def racing_update(queryset, **kwargs):
+            # Another request moves the first order between the read and the write
+            update(Order.objects.filter(pk=ids[0]), status='processing')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            changed, rejected = transition_orders(ids, 'cancelled', self.user)
+        self.assertEqual(changed, ids[1:])
+        self.assertEqual(set(OrderStatusLog.objects.values_list('order_id', flat=True)), set(ids[1:]))
+
+    def test_cancelling_returns_stock(self):
+        laptop, cable = make_product(stock=5), make_product(stock=5, name='Cable')
+        OrderItem.objects.bulk_create([
+            OrderItem(order=self.orders[0], product=laptop, price=Decimal('20.00'), quantity=2),
+            OrderItem(order=self.orders[1], product=laptop, price=Decimal('20.00'), quantity=1),
+            OrderItem(order=self.orders[1], product=cable, price=Decimal('20.00'), quantity=3),
+            OrderItem(order=self.orders[2], product=cable, price=Decimal('20.00'), quantity=4),
+        ])
+        Order.objects.filter(pk=self.orders[2].pk).update(status='shipped')
+        transition_orders([order.pk for order in self.orders[:3]], 'cancelled')
+        laptop.refresh_from_db()
+        cable.refresh_from_db()
+        self.assertEqual((laptop.stock, cable.stock), (8, 8))
+
+
+class SearchStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        search_stats.tracker.flush()
+        SearchSketch.objects.all().delete()
+
+    def stream(self):
+        """A skewed stream: query n is searched 1000 // (n + 1) times."""
+        return [f'query {n}' for n in range(2000) for _ in range(1000 // (n + 1))]
+
+    def test_sketch_never_undercounts_and_keeps_heavy_hitters(self):
+        tracker = search_stats.SearchTracker(interval=3600)
+        for query in self.stream():
+            tracker.record(query, results=1)
+        sketch = tracker.sketches[search_stats.SEARCHES]
+        total = tracker.totals[search_stats.SEARCHES]
+        for n in (0, 5, 50, 500):
+            exact = 1000 // (n + 1)
+            self.assertGreaterEqual(sketch.estimate(f'query {n}'), exact)
+            self.assertLessEqual(sketch.estimate(f'query {n}'), exact + total * 2.72 / search_stats.WIDTH)
+        top = [query for query, count in tracker.top[search_stats.SEARCHES].items()[:10]]
+        self.assertEqual(top, [f'query {n}' for n in range(10)])
+
+    def test_workers_add_up_when_flushed(self):
+        for _ in range(2):
+            tracker = search_stats.SearchTracker(interval=3600)
+            for query in ['Laptop', ' laptop ', 'headset', 'nothing here']:
+                tracker.record(query, results=0 if query == 'nothing here' else 3)
+            tracker.flush()
+        self.assertEqual(search_stats.popular()[:2], [('laptop', 4), ('headset', 2)])
+        self.assertEqual(search_stats.popular(search_stats.ZERO_RESULTS), [('nothing here', 2)])
+        self.assertEqual(SearchSketch.objects.get(name=search_stats.SEARCHES).total, 8)
+
+    def test_failed_flush_keeps_counts(self):
+        tracker = search_stats.SearchTracker(interval=60)
+        tracker.record('laptop', results=3)
+        tracker.started -= 61
+        with mock.patch.object(search_stats, '_merge', side_effect=DatabaseError('database is locked')), \
+                self.assertLogs('store.search_stats', 'ERROR'):
+            tracker.record('laptop', results=3)
+        tracker.record('headset', results=0)
+        self.assertEqual(tracker.totals, {search_stats.SEARCHES: 3, search_stats.ZERO_RESULTS: 1})
+        tracker.flush()
+        self.assertEqual(search_stats.popular()[:2], [('laptop', 2), ('headset', 1)])
+
+    def test_live_search_drives_suggestions(self):
+        make_product(name='Gaming Laptop')
+        for _ in range(3):
+            self.client.get(reverse('store:product_search'), {'q': 'gaming laptop'})
+        self.client.get(reverse('store:product_search'), {'q': 'laptop stand'})
+        self.client.get(reverse('store:product_search'), {'q': 'Docking  Station'})
+        search_stats.tracker.flush()
+        self.assertEqual(get_search_suggestions('laptop')[:2], ['gaming laptop', 'laptop stand'])
+        self.assertEqual(search_stats.popular(search_stats.ZERO_RESULTS), [('docking station', 1)])
+
+    def test_popular_ages_out_without_a_shared_cache(self):
+        # Another worker's flush can't drop this process's copy
+        with mock.patch.object(cache, 'set') as cache_set:
+            search_stats.popular()
+        self.assertEqual(cache_set.call_args.args[2], 60)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Many checkout workers racing for a handful of units must never oversell."""
+
+    workers = 24
+    initial_stock = 10
+
+    def test_no_oversell_under_concurrent_checkouts(self):
+        products = [make_product(stock=self.initial_stock, name=f'Item {i}') for i in range(3)]
+        start = threading.Barrier(self.workers)
+        errors = []
+        rejected = []
+
+        def worker(n):
+            try:
+                start.wait()
+                lines = {p.id: 1 + (n + i) % 3 for i, p in enumerate(products)}
+                token = f'cart-{n}'
+                # Half the workers reserve first, the others check out straight away
+                if n % 2:
+                    for product_id, quantity in lines.items():
+                        try:
+                            inventory.set_hold(token, product_id, quantity)
+                        except inventory.InsufficientStock:
+                            pass
+                try:
+                    with transaction.atomic():
+                        inventory.commit_holds(token, lines)
+                        order = Order.objects.create(status='pending')
+                        OrderItem.objects.bulk_create(
+                            OrderItem(order=order, product_id=product_id, price=Decimal('1'), quantity=quantity)
+                            for product_id, quantity in lines.items()
+                        )
+                except inventory.InsufficientStock:
+                    rejected.append(n)
+                    inventory.release_holds(token)
+            except Exception as e:  # pragma: no cover - surfaced by the assertion below
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # Demand exceeds supply, so both outcomes must have happened
+        self.assertTrue(rejected)
+        self.assertEqual(Order.objects.count(), self.workers - len(rejected))
+        self.assertFalse(StockReservation.objects.exists())
+        for product in products:
+            product.refresh_from_db()
+            sold = OrderItem.objects.filter(product=product).aggregate(n=Sum('quantity'))['n'] or 0
+            self.assertGreaterEqual(product.stock, 0)
+            self.assertEqual(product.stock + sold, self.initial_stock)
@@ -0,0 +1,58 @@
+"""
+Cache version tokens.
+
+A version token names the current generation of some data set. Caches derived
+from that data embed the token in their keys (or remember it next to the value)
+and bumping the token makes every derived entry unreachable at once, without
+having to know which keys exist.
+
+Tokens are random rather than counters so an evicted token can never come back
+with a value an old cache entry was stored under. They live in the default
+cache. Only a cache shared between workers (Redis, see ``REDIS_URL`` in the
+settings) carries a bump to every worker; with the per-process local memory
+cache each worker has tokens of its own and only sees its own bumps. Derived
+data is therefore kept for at most ``max_age`` seconds, which is unlimited
+with a shared cache and ``CACHE_LOCAL_MAX_AGE`` (60 seconds) without one.
+"""
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+
+# Backends whose entries live in one worker's memory
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def shared():
+    """Whether the default cache is seen by every worker."""
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_BACKENDS
+
+
+def max_age(timeout=None):
+    """
+    How long data derived from a versioned data set may be kept: ``timeout``
+    (None for as long as the version holds) when bumps reach every worker,
+    capped at ``CACHE_LOCAL_MAX_AGE`` seconds when they don't.
+    """
+    if shared():
+        return timeout
+    local = getattr(settings, 'CACHE_LOCAL_MAX_AGE', 60)
+    return local if timeout is None else min(timeout, local)
+
+
+def _key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        cache.add(_key(name), uuid.uuid4().hex, None)
+        version = cache.get(_key(name))
+    return version
+
+
+def bump_version(name):
+    cache.set(_key(name), uuid.uuid4().hex, None)
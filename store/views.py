@@ -9,12 +9,18 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from .models import Category, Product, Review, Order
 from .cart import Cart
+from .orders import clean_idempotency_key, get_order_for_key, place_order
+from .inventory import InsufficientStock, refresh_sold_out
+from .promotions import PromoError, PromoUnavailable
 from .throttles import SearchRateThrottle
+from . import search_stats
+from .signals import product_viewed, product_added_to_cart, products_searched
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_protect
 from functools import reduce
 from operator import or_
 import re
+import uuid
 
 def home(request):
     """Homepage view showcasing featured products and categories"""
@@ -49,6 +55,9 @@ def product_list(request, category_slug=None):
         # Combine queries and search
         if queries:
             products = products.filter(reduce(or_, queries))
+        if 'page' not in request.GET:
+            # Later pages of the same results are not new searches
+            products_searched.send(sender=Product, query=search_query, user_id=request.user.id)
     
     if category_slug:
         category = get_object_or_404(Category, slug=category_slug)
@@ -75,6 +84,7 @@ def product_list(request, category_slug=None):
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'has_more': False})
         products = paginator.page(paginator.num_pages)
+    refresh_sold_out(products)
 
     context = {
         'category': category,
@@ -96,9 +106,18 @@ def product_list(request, category_slug=None):
 
     return render(request, 'store/product_list.html', context)
 
+def visitor_id(request):
+    """A stable id for whoever sent the request: user, session or address and browser"""
+    if request.user.is_authenticated:
+        return f'user:{request.user.id}'
+    if request.session.session_key:
+        return f'session:{request.session.session_key}'
+    return f"client:{request.META.get('REMOTE_ADDR', '')}:{request.META.get('HTTP_USER_AGENT', '')}"
+
 def product_detail(request, slug):
     """View to show product details"""
     product = get_object_or_404(Product, slug=slug, available=True)
+    refresh_sold_out([product])
     
     # Handle review submission
     if request.method == 'POST' and 'action' in request.GET and request.GET['action'] == 'review':
@@ -137,6 +156,10 @@ def product_detail(request, slug):
             product.average_rating = avg_rating or 0
             product.save()
     
+    else:
+        product_viewed.send(sender=Product, product_id=product.id, user_id=request.user.id,
+                            visitor=visitor_id(request))
+    
     # Get related products from same category
     related_products = Product.objects.filter(category=product.category, available=True).exclude(id=product.id)[:4]
     
@@ -145,20 +168,32 @@ def product_detail(request, slug):
         'related_products': related_products
     })
 
+def posted_quantity(request, minimum):
+    """The ``quantity`` field of a cart form, or None unless it is a number >= ``minimum``"""
+    try:
+        quantity = int(request.POST.get('quantity', 1))
+    except ValueError:
+        return None
+    return quantity if quantity >= minimum else None
+
 @require_POST
 @csrf_protect
 def cart_add(request, product_id):
     """Add items to cart with AJAX support"""
     cart = Cart(request)
     product = get_object_or_404(Product, id=product_id)
-    quantity = int(request.POST.get('quantity', 1))
+    quantity = posted_quantity(request, minimum=1)
+    if quantity is None:
+        return JsonResponse({'error': 'Quantity must be at least 1'}, status=400)
     
-    if quantity > product.stock:
+    try:
+        cart.add(product=product, quantity=quantity)
+    except InsufficientStock:
         return JsonResponse({
             'error': 'Not enough stock available'
         }, status=400)
-    
-    cart.add(product=product, quantity=quantity)
+    product_added_to_cart.send(sender=Product, product_id=product.id,
+                               user_id=request.user.id, quantity=quantity)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         cart_html = render_to_string(
@@ -181,15 +216,20 @@ def cart_update(request, product_id):
     """Update cart item quantity with AJAX support"""
     cart = Cart(request)
     product = get_object_or_404(Product, id=product_id)
-    quantity = int(request.POST.get('quantity', 1))
+    quantity = posted_quantity(request, minimum=0)
+    if quantity is None:
+        return JsonResponse({'error': 'Quantity cannot be negative'}, status=400)
     
-    if quantity > product.stock:
+    try:
+        if quantity:
+            cart.add(product=product, quantity=quantity, update_quantity=True)
+        else:
+            cart.remove(product)
+    except InsufficientStock:
         return JsonResponse({
             'error': 'Not enough stock available'
         }, status=400)
     
-    cart.add(product=product, quantity=quantity, update_quantity=True)
-    
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         cart_html = render_to_string(
             'store/includes/cart_preview.html',
@@ -243,31 +283,28 @@ def apply_promo(request):
     cart = Cart(request)
     code = request.POST.get('code', '').strip().upper()
     
-    # For now, just a simple demo promo code
-    if code == 'WELCOME10':
-        # Apply 10% discount
-        if not cart.has_discount():
-            cart.apply_discount(10)
-            messages.success(request, "Promo code WELCOME10 applied successfully. You get 10% off!")
-        else:
-            messages.info(request, "A discount is already applied to your cart.")
-    elif code == 'FREESHIP':
-        # Free shipping promo
-        if not cart.has_free_shipping():
-            cart.apply_free_shipping()
-            messages.success(request, "Promo code FREESHIP applied successfully. Free shipping!")
-        else:
-            messages.info(request, "Free shipping is already applied to your cart.")
+    try:
+        rule = cart.apply_promo(code)
+    except PromoError as e:
+        messages.error(request, str(e))
     else:
-        messages.error(request, "Invalid promo code. Please try again.")
+        messages.success(request, f"Promo code {rule.code} applied successfully. {rule.description}")
     
     return redirect('store:cart_detail')
 
 def checkout(request):
     """Checkout process view"""
     cart = Cart(request)
+    idempotency_key = None
+    
+    # A retried submit whose order already went through lands on that order
+    if request.method == 'POST' and request.user.is_authenticated:
+        idempotency_key = clean_idempotency_key(request.POST.get('idempotency_key'))
+        previous_order = get_order_for_key(request.user, idempotency_key)
+        if previous_order:
+            return redirect('store:order_confirmation', order_id=previous_order.id)
     
-    if not cart.items:
+    if not cart:
         messages.warning(request, "Your cart is empty. Please add items before checkout.")
         return redirect('store:product_list')
     
@@ -278,32 +315,31 @@ def checkout(request):
     
     # Process checkout form if submitted
     if request.method == 'POST':
-        # Process the order here (simplified for now)
-        new_order = Order.objects.create(
-            user=request.user,
-            shipping_address=request.POST.get('shipping_address', ''),
-            total_amount=cart.get_total_price(),
-            status='pending'
-        )
-        
-        # Create order items from cart
-        for item in cart.items:
-            new_order.items.create(
-                product=item['product'],
-                price=item['price'],
-                quantity=item['quantity']
+        try:
+            new_order, created = place_order(
+                cart,
+                request.user,
+                shipping_address=request.POST.get('shipping_address', ''),
+                idempotency_key=idempotency_key
             )
+        except InsufficientStock:
+            messages.error(request, "Sorry, some items in your cart are no longer available in the requested quantity.")
+            return redirect('store:cart_detail')
+        except PromoUnavailable as e:
+            cart.remove_promo(e.code)
+            messages.error(request, str(e))
+            return redirect('store:cart_detail')
         
-        # Clear cart after successful order
-        cart.clear()
-        
-        # Show success message and redirect to order confirmation
-        messages.success(request, "Your order has been placed successfully!")
+        if created:
+            # Clear cart after successful order; the holds are already sold
+            cart.clear(release_stock=False)
+            messages.success(request, "Your order has been placed successfully!")
         return redirect('store:order_confirmation', order_id=new_order.id)
     
     return render(request, 'store/checkout.html', {
         'cart': cart,
         'tax_rate': 7.5,  # Could be dynamic based on location
+        'idempotency_key': uuid.uuid4().hex,
     })
 
 def order_confirmation(request, order_id):
@@ -317,7 +353,20 @@ def order_confirmation(request, order_id):
 @login_required
 def my_orders(request):
     """View for users to see their order history"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = Order.objects.filter(
+        user=request.user
+    ).prefetch_related('items__product').order_by('-created_at', '-id')
+    
+    # Pagination with 10 orders per page
+    paginator = Paginator(orders, 10)
+    page = request.GET.get('page')
+    
+    try:
+        orders = paginator.page(page)
+    except PageNotAnInteger:
+        orders = paginator.page(1)
+    except EmptyPage:
+        orders = paginator.page(paginator.num_pages)
     
     return render(request, 'store/my_orders.html', {
         'orders': orders
@@ -380,14 +429,8 @@ def search_products(request):
             
             # Cache results for 15 minutes
             cache.set(cache_key, results, 900)
-            
-            # Store search term for suggestions
-            search_terms = cache.get('popular_searches', [])
-            if query.lower() not in search_terms:
-                search_terms.append(query.lower())
-                search_terms = search_terms[-10:]  # Keep only last 10 searches
-                cache.set('popular_searches', search_terms, 86400)  # Store for 24 hours
         
+        search_stats.tracker.record(query, len(results))
         return JsonResponse({
             'results': results,
             'suggestions': get_search_suggestions(query)
@@ -398,11 +441,10 @@ def get_search_suggestions(query):
     """Get search suggestions based on popular searches and available categories"""
     suggestions = []
     
-    # Get popular searches
-    popular_searches = cache.get('popular_searches', [])
-    if popular_searches:
-        matching_searches = [s for s in popular_searches if query.lower() in s]
-        suggestions.extend(matching_searches[:3])
+    # Get popular searches, most searched first
+    query = search_stats.normalize(query)
+    matching_searches = [s for s, count in search_stats.popular() if query in s]
+    suggestions.extend(matching_searches[:3])
     
     # Add category suggestions
     category_suggestions = Category.objects.filter(